@@ -8,6 +8,7 @@ import type { SyncOptions } from '../types';
 import type { RootState } from '../store/store';
 import { setIsImporting } from '../store/transactions';
 import {
+    useGetImportJobQuery,
     useGetStripeInfoQuery,
     useImportTransactionsMutation,
 } from '../services/api';
@@ -21,6 +22,14 @@ const ImportTransactions = () => {
     );
     const { data: stripeInfo } = useGetStripeInfoQuery();
     const [importTransactions] = useImportTransactionsMutation();
+    const { data: importJob } = useGetImportJobQuery();
+
+    // Show an import that is still running in the background after a reload
+    React.useEffect(() => {
+        if (importJob?.status === 'importing') {
+            dispatch(setIsImporting(true));
+        }
+    }, [importJob, dispatch]);
 
     const handleSubmit = async (options: SyncOptions) => {
         if (!stripeInfo) {
@@ -28,9 +37,12 @@ const ImportTransactions = () => {
             return;
         }
         dispatch(setIsImporting(true));
-        await importTransactions(options);
-
-        dispatch(setIsImporting(false));
+        // The import runs in the background, and reports its progress
+        // over the sync websocket, which clears isImporting when it's done
+        const result = await importTransactions(options);
+        if ('error' in result) {
+            dispatch(setIsImporting(false));
+        }
     };
 
     return (
@@ -52,7 +64,11 @@ const ImportTransactions = () => {
             </Popover.Button>
             <Popover.Panel className="absolute z-10 bg-white p-4 left-0 shadow-lg text-left">
                 <Formik
-                    initialValues={{ from_date: '2023-08-28', to_date: '' }}
+                    initialValues={{
+                        from_date: '2023-08-28',
+                        to_date: '',
+                        full_rescan: false,
+                    }}
                     onSubmit={async (values: SyncOptions) => {
                         await handleSubmit(values);
                     }}
@@ -80,6 +96,22 @@ const ImportTransactions = () => {
                             </label>
                             <Field id="to_date" name="to_date" type="date" />
                         </div>
+                        <div
+                            className="flex justify-between items-center my-2"
+                            title="Check every transaction in the date range, including those already imported"
+                        >
+                            <label
+                                className="font-semibold mx-2"
+                                htmlFor="full_rescan"
+                            >
+                                Full rescan:
+                            </label>
+                            <Field
+                                id="full_rescan"
+                                name="full_rescan"
+                                type="checkbox"
+                            />
+                        </div>
                         <div className="text-center">
                             <Popover.Button
                                 as={SubmitButton}
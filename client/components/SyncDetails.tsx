@@ -60,9 +60,13 @@ const SyncDetails = ({ drawerWidth = 320 }: { drawerWidth: number }) => {
         (state: RootState) => state.transactions.expandedTransactionId
     );
 
-    const { transaction } = useGetTransactionsQuery(undefined, {
+    const transactionQuery = useSelector(
+        (state: RootState) => state.transactions.transactionQuery
+    );
+
+    const { transaction } = useGetTransactionsQuery(transactionQuery, {
         selectFromResult: ({ data }) => ({
-            transaction: data?.find(
+            transaction: data?.transactions.find(
                 (transaction: Transaction) =>
                     transaction.id === expandedTransactionId
             ),
@@ -15,7 +15,11 @@ const SyncTransactions = () => {
     const selectedTransactionIds = useSelector(
         (state: RootState) => state.transactions.selectedTransactionIds
     );
-    const { data: transactions = [] } = useGetTransactionsQuery();
+    const transactionQuery = useSelector(
+        (state: RootState) => state.transactions.transactionQuery
+    );
+    const { data: { transactions } = { transactions: [] } } =
+        useGetTransactionsQuery(transactionQuery);
 
     return (
         <PrimaryButton
@@ -2,6 +2,7 @@ import * as React from 'react';
 import { useDispatch, useSelector } from 'react-redux';
 import { DataGrid } from '@mui/x-data-grid';
 import type {
+    GridPaginationModel,
     GridRowsProp,
     GridColDef,
     GridRenderCellParams,
@@ -15,14 +16,57 @@ import type { Transaction } from '../types';
 import {
     setExpandedTransactionId,
     selectTransactionIds,
+    setTransactionQuery,
 } from '../store/transactions';
-import { useGetTransactionsQuery } from '../services/api';
+import {
+    useGetTransactionsQuery,
+    useGetTransactionCountQuery,
+} from '../services/api';
 import { numToAccountingFormat, snakeCaseToSentence } from '../formatting';
 import SyncStatus from './SyncStatus';
 
 const TransactionTable = () => {
     const dispatch = useDispatch();
-    const { data: transactions = [], isLoading } = useGetTransactionsQuery();
+    const transactionQuery = useSelector(
+        (state: RootState) => state.transactions.transactionQuery
+    );
+    const { data, isFetching } = useGetTransactionsQuery(transactionQuery);
+    const { data: rowCount = 0 } = useGetTransactionCountQuery();
+    const transactions = data?.transactions ?? [];
+
+    // Pages are fetched by cursor, so keep the cursor of each page seen so far
+    const [cursors, setCursors] = React.useState<(string | undefined)[]>([
+        undefined,
+    ]);
+    const [paginationModel, setPaginationModel] =
+        React.useState<GridPaginationModel>({
+            page: 0,
+            pageSize: transactionQuery.limit,
+        });
+
+    const handlePaginationModelChange = (model: GridPaginationModel) => {
+        let page = model.page;
+        let pageCursors = cursors;
+        if (model.pageSize !== paginationModel.pageSize) {
+            page = 0;
+            pageCursors = [undefined];
+        } else if (page > paginationModel.page && data?.next_cursor) {
+            pageCursors = [...cursors.slice(0, page), data.next_cursor];
+        }
+        if (page >= pageCursors.length) {
+            return;
+        }
+
+        setCursors(pageCursors);
+        setPaginationModel({ page, pageSize: model.pageSize });
+        dispatch(
+            setTransactionQuery({
+                cursor: pageCursors[page],
+                limit: model.pageSize,
+            })
+        );
+    };
+
     const selectedTransactionIds = useSelector(
         (state: RootState) => state.transactions.selectedTransactionIds
     );
@@ -102,8 +146,13 @@ const TransactionTable = () => {
                     dispatch(setExpandedTransactionId(params.row.id));
                 }}
                 rows={rows}
-                loading={isLoading}
+                loading={isFetching}
                 columns={columns}
+                paginationMode="server"
+                rowCount={rowCount}
+                paginationModel={paginationModel}
+                onPaginationModelChange={handlePaginationModelChange}
+                keepNonExistentRowsSelected
                 checkboxSelection
                 disableColumnSelector
                 hideFooterSelectedRowCount
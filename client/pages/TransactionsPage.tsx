@@ -1,4 +1,5 @@
 import * as React from 'react';
+import { ArrowUpOnSquareIcon } from '@heroicons/react/24/outline';
 
 import ImportTransactions from '../components/ImportTransactions';
 import SyncDetails from '../components/SyncDetails';
@@ -11,7 +12,17 @@ const TransactionsPage = () => {
     return (
         <div>
             <div className="my-4 flex justify-between">
-                <ImportTransactions />
+                <div>
+                    <ImportTransactions />
+                    <a
+                        className="text-green-800 bg-green-100 hover:bg-green-200 text-semibold text-sm py-2 px-4 rounded-full border border-green-800 mr-4"
+                        href="/api/transaction/export?format=csv"
+                        download
+                    >
+                        <ArrowUpOnSquareIcon className="inline-block mr-1 h-4 w-4 -mt-px" />{' '}
+                        Export CSV
+                    </a>
+                </div>
                 <SyncTransactions />
             </div>
             <div className="flex h-3/4">
@@ -1,5 +1,8 @@
 import { createApi, fetchBaseQuery } from '@reduxjs/toolkit/query/react';
+import { setIsImporting } from '../store/transactions';
+import type { RootState } from '../store/store';
 import type {
+    ImportJob,
     QBOCompanyInfo,
     QBOAccount,
     QBOTaxCode,
@@ -7,6 +10,8 @@ import type {
     Settings,
     StripeInfo,
     Transaction,
+    TransactionPage,
+    TransactionQuery,
     SyncOptions, // TODO: Rename to ImportOptions
     User,
 } from '../types';
@@ -133,12 +138,23 @@ export const api = createApi({
         }),
 
         // transactions
-        getTransactions: builder.query<Transaction[], void>({
-            query: () => `transaction/`,
+        getTransactions: builder.query<TransactionPage, TransactionQuery>({
+            query: ({ cursor, limit }) => {
+                const params = new URLSearchParams({ limit: String(limit) });
+                if (cursor) {
+                    params.set('cursor', cursor);
+                }
+                return `transaction/?${params.toString()}`;
+            },
             providesTags: ['Transaction'],
             async onCacheEntryAdded(
                 _,
-                { updateCachedData, cacheDataLoaded, cacheEntryRemoved }
+                {
+                    updateCachedData,
+                    cacheDataLoaded,
+                    cacheEntryRemoved,
+                    dispatch,
+                }
             ) {
                 const HOST = process.env.HOST;
                 const PROTOCOL = process.env.SSL ? 'wss' : 'ws';
@@ -148,16 +164,30 @@ export const api = createApi({
                     await cacheDataLoaded;
 
                     const listener = (event: { data: string }) => {
+                        const message = JSON.parse(event.data) as
+                            | Transaction
+                            | ImportJob;
+
+                        if ('imported' in message) {
+                            // Import progress: fetch the newly imported page
+                            dispatch(api.util.invalidateTags(['Transaction']));
+                            if (message.status !== 'importing') {
+                                dispatch(setIsImporting(false));
+                            }
+                            return;
+                        }
+
                         // TODO: Validate that the data is a valid Transaction object
-                        const data: Transaction = JSON.parse(
-                            event.data
-                        ) as Transaction;
+                        const data: Transaction = message;
 
                         updateCachedData((draft) => {
-                            const index = draft.findIndex(
+                            const index = draft.transactions.findIndex(
                                 (t: Transaction) => t.id === data.id
                             );
-                            draft[index] = data;
+                            // Transactions on other pages are fetched when shown
+                            if (index !== -1) {
+                                draft.transactions[index] = data;
+                            }
                         });
                     };
                     ws.addEventListener('message', listener);
@@ -168,9 +198,19 @@ export const api = createApi({
                 ws.close();
             },
         }),
-        importTransactions: builder.mutation<string, SyncOptions>({
+        getTransactionCount: builder.query<number, void>({
+            query: () => 'transaction/count',
+            providesTags: ['Transaction'],
+        }),
+        getImportJob: builder.query<ImportJob | null, void>({
+            query: () => 'stripe/transactions/import',
+        }),
+        importTransactions: builder.mutation<ImportJob, SyncOptions>({
             query: (options) => {
-                const queryString = new URLSearchParams(options).toString();
+                const queryString = new URLSearchParams({
+                    ...options,
+                    full_rescan: String(options.full_rescan),
+                }).toString();
 
                 return {
                     url: `stripe/transactions?${queryString}`,
@@ -193,15 +233,15 @@ export const api = createApi({
             },
             async onQueryStarted(
                 transaction_ids,
-                { dispatch, queryFulfilled }
+                { dispatch, getState, queryFulfilled }
             ) {
                 // Optimistically update the status of the transactions to 'syncing'
                 const patchResult = dispatch(
                     api.util.updateQueryData(
                         'getTransactions',
-                        undefined,
-                        (draft: Transaction[]) => {
-                            draft.forEach((t) => {
+                        (getState() as RootState).transactions.transactionQuery,
+                        (draft: TransactionPage) => {
+                            draft.transactions.forEach((t) => {
                                 if (transaction_ids.includes(t.id)) {
                                     Object.assign(t, { status: 'syncing' });
                                 }
@@ -242,6 +282,8 @@ export const {
     useUpdateSettingsMutation,
 
     useGetTransactionsQuery,
+    useGetTransactionCountQuery,
+    useGetImportJobQuery,
     useImportTransactionsMutation,
     useSyncTransactionsMutation,
 } = api;
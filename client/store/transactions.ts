@@ -1,16 +1,20 @@
 import { createSlice } from '@reduxjs/toolkit';
 import type { PayloadAction } from '@reduxjs/toolkit';
 
+import type { TransactionQuery } from '../types';
+
 type transactionState = {
     expandedTransactionId: string | null;
     selectedTransactionIds: string[];
     isImporting: boolean;
+    transactionQuery: TransactionQuery;
 };
 
 const initialState: transactionState = {
     expandedTransactionId: null,
     selectedTransactionIds: [],
     isImporting: false,
+    transactionQuery: { limit: 100 },
 };
 
 export const transactionsSlice = createSlice({
@@ -29,6 +33,12 @@ export const transactionsSlice = createSlice({
         setIsImporting: (state, action: PayloadAction<boolean>) => {
             state.isImporting = action.payload;
         },
+        setTransactionQuery: (
+            state,
+            action: PayloadAction<TransactionQuery>
+        ) => {
+            state.transactionQuery = action.payload;
+        },
     },
 });
 
@@ -36,4 +46,5 @@ export const {
     setExpandedTransactionId,
     setIsImporting,
     selectTransactionIds,
+    setTransactionQuery,
 } = transactionsSlice.actions;
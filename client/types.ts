@@ -58,6 +58,7 @@ export type StripeInfo = {
 export type SyncOptions = {
     from_date: string;
     to_date: string;
+    full_rescan: boolean;
 };
 
 export type Transaction = {
@@ -75,3 +76,24 @@ export type Transaction = {
     payment_id: string | null;
     transfer_id: string | null;
 };
+
+export type TransactionPage = {
+    transactions: Transaction[];
+    next_cursor: string | null;
+};
+
+export type TransactionQuery = {
+    cursor?: string;
+    limit: number;
+};
+
+export type ImportJob = {
+    user_id: number;
+    status: 'importing' | 'done' | 'failed';
+    from_timestamp: number | null;
+    to_timestamp: number | null;
+    starting_after: string | null;
+    imported: number;
+    skipped: number;
+    failure_reason: string | null;
+};
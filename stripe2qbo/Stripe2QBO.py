@@ -1,89 +1,185 @@
+from contextlib import nullcontext
+import asyncio
 import os
+import weakref
 from typing import cast, Dict, Optional
 
 from stripe2qbo.db.models import User
 from stripe2qbo.db.schemas import Settings, TransactionSync
 from stripe2qbo.exceptions import QBOException
+from stripe2qbo.metrics import syncs, track_phase
 from stripe2qbo.qbo.QBO import create_qbo, QBO
 from stripe2qbo.qbo.auth import Token
 import stripe2qbo.qbo.models as qbo_models
 import stripe2qbo.stripe.models as stripe_models
-from stripe2qbo.qbo.check_for_existing import check_for_existing
-from stripe2qbo.sync_helpers import (
-    qbo_invoice_from_stripe_invoice,
-    transfer_from_payout,
-    expense_from_transaction,
-    payment_from_charge,
-)
+from stripe2qbo.qbo.check_for_existing import ExistingIndex, get_existing_index
+from stripe2qbo.sync_helpers import Transformer
 
 
-async def create_stripe2qbo(settings: Settings, qbo_token: Token) -> "Stripe2QBO":
+_syncers: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, Dict[str, "Stripe2QBO"]
+] = weakref.WeakKeyDictionary()
+
+
+async def create_stripe2qbo(
+    settings: Settings, qbo_token: Token, batch: bool = False
+) -> "Stripe2QBO":
+    """Create a syncer for a QBO realm.
+
+    If batch is True, QBO objects created by concurrent syncs are sent
+    together through QBO's /batch endpoint."""
     syncer = Stripe2QBO(settings)
     await syncer.attach_qbo(qbo_token)
+    if batch:
+        syncer._qbo.enable_batching()
+    return syncer
+
+
+async def get_stripe2qbo(
+    settings: Settings, qbo_token: Token, batch: bool = False
+) -> "Stripe2QBO":
+    """Get the syncer for a QBO realm, shared by every sync on this event loop.
+
+    The syncer is replaced when the realm's settings change, after clearing
+    the realm's cached preferences and tax codes. Otherwise it is reused with
+    the latest token, cached preferences and tax codes."""
+    syncers = _syncers.setdefault(asyncio.get_running_loop(), {})
+    syncer = syncers.get(qbo_token.realm_id)
+    if syncer is not None and syncer._settings != settings:
+        # Saving settings only clears the cache of the process that saved
+        # them, unless the cache is shared through Redis
+        await syncer._qbo.invalidate_preferences(
+            {
+                syncer._settings.default_tax_code_id,
+                syncer._settings.exempt_tax_code_id,
+                settings.default_tax_code_id,
+                settings.exempt_tax_code_id,
+            }
+        )
+
+    if (
+        syncer is None
+        or syncer._settings != settings
+        or (syncer._qbo.batch is not None) != batch
+    ):
+        syncer = await create_stripe2qbo(settings, qbo_token, batch=batch)
+        syncers[qbo_token.realm_id] = syncer
+    else:
+        await syncer._qbo.set_token(qbo_token)
+        await syncer.reload_tax_codes()
     return syncer
 
 
 class Stripe2QBO:
+    """Syncs Stripe transactions to one QBO realm.
+
+    Nothing is stored on the syncer during a sync, so concurrent syncs can
+    share it. Syncs creating the same QBO object take a lock first."""
+
     _settings: Settings
     _qbo: QBO
-    _tax_codes: Dict[str, qbo_models.TaxCode | None] = {}
-    _exchange_rate: float = 1.0
-    _currency: qbo_models.QBOCurrency
+    _tax_codes: Dict[str, qbo_models.TaxCode | None]
+    _transformer: Transformer
+    _existing: ExistingIndex
+    _locks: "weakref.WeakValueDictionary[str, asyncio.Lock]"
 
     def __init__(self, settings: Settings) -> None:
         self._settings = settings
+        self._tax_codes = {}
+        self._transformer = Transformer(settings)
+        self._locks = weakref.WeakValueDictionary()
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        """Lock serializing concurrent syncs that touch the same QBO object,
+        so that it isn't created twice"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
 
     async def attach_qbo(self, qbo_token: Token) -> None:
-        self._qbo = await create_qbo(qbo_token)
+        await self.use_qbo(await create_qbo(qbo_token))
+
+    async def use_qbo(self, qbo: QBO) -> None:
+        """Sync to qbo, loading the tax codes in the settings for its realm"""
+        assert qbo.realm_id is not None
+        tax_codes = await self._load_tax_codes(qbo)
+
+        self._qbo = qbo
+        self._existing = get_existing_index(qbo.realm_id)
+        self._set_tax_codes(tax_codes)
+
+    async def reload_tax_codes(self) -> None:
+        """Load the tax codes again, in case the realm's preferences or tax
+        codes changed since they were loaded.
+
+        They come from the cache, so this only asks QBO once they expire
+        or are invalidated."""
+        self._set_tax_codes(await self._load_tax_codes(self._qbo))
 
-        if self._qbo.using_sales_tax:
-            self._tax_codes[self._settings.default_tax_code_id] = (
-                await self._qbo.get_tax_code(self._settings.default_tax_code_id)
-                if self._settings.default_tax_code_id != "TAX"
-                else None
+    async def _load_tax_codes(self, qbo: QBO) -> Dict[str, qbo_models.TaxCode | None]:
+        tax_codes: Dict[str, qbo_models.TaxCode | None] = {}
+        if qbo.using_sales_tax:
+            default_id = self._settings.default_tax_code_id
+            exempt_id = self._settings.exempt_tax_code_id
+            tax_codes[default_id] = (
+                await qbo.get_tax_code(default_id) if default_id != "TAX" else None
             )
-            self._tax_codes[self._settings.exempt_tax_code_id] = (
-                await self._qbo.get_tax_code(self._settings.exempt_tax_code_id)
-                if self._settings.exempt_tax_code_id != "NON"
-                else None
+            tax_codes[exempt_id] = (
+                await qbo.get_tax_code(exempt_id) if exempt_id != "NON" else None
             )
-        return None
+        return tax_codes
+
+    def _set_tax_codes(self, tax_codes: Dict[str, qbo_models.TaxCode | None]) -> None:
+        # Replaced rather than updated, so concurrent syncs keep a consistent
+        # transformer
+        if tax_codes != self._tax_codes:
+            self._tax_codes = tax_codes
+            self._transformer = Transformer(self._settings, tax_codes)
 
     async def sync_invoice(
-        self, stripe_invoice: stripe_models.Invoice, qbo_customer: qbo_models.Customer
+        self,
+        stripe_invoice: stripe_models.Invoice,
+        qbo_customer: qbo_models.Customer,
+        exchange_rate: float = 1.0,
     ):
-        invoice_id = await check_for_existing(
-            "Invoice",
-            qbo_customer_id=qbo_customer.Id,
-            private_note=stripe_invoice.id,
-            qbo=self._qbo,
-        )
+        async with self._lock(f"invoice:{stripe_invoice.id}"):
+            return await self._sync_invoice(
+                stripe_invoice, qbo_customer, exchange_rate=exchange_rate
+            )
+
+    async def _sync_invoice(
+        self,
+        stripe_invoice: stripe_models.Invoice,
+        qbo_customer: qbo_models.Customer,
+        exchange_rate: float = 1.0,
+    ):
+        invoice_id = await self._existing.find(self._qbo, "Invoice", stripe_invoice.id)
         if invoice_id:
             return invoice_id
 
-        qbo_invoice = qbo_invoice_from_stripe_invoice(
-            stripe_invoice,
-            qbo_customer.Id,
-            self._tax_codes,
-            self._settings,
-            exchange_rate=self._exchange_rate,
+        qbo_invoice = self._transformer.invoice(
+            stripe_invoice, qbo_customer.Id, exchange_rate=exchange_rate
         )
 
         for line in qbo_invoice.Line:
             product = line.SalesItemLineDetail.ItemRef
             if product.value is None and product.name is not None:
-                income_account_id = await self._qbo.get_or_create_account(
-                    product.name, "Income"
-                )
-                line.SalesItemLineDetail.ItemRef = cast(
-                    qbo_models.ProductItemRef,
-                    await self._qbo.get_or_create_item(
-                        product.name,
-                        income_account_id,
-                    ),
-                )
+                async with self._lock(f"item:{product.name}"):
+                    income_account_id = await self._qbo.get_or_create_account(
+                        product.name, "Income"
+                    )
+                    line.SalesItemLineDetail.ItemRef = cast(
+                        qbo_models.ProductItemRef,
+                        await self._qbo.get_or_create_item(
+                            product.name,
+                            income_account_id,
+                        ),
+                    )
 
         invoice_id = await self._qbo.create_invoice(qbo_invoice)
+        self._existing.add("Invoice", stripe_invoice.id, invoice_id)
         return invoice_id
 
     async def sync_charge(
@@ -91,59 +187,61 @@ class Stripe2QBO:
         stripe_charge: stripe_models.Charge,
         qbo_customer: qbo_models.Customer,
         qbo_invoice_id: Optional[str] = None,
+        exchange_rate: float = 1.0,
     ) -> str:
         """Create a QBO Payment for a Stripe Charge"""
-        payment_id = await check_for_existing(
-            "Payment",
-            qbo_customer_id=qbo_customer.Id,
-            private_note=stripe_charge.id,
-            qbo=self._qbo,
-        )
+        payment_id = await self._existing.find(self._qbo, "Payment", stripe_charge.id)
         if payment_id:
             return payment_id
 
-        payment = payment_from_charge(
+        payment = self._transformer.payment(
             stripe_charge,
             qbo_customer.Id,
-            self._settings,
             invoice_id=qbo_invoice_id,
-            exchange_rate=self._exchange_rate,
+            exchange_rate=exchange_rate,
         )
         payment_id = await self._qbo.create_payment(payment)
+        self._existing.add("Payment", stripe_charge.id, payment_id)
         return payment_id
 
     async def sync_stripe_fee(self, transaction: stripe_models.Transaction) -> str:
         """Create a QBO Expense for a Stripe Transaction"""
-        expense_id = await check_for_existing(
-            "Purchase",
-            private_note=transaction.id,
-            qbo=self._qbo,
-        )
+        expense_id = await self._existing.find(self._qbo, "Purchase", transaction.id)
         if expense_id:
             return expense_id
 
-        expense = expense_from_transaction(
-            transaction,
-            self._settings,
-        )
+        expense = self._transformer.expense(transaction)
         expense_id = await self._qbo.create_expense(expense)
+        self._existing.add("Purchase", transaction.id, expense_id)
         return expense_id
 
     async def sync_payout(self, payout: stripe_models.Payout) -> str:
         """Create a QBO Transfer for a Stripe Payout"""
-        transfer_id = await check_for_existing(
-            "Transfer", private_note=payout.id, qbo=self._qbo
-        )
+        transfer_id = await self._existing.find(self._qbo, "Transfer", payout.id)
         if transfer_id:
             return transfer_id
 
-        transfer = transfer_from_payout(payout, self._settings)
+        transfer = self._transformer.transfer(payout)
         transfer_id = await self._qbo.create_transfer(transfer)
+        self._existing.add("Transfer", payout.id, transfer_id)
         return transfer_id
 
     async def sync(
         self, transaction: stripe_models.Transaction, user: User
     ) -> TransactionSync:
+        realm = str(self._qbo.realm_id)
+        batch = self._qbo.batch
+        with track_phase("total", realm), batch.caller() if batch else nullcontext():
+            sync_status = await self._sync(transaction, user)
+        syncs.labels(
+            realm=realm, type=transaction.type, status=sync_status.status
+        ).inc()
+        return sync_status
+
+    async def _sync(
+        self, transaction: stripe_models.Transaction, user: User
+    ) -> TransactionSync:
+        realm = str(self._qbo.realm_id)
         currency = cast(qbo_models.QBOCurrency, transaction.currency.upper())
         stripe_user_id = os.getenv("STRIPE_ACCOUNT_ID", user.stripe_user_id)
 
@@ -159,7 +257,7 @@ class Stripe2QBO:
             # Would need to ensure QBO has corresponding bank accounts
 
             # date_string = _transfrom_timestamp(transaction.created)
-            # self._exchange_rate = self._qbo.get_exchange_rate(currency, date_string)
+            # exchange_rate = self._qbo.get_exchange_rate(currency, date_string)
             sync_status.status = "failed"
             sync_status.failure_reason = (
                 f"Transaction currency ({currency})"
@@ -167,7 +265,7 @@ class Stripe2QBO:
             )
             return sync_status
         else:
-            self._exchange_rate = transaction.exchange_rate or 1.0
+            exchange_rate = transaction.exchange_rate or 1.0
 
         if transaction.type not in ["charge", "payout", "stripe_fee", "payment"]:
             sync_status.status = "failed"
@@ -179,36 +277,53 @@ class Stripe2QBO:
         try:
             if transaction.type == "stripe_fee":
                 sync_status.status = "success"
-                sync_status.expense_id = await self.sync_stripe_fee(transaction)
+                with track_phase("expense", realm):
+                    sync_status.expense_id = await self.sync_stripe_fee(transaction)
                 return sync_status
 
             if transaction.customer:
                 assert transaction.charge is not None
-                charge_currency = cast(
+                customer_name = transaction.customer.name or transaction.customer.id
+                customer_currency = cast(
                     qbo_models.QBOCurrency, transaction.charge.currency.upper()
                 )
-                qbo_customer = await self._qbo.get_or_create_customer(
-                    transaction.customer.name or transaction.customer.id,
-                    charge_currency,
-                )
             else:
-                qbo_customer = await self._qbo.get_or_create_customer(
-                    "Stripe customer", currency
-                )
+                customer_name = "Stripe customer"
+                customer_currency = currency
+
+            # Only while the customer is found or created, so that syncs for
+            # the same customer still create their invoices and payments
+            # concurrently, and can share a batch
+            async with self._lock(f"customer:{customer_name}"):
+                with track_phase("customer", realm):
+                    qbo_customer = await self._qbo.get_or_create_customer(
+                        customer_name, customer_currency
+                    )
 
             if transaction.invoice:
-                sync_status.invoice_id = await self.sync_invoice(
-                    transaction.invoice, qbo_customer
-                )
+                with track_phase("invoice", realm):
+                    sync_status.invoice_id = await self.sync_invoice(
+                        transaction.invoice,
+                        qbo_customer,
+                        exchange_rate=exchange_rate,
+                    )
 
             if transaction.charge:
-                sync_status.payment_id = await self.sync_charge(
-                    transaction.charge, qbo_customer, sync_status.invoice_id
-                )
-                sync_status.expense_id = await self.sync_stripe_fee(transaction)
+                with track_phase("payment", realm):
+                    sync_status.payment_id = await self.sync_charge(
+                        transaction.charge,
+                        qbo_customer,
+                        sync_status.invoice_id,
+                        exchange_rate=exchange_rate,
+                    )
+
+            if transaction.charge:
+                with track_phase("expense", realm):
+                    sync_status.expense_id = await self.sync_stripe_fee(transaction)
 
             if transaction.payout:
-                sync_status.transfer_id = await self.sync_payout(transaction.payout)
+                with track_phase("transfer", realm):
+                    sync_status.transfer_id = await self.sync_payout(transaction.payout)
         except QBOException as e:
             sync_status.status = "failed"
             sync_status.failure_reason = str(e)
@@ -1,16 +1,21 @@
+from contextlib import asynccontextmanager
 from typing import Annotated
+import hmac
 import os
 
 from sqlalchemy.orm import Session
-from fastapi import Depends, FastAPI, HTTPException, Response
+from fastapi import Depends, FastAPI, Header, HTTPException, Response
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 
+from stripe2qbo import metrics
 from stripe2qbo.api.dependencies import get_db
+from stripe2qbo.cache import close_cache
 from stripe2qbo.api.routers import (
     qbo,
+    schedule,
     stripe_router,
     transaction_router,
     settings,
@@ -18,6 +23,8 @@ from stripe2qbo.api.routers import (
 )
 from stripe2qbo.db.models import User as UserORM
 from stripe2qbo.db.schemas import User
+from stripe2qbo.qbo import qbo_request
+from stripe2qbo.stripe import stripe_request
 from stripe2qbo.api.auth import (
     authenticate_user,
     create_access_token,
@@ -27,7 +34,20 @@ from stripe2qbo.api.auth import (
 
 load_dotenv()
 
-app = FastAPI()
+# Required by /metrics as an "Authorization: Bearer <METRICS_TOKEN>" header.
+# /metrics isn't served if it isn't set, since labels include realm and account ids.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await qbo_request.close_client()
+    await stripe_request.close_client()
+    await close_cache()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 if not os.path.exists("static"):
@@ -39,6 +59,7 @@ app.include_router(stripe_router.router, prefix="/api")
 app.include_router(transaction_router.router, prefix="/api")
 app.include_router(sync.router, prefix="/api")
 app.include_router(settings.router, prefix="/api")
+app.include_router(schedule.router, prefix="/api")
 
 
 @app.post("/api/token")
@@ -103,6 +124,15 @@ def user_id(user: Annotated[UserORM, Depends(get_current_user_from_token)]) -> U
     return User.model_validate(user, from_attributes=True)
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics(authorization: Annotated[str | None, Header()] = None) -> Response:
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.collect(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/{path:path}")
 def catch_all(path: str) -> HTMLResponse:
     return HTMLResponse(
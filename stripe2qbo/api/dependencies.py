@@ -9,6 +9,7 @@ from stripe2qbo.api.auth import get_current_user_from_token
 from stripe2qbo.db.database import SessionLocal
 from stripe2qbo.db.models import User, QBOToken
 from stripe2qbo.qbo.auth import Token, refresh_auth_token
+from stripe2qbo.qbo.QBO import QBO
 
 
 def get_db():
@@ -44,6 +45,12 @@ def get_qbo_token(
     return Token.model_validate(token, from_attributes=True)
 
 
+def get_qbo(token: Annotated[Token, Depends(get_qbo_token)]) -> QBO:
+    qbo = QBO()
+    qbo.set_credentials(token)
+    return qbo
+
+
 def get_stripe_user_id(
     user: Annotated[User, Depends(get_current_user_from_token)]
 ) -> str:
@@ -1,16 +1,19 @@
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Optional
 
 from sqlalchemy.orm import Session
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
-from stripe2qbo.qbo.models import CompanyInfo
+from stripe2qbo.qbo.models import Account, CompanyInfo, TaxCodeInfo, Vendor
+from stripe2qbo.qbo.QBO import QBO
 from stripe2qbo.qbo.qbo_request import qbo_request
 from stripe2qbo.qbo.auth import (
     Token,
     generate_auth_token,
     get_auth_url,
 )
-from stripe2qbo.api.dependencies import get_db, get_qbo_token
+from stripe2qbo.api.dependencies import get_db, get_qbo, get_qbo_token
 from stripe2qbo.db.models import User, QBOToken
 from stripe2qbo.api.auth import get_current_user_from_token
 
@@ -20,6 +23,29 @@ router = APIRouter(
 )
 
 
+async def _stream_json_list(items: AsyncIterator[BaseModel]) -> StreamingResponse:
+    """Stream the items as a JSON list, page by page.
+
+    The first page is fetched before responding, so that QBO errors
+    are still returned with an error status."""
+    try:
+        first: Optional[BaseModel] = await anext(items)
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error making request: {e}")
+
+    async def content() -> AsyncIterator[str]:
+        yield "["
+        if first is not None:
+            yield first.model_dump_json()
+            async for item in items:
+                yield "," + item.model_dump_json()
+        yield "]"
+
+    return StreamingResponse(content(), media_type="application/json")
+
+
 @router.get("/oauth2")
 def qbo_uth_url() -> str:
     return get_auth_url()
@@ -81,43 +107,16 @@ async def get_qbo_info(token: Annotated[Token, Depends(get_qbo_token)]) -> Compa
     return CompanyInfo(**response.json()["CompanyInfo"])
 
 
-@router.get("/accounts")
-async def get_qbo_accounts(token: Annotated[Token, Depends(get_qbo_token)]):
-    try:
-        response = await qbo_request(
-            "/query?query=select * from Account MAXRESULTS 1000",
-            access_token=token.access_token,
-            realm_id=token.realm_id,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error making request: {e}")
-
-    return response.json()["QueryResponse"].get("Account", [])
-
-
-@router.get("/vendors")
-async def get_qbo_vendors(token: Annotated[Token, Depends(get_qbo_token)]):
-    try:
-        response = await qbo_request(
-            "/query?query=select * from Vendor MAXRESULTS 1000",
-            access_token=token.access_token,
-            realm_id=token.realm_id,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error making request: {e}")
+@router.get("/accounts", response_model=list[Account])
+async def get_qbo_accounts(qbo: Annotated[QBO, Depends(get_qbo)]):
+    return await _stream_json_list(qbo.iter_query("Account", Account))
 
-    return response.json()["QueryResponse"].get("Vendor", [])
 
+@router.get("/vendors", response_model=list[Vendor])
+async def get_qbo_vendors(qbo: Annotated[QBO, Depends(get_qbo)]):
+    return await _stream_json_list(qbo.iter_query("Vendor", Vendor))
 
-@router.get("/taxcodes")
-async def get_qbo_taxcodes(token: Annotated[Token, Depends(get_qbo_token)]):
-    try:
-        response = await qbo_request(
-            "/query?query=select * from TaxCode MAXRESULTS 1000",
-            access_token=token.access_token,
-            realm_id=token.realm_id,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error making request: {e}")
 
-    return response.json()["QueryResponse"].get("TaxCode", [])
+@router.get("/taxcodes", response_model=list[TaxCodeInfo])
+async def get_qbo_taxcodes(qbo: Annotated[QBO, Depends(get_qbo)]):
+    return await _stream_json_list(qbo.iter_query("TaxCode", TaxCodeInfo))
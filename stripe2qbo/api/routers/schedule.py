@@ -0,0 +1,71 @@
+from typing import Annotated, Optional
+import time
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from stripe2qbo.api.auth import get_current_user_from_token
+from stripe2qbo.api.dependencies import get_db, get_stripe_user_id
+from stripe2qbo.db.models import ImportWatermark
+from stripe2qbo.db.models import SyncSchedule as SyncScheduleORM
+from stripe2qbo.db.models import User
+from stripe2qbo.db.schemas import SyncSchedule
+from stripe2qbo.workers.sync_worker import next_scheduled_run
+
+router = APIRouter(
+    prefix="/schedule",
+    tags=["schedule"],
+)
+
+
+@router.get("")
+def get_schedule(
+    user: Annotated[User, Depends(get_current_user_from_token)],
+    db: Annotated[Session, Depends(get_db)],
+) -> Optional[SyncSchedule]:
+    schedule = db.get(SyncScheduleORM, user.id)
+    return SyncSchedule.model_validate(schedule) if schedule is not None else None
+
+
+@router.put("")
+def save_schedule(
+    schedule: SyncSchedule,
+    user: Annotated[User, Depends(get_current_user_from_token)],
+    stripe_user_id: Annotated[str, Depends(get_stripe_user_id)],
+    db: Annotated[Session, Depends(get_db)],
+) -> SyncSchedule:
+    """Import and sync new transactions every interval_minutes.
+
+    Transactions are imported from the Stripe account's watermark, so
+    from_timestamp is required if none were imported yet. Otherwise, the
+    first run would import and sync the account's whole history."""
+    if (
+        schedule.from_timestamp is None
+        and db.get(ImportWatermark, stripe_user_id) is None
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="Import transactions first, or set from_timestamp",
+        )
+
+    next_run_at = next_scheduled_run(
+        user.id, schedule.interval_minutes, int(time.time())
+    )
+    saved = db.get(SyncScheduleORM, user.id)
+    if saved is None:
+        saved = SyncScheduleORM(user_id=user.id)
+        db.add(saved)
+    saved.interval_minutes = schedule.interval_minutes
+    saved.from_timestamp = schedule.from_timestamp
+    saved.next_run_at = next_run_at
+    db.commit()
+    return SyncSchedule.model_validate(saved)
+
+
+@router.delete("")
+def delete_schedule(
+    user: Annotated[User, Depends(get_current_user_from_token)],
+    db: Annotated[Session, Depends(get_db)],
+) -> None:
+    db.query(SyncScheduleORM).filter(SyncScheduleORM.user_id == user.id).delete()
+    db.commit()
@@ -1,14 +1,16 @@
 from typing import Optional, Annotated
 
+import anyio
 from fastapi import Depends, APIRouter
 from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
-from stripe2qbo.api.dependencies import get_db, get_qbo_token
+from stripe2qbo.api.dependencies import get_db, get_qbo, get_qbo_token
 
 from stripe2qbo.db.models import SyncSettings
 from stripe2qbo.db.schemas import Settings
 from stripe2qbo.qbo.auth import Token
+from stripe2qbo.qbo.QBO import QBO
 
 router = APIRouter(
     prefix="/settings",
@@ -34,10 +36,20 @@ def save_settings(
     settings: Settings,
     token: Annotated[Token, Depends(get_qbo_token)],
     db: Annotated[Session, Depends(get_db)],
+    qbo: Annotated[QBO, Depends(get_qbo)],
 ) -> None:
     realm_id = token.realm_id
     query = select(SyncSettings).where(SyncSettings.qbo_realm_id == realm_id)
     sync_settings = db.execute(query).scalar_one_or_none()
+
+    # Syncs cache the realm's preferences and the tax codes they use
+    tax_code_ids = {settings.default_tax_code_id, settings.exempt_tax_code_id}
+    if sync_settings is not None:
+        tax_code_ids |= {
+            sync_settings.default_tax_code_id,
+            sync_settings.exempt_tax_code_id,
+        }
+
     if sync_settings is None:
         sync_settings = SyncSettings(qbo_realm_id=realm_id, **settings.model_dump())
         db.add(sync_settings)
@@ -49,3 +61,7 @@ def save_settings(
         )
         db.execute(update_query)
     db.commit()
+
+    # Workers clear their own cache when they see the new settings,
+    # in case it isn't shared with this process through Redis
+    anyio.from_thread.run(qbo.invalidate_preferences, tax_code_ids)
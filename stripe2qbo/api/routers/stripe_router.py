@@ -1,9 +1,11 @@
 import os
+import time
 from datetime import datetime
 from typing import Annotated, Optional
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 import stripe
 from dotenv import load_dotenv
 from stripe2qbo.api.auth import get_current_user_from_token
@@ -13,16 +15,29 @@ from stripe2qbo.stripe.auth import (
     get_auth_url,
 )
 from stripe2qbo.stripe.models import Account
-from stripe2qbo.stripe.stripe_transactions import get_transactions
-from stripe2qbo.db.schemas import TransactionSync
+from stripe2qbo.db.schemas import ImportJob
 from stripe2qbo.api.dependencies import get_db, get_stripe_user_id
 from stripe2qbo.db.models import User
-from stripe2qbo.db.models import TransactionSync as TransactionSyncORM
+from stripe2qbo.db.models import ImportJob as ImportJobORM
+from stripe2qbo.db.models import StripeEvent
+from stripe2qbo.db.watermark import incremental_from_timestamp
+from stripe2qbo.workers.sync_worker import (
+    import_new_transactions_worker,
+    import_transactions_worker,
+    start_import_job,
+)
 
 load_dotenv()
 
 stripe.api_key = os.getenv("STRIPE_API_KEY")
 
+# Signing secret of the webhook endpoint, found in Stripe's webhook settings
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+
+# Events that import new transactions. Charges and payouts name their balance
+# transaction, balance.available imports every transaction newer than the last.
+WEBHOOK_EVENTS = ["balance.available", "charge.succeeded", "payout.paid"]
+
 router = APIRouter(
     prefix="/stripe",
     tags=["stripe"],
@@ -76,44 +91,109 @@ def get_stripe_transactions(
     db: Annotated[Session, Depends(get_db)],
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
-) -> str:
+    full_rescan: bool = False,
+) -> ImportJob:
+    """Start importing Stripe transactions in the background.
+
+    Unless full_rescan is set, skips the transactions older than the newest
+    one already imported from the account, if every transaction since
+    from_date was imported before it.
+
+    An unfinished import for the same dates resumes from its last page.
+    While an import is running, it is returned instead of starting another."""
     from_timestamp = (
         int(datetime.strptime(from_date, "%Y-%m-%d").timestamp()) if from_date else None
     )
+    if not full_rescan:
+        from_timestamp = incremental_from_timestamp(db, stripe_user_id, from_timestamp)
     to_timestamp = (
         int(datetime.strptime(to_date, "%Y-%m-%d").timestamp()) if to_date else None
     )
 
-    transactions = []
-    starting_after: str | None = None
-    while True:
-        txns = get_transactions(
-            stripe_user_id,
-            from_timestamp=from_timestamp,
-            to_timestamp=to_timestamp,
-            starting_after=starting_after,
+    job, started = start_import_job(db, user.id, from_timestamp, to_timestamp)
+    if not started:
+        return ImportJob.model_validate(job)
+
+    try:
+        import_transactions_worker.delay(user.id)
+    except Exception as e:
+        job.status = "failed"
+        job.failure_reason = str(e)
+        db.commit()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return ImportJob.model_validate(job)
+
+
+@router.get("/transactions/import")
+def get_import_job(
+    user: Annotated[User, Depends(get_current_user_from_token)],
+    db: Annotated[Session, Depends(get_db)],
+) -> Optional[ImportJob]:
+    job = db.get(ImportJobORM, user.id)
+    return ImportJob.model_validate(job) if job is not None else None
+
+
+async def get_body(request: Request) -> bytes:
+    """Raw request body, read on the event loop for sync routes"""
+    return await request.body()
+
+
+@router.post("/webhook")
+def stripe_webhook(
+    body: Annotated[bytes, Depends(get_body)],
+    db: Annotated[Session, Depends(get_db)],
+    stripe_signature: Annotated[str | None, Header()] = None,
+) -> str:
+    """Import the transactions of Stripe events as they happen.
+
+    Each event is handled once, even if Stripe sends it again, unless
+    its import failed."""
+    if STRIPE_WEBHOOK_SECRET is None:
+        raise HTTPException(status_code=503, detail="Webhooks are not configured")
+
+    try:
+        event = stripe.Webhook.construct_event(
+            body, stripe_signature or "", STRIPE_WEBHOOK_SECRET
         )
-        transactions.extend(txns)
-
-        for txn in txns:
-            t = TransactionSync(
-                stripe_id=stripe_user_id,
-                user_id=user.id,
-                status="pending",
-                **txn.model_dump()
-            )
-            is_imported = (
-                db.query(TransactionSyncORM)
-                .where(TransactionSyncORM.id == t.id)
-                .first()
-                is not None
+    except (ValueError, stripe.error.SignatureVerificationError):
+        raise HTTPException(status_code=400, detail="Invalid signature")
+
+    if event.type not in WEBHOOK_EVENTS:
+        return "ignored"
+
+    account_id = event.get("account") or os.getenv("STRIPE_ACCOUNT_ID")
+    users = db.query(User).filter(User.stripe_user_id == account_id).all()
+    if account_id is None or len(users) == 0:
+        return "ignored"
+
+    db.add(
+        StripeEvent(
+            id=event.id,
+            type=event.type,
+            account_id=account_id,
+            received_at=int(time.time()),
+        )
+    )
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return "duplicate"
+
+    transaction_id = None
+    if event.type != "balance.available":
+        transaction_id = event.data.object.get("balance_transaction")
+
+    try:
+        for user in users:
+            import_new_transactions_worker.delay(
+                user.id, [transaction_id] if transaction_id else None, event.id
             )
-            if not is_imported:
-                db.add(TransactionSyncORM(**t.model_dump()))
-
+    except Exception as e:
+        # Let Stripe send the event again
+        db.query(StripeEvent).filter(StripeEvent.id == event.id).delete()
         db.commit()
-        if len(txns) < 100:
-            break
-        starting_after = txns[-1].id
+        raise HTTPException(status_code=500, detail=str(e))
 
-    return "Done"  # TODO: import summary
+    return "ok"
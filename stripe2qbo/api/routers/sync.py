@@ -3,6 +3,7 @@ import hashlib
 import hmac
 import os
 
+from pydantic import BaseModel
 from fastapi import (
     APIRouter,
     Depends,
@@ -16,11 +17,10 @@ from fastapi import (
 from sqlalchemy.orm import Session
 from stripe2qbo.api.auth import get_current_user_from_token
 
-from stripe2qbo.workers.sync_worker import sync_transaction_worker
+from stripe2qbo.workers.sync_worker import dispatch_sync
 from stripe2qbo.db.models import User
-from stripe2qbo.db.schemas import TransactionSync
+from stripe2qbo.db.schemas import ImportJob, TransactionSync
 from stripe2qbo.api.dependencies import get_db
-from stripe2qbo.db.models import TransactionSync as TransactionSyncORM
 
 router = APIRouter(
     tags=["sync"],
@@ -40,12 +40,12 @@ class WebSocketManager:
         del connections[user_id]
         self._clients = connections
 
-    async def send_message(self, user_id: int, transaction: TransactionSync):
+    async def send_message(self, user_id: int, message: BaseModel):
         connection = self._clients.get(user_id)
         if connection is None:
             return
         try:
-            await connection.send_json(transaction.model_dump())
+            await connection.send_json(message.model_dump())
         except WebSocketException:
             self.unregister(user_id)
 
@@ -73,29 +73,44 @@ async def websocket_endpoint(
             break
 
 
-@router.post("/notify")
-async def notify(
-    user_id: int,
-    transaction: TransactionSync,
-    X_Signature: Annotated[str | None, Header()] = None,
-):
-    """Notify the client of a transaction sync status change.
-    This is called by the worker and should not callable by an end user"""
-    if X_Signature is None:
+def _check_signature(body: BaseModel, signature: str | None) -> None:
+    if signature is None:
         raise HTTPException(status_code=401, detail="Missing signature")
 
     sig = hmac.new(
         os.environ["SECRET_KEY"].encode(),
-        transaction.model_dump_json().encode(),
+        body.model_dump_json().encode(),
         hashlib.sha256,
     ).hexdigest()
 
-    if sig != X_Signature:
+    if sig != signature:
         raise HTTPException(status_code=401, detail="Invalid signature")
 
+
+@router.post("/notify")
+async def notify(
+    user_id: int,
+    transaction: TransactionSync,
+    X_Signature: Annotated[str | None, Header()] = None,
+):
+    """Notify the client of a transaction sync status change.
+    This is called by the worker and should not callable by an end user"""
+    _check_signature(transaction, X_Signature)
     await manager.send_message(user_id, transaction)
 
 
+@router.post("/notify/import")
+async def notify_import(
+    user_id: int,
+    import_job: ImportJob,
+    X_Signature: Annotated[str | None, Header()] = None,
+):
+    """Notify the client of a Stripe import's progress.
+    This is called by the worker and should not callable by an end user"""
+    _check_signature(import_job, X_Signature)
+    await manager.send_message(user_id, import_job)
+
+
 @router.post("")
 async def sync(
     transaction_ids: Annotated[List[str], Query()],
@@ -103,15 +118,8 @@ async def sync(
     db: Annotated[Session, Depends(get_db)],
 ) -> str:
     try:
-        sync_transaction_worker.starmap(
-            map(lambda x: (x, user.id), transaction_ids)
-        ).delay()
+        dispatch_sync(db, user.id, transaction_ids)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    db.query(TransactionSyncORM).filter(
-        TransactionSyncORM.id.in_(transaction_ids)
-    ).update({"status": "syncing"})
-    db.commit()
-
     return "ok"
@@ -1,13 +1,25 @@
-from typing import Annotated, List
+from datetime import datetime, timedelta
+from typing import Annotated, Iterator, List, Literal, Optional, Tuple
+import csv
+import io
+import json
 
+from sqlalchemy import ColumnElement, Result, func, literal, select, tuple_
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from stripe2qbo.api.auth import get_current_user_from_token
 
 from stripe2qbo.api.dependencies import get_db
 from stripe2qbo.db.models import User, TransactionSync as TransactionSyncORM
 
-from stripe2qbo.db.schemas import TransactionSync
+from stripe2qbo.db.schemas import TransactionPage, TransactionSync
+
+MAX_PAGE_SIZE = 1000
+
+# Rows fetched from the database at a time by the export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = list(TransactionSync.model_fields)
 
 router = APIRouter(
     prefix="/transaction",
@@ -15,18 +27,143 @@ router = APIRouter(
 )
 
 
+def _to_timestamp(date: str, days: int = 0) -> int:
+    """Timestamp of midnight at the start of date, plus the given days"""
+    try:
+        start = datetime.strptime(date, "%Y-%m-%d")
+        return int((start + timedelta(days=days)).timestamp())
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {date}")
+
+
+def _encode_cursor(transaction: TransactionSyncORM) -> str:
+    return f"{transaction.created}:{transaction.id}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[int, str]:
+    created, _, id = cursor.partition(":")
+    if not created.isdigit() or id == "":
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return int(created), id
+
+
+def transaction_filters(
+    user: Annotated[User, Depends(get_current_user_from_token)],
+    status: Optional[Literal["pending", "success", "syncing", "failed"]] = None,
+    transaction_type: Annotated[Optional[str], Query(alias="type")] = None,
+    currency: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+) -> List[ColumnElement[bool]]:
+    """Filters for the user's transactions, shared by the listing routes"""
+    filters = [TransactionSyncORM.user_id == user.id]
+    if status is not None:
+        filters.append(TransactionSyncORM.status == status)
+    if transaction_type is not None:
+        filters.append(TransactionSyncORM.type == transaction_type)
+    if currency is not None:
+        filters.append(TransactionSyncORM.currency == currency.lower())
+    if from_date is not None:
+        filters.append(TransactionSyncORM.created >= _to_timestamp(from_date))
+    if to_date is not None:
+        # Up to the end of to_date, included
+        filters.append(TransactionSyncORM.created < _to_timestamp(to_date, days=1))
+    return filters
+
+
 @router.get("/")
 def get_all_transactions(
-    user: Annotated[User, Depends(get_current_user_from_token)],
+    filters: Annotated[List[ColumnElement[bool]], Depends(transaction_filters)],
     db: Annotated[Session, Depends(get_db)],
-) -> List[TransactionSync]:
-    transactions = (
-        db.query(TransactionSyncORM).filter(TransactionSyncORM.user_id == user.id).all()
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = 100,
+    order: Literal["asc", "desc"] = "desc",
+) -> TransactionPage:
+    """Get a page of the user's transactions, ordered by created date.
+
+    Pages are keyed by the last transaction of the previous page, so each one
+    costs the same no matter how deep into the list it is."""
+    query = db.query(TransactionSyncORM).filter(*filters)
+
+    key = tuple_(TransactionSyncORM.created, TransactionSyncORM.id)
+    if cursor is not None:
+        created, id = _decode_cursor(cursor)
+        after = tuple_(literal(created), literal(id))
+        query = query.filter(key < after if order == "desc" else key > after)
+
+    if order == "desc":
+        query = query.order_by(
+            TransactionSyncORM.created.desc(), TransactionSyncORM.id.desc()
+        )
+    else:
+        query = query.order_by(TransactionSyncORM.created, TransactionSyncORM.id)
+
+    transactions = query.limit(limit + 1).all()
+    has_more = len(transactions) > limit
+    transactions = transactions[:limit]
+
+    return TransactionPage(
+        transactions=[
+            TransactionSync.model_validate(tsx, from_attributes=True)
+            for tsx in transactions
+        ],
+        next_cursor=_encode_cursor(transactions[-1]) if has_more else None,
+    )
+
+
+@router.get("/count")
+def get_transaction_count(
+    filters: Annotated[List[ColumnElement[bool]], Depends(transaction_filters)],
+    db: Annotated[Session, Depends(get_db)],
+) -> int:
+    return db.query(func.count(TransactionSyncORM.id)).filter(*filters).scalar()
+
+
+def _export_csv(result: Result) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+
+    for rows in result.partitions():
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def _export_ndjson(result: Result) -> Iterator[str]:
+    for rows in result.partitions():
+        yield "".join(json.dumps(row._asdict()) + "\n" for row in rows)
+
+
+@router.get("/export")
+def export_transactions(
+    filters: Annotated[List[ColumnElement[bool]], Depends(transaction_filters)],
+    db: Annotated[Session, Depends(get_db)],
+    format: Literal["csv", "ndjson"] = "csv",
+) -> StreamingResponse:
+    """Download the user's transactions, including their QBO ids.
+
+    Rows are streamed from a server-side cursor as they are written,
+    so memory use doesn't grow with the number of transactions."""
+    result = db.execute(
+        select(*[getattr(TransactionSyncORM, field) for field in EXPORT_FIELDS])
+        .where(*filters)
+        .order_by(TransactionSyncORM.created, TransactionSyncORM.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    if format == "csv":
+        content, media_type = _export_csv(result), "text/csv"
+    else:
+        content, media_type = _export_ndjson(result), "application/x-ndjson"
+
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=transactions.{format}"},
     )
-    return [
-        TransactionSync.model_validate(tsx, from_attributes=True)
-        for tsx in transactions
-    ]
 
 
 @router.get("/{transaction_id}")
@@ -0,0 +1,38 @@
+import pytest
+
+from stripe2qbo.benchmarks.fake_stripe import FakeStripe
+from stripe2qbo.benchmarks.harness import Benchmark
+from stripe2qbo.stripe import stripe_transactions
+from stripe2qbo.stripe.stripe_transactions import get_transactions_async
+
+ACCOUNT_ID = "acct_bench"
+PAGE_SIZE = 100
+
+
+async def _clear_expansions() -> None:
+    stripe_transactions._loop_expansions.clear()
+
+
+@pytest.mark.parametrize("latency", [0, 0.01], ids=["local", "latency"])
+async def bench_get_transactions(
+    bench: Benchmark, fake_stripe: FakeStripe, latency: float
+):
+    """Transactions imported per second, one page at a time like the import
+    worker, starting with no products or tax rates cached"""
+    fake_stripe.latency = latency
+    count = len(fake_stripe._transactions)
+
+    async def import_all(_: None) -> None:
+        imported = 0
+        starting_after = None
+        while True:
+            transactions = await get_transactions_async(
+                ACCOUNT_ID, limit=PAGE_SIZE, starting_after=starting_after
+            )
+            imported += len(transactions)
+            if len(transactions) < PAGE_SIZE:
+                break
+            starting_after = transactions[-1].id
+        assert imported == count
+
+    await bench.run_async(import_all, _clear_expansions, items=count, rounds=3)
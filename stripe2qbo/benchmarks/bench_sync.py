@@ -0,0 +1,119 @@
+from typing import List
+import asyncio
+import itertools
+import time
+
+import pytest
+
+from stripe2qbo.benchmarks.fake_qbo import FakeQBO
+from stripe2qbo.benchmarks.fake_stripe import FakeStripe
+from stripe2qbo.benchmarks.harness import Benchmark
+from stripe2qbo.db.models import User
+from stripe2qbo.db.schemas import Settings
+from stripe2qbo.qbo import qbo_request
+from stripe2qbo.qbo.auth import Token
+from stripe2qbo.rate_limit import MemoryRateLimiter
+from stripe2qbo.stripe.models import Transaction
+from stripe2qbo.stripe.stripe_transactions import get_transactions_async
+from stripe2qbo.Stripe2QBO import Stripe2QBO, create_stripe2qbo
+
+ACCOUNT_ID = "acct_bench"
+SYNC_CONCURRENCY = 5  # default of the sync worker
+TRANSACTIONS = 100
+# QBO's limit of 450 requests per minute, sped up so the benchmark stays short
+QBO_RATE_LIMIT = 500
+QBO_RATE_BURST = 10
+
+SETTINGS = Settings(
+    stripe_clearing_account_id="1",
+    stripe_payout_account_id="2",
+    stripe_vendor_id="3",
+    stripe_fee_account_id="4",
+    default_income_account_id="5",
+    default_tax_code_id="10",
+    exempt_tax_code_id="NON",
+)
+
+_realms = itertools.count()
+
+
+def _token() -> Token:
+    """Token for a new realm, so each round starts with empty caches"""
+    return Token(
+        realm_id=f"bench-realm-{next(_realms)}",
+        access_token="access",
+        refresh_token="refresh",
+        expires_at="",
+        refresh_token_expires_at="",
+    )
+
+
+@pytest.fixture
+async def transactions(fake_stripe: FakeStripe) -> List[Transaction]:
+    return await get_transactions_async(ACCOUNT_ID, limit=TRANSACTIONS)
+
+
+async def _sync_all(syncer: Stripe2QBO, transactions: List[Transaction]) -> None:
+    user = User(id=1, stripe_user_id=ACCOUNT_ID)
+    semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async def _sync(transaction: Transaction) -> str:
+        async with semaphore:
+            return (await syncer.sync(transaction, user)).status
+
+    statuses = await asyncio.gather(*[_sync(txn) for txn in transactions])
+    assert statuses == ["success"] * len(transactions)
+
+
+@pytest.mark.parametrize("batch", [False, True], ids=["single", "batch"])
+@pytest.mark.parametrize(
+    "latency,throttle_every",
+    [(0, 0), (0.01, 0), (0.01, 10)],
+    ids=["local", "latency", "throttled"],
+)
+async def bench_sync(
+    bench: Benchmark,
+    fake_qbo: FakeQBO,
+    transactions: List[Transaction],
+    batch: bool,
+    latency: float,
+    throttle_every: int,
+):
+    """Transactions synced per second by Stripe2QBO.sync, as the sync worker
+    runs it"""
+    fake_qbo.latency = latency
+    fake_qbo.throttle_every = throttle_every
+
+    async def setup() -> Stripe2QBO:
+        return await create_stripe2qbo(SETTINGS, _token(), batch=batch)
+
+    await bench.run_async(
+        lambda syncer: _sync_all(syncer, transactions),
+        setup,
+        items=len(transactions),
+        rounds=3,
+    )
+
+
+async def bench_batching_under_rate_limit(
+    fake_qbo: FakeQBO,
+    transactions: List[Transaction],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """Batching sends fewer requests than single creates, and so syncs faster
+    when QBO's rate limit is what holds syncs back"""
+    monkeypatch.setattr(
+        qbo_request, "_rate_limiter", MemoryRateLimiter(QBO_RATE_LIMIT, QBO_RATE_BURST)
+    )
+    requests = {}
+    durations = {}
+    for batch in [False, True]:
+        syncer = await create_stripe2qbo(SETTINGS, _token(), batch=batch)
+        requests_before = fake_qbo.requests
+        start = time.perf_counter()
+        await _sync_all(syncer, transactions)
+        durations[batch] = time.perf_counter() - start
+        requests[batch] = fake_qbo.requests - requests_before
+
+    assert requests[True] < requests[False] * 0.7
+    assert durations[True] < durations[False] * 0.7
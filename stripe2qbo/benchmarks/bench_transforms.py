@@ -0,0 +1,97 @@
+from typing import Any, Callable, Dict, List
+
+import pytest
+
+from stripe2qbo.benchmarks.bench_sync import ACCOUNT_ID, SETTINGS
+from stripe2qbo.benchmarks.fake_stripe import FakeStripe
+from stripe2qbo.benchmarks.harness import Benchmark
+import stripe2qbo.qbo.models as qbo_models
+from stripe2qbo.stripe.models import Transaction
+from stripe2qbo.stripe.stripe_transactions import get_transactions_async
+from stripe2qbo.sync_helpers import (
+    Transformer,
+    expense_from_transaction,
+    payment_from_charge,
+    qbo_invoice_from_stripe_invoice,
+    transfer_from_payout,
+)
+
+TAX_CODES: Dict[str, qbo_models.TaxCode | None] = {
+    "10": qbo_models.TaxCode.model_validate(
+        {
+            "Id": "10",
+            "SalesTaxRateList": {
+                "TaxRateDetail": [{"TaxRateRef": {"value": "7", "name": "Sales Tax"}}]
+            },
+        }
+    ),
+    "NON": None,
+}
+
+
+def _invoice(txn: Transaction) -> Any:
+    assert txn.invoice is not None
+    return qbo_invoice_from_stripe_invoice(txn.invoice, "1", TAX_CODES, SETTINGS)
+
+
+def _payment(txn: Transaction) -> Any:
+    assert txn.charge is not None
+    return payment_from_charge(txn.charge, "1", SETTINGS)
+
+
+def _expense(txn: Transaction) -> Any:
+    return expense_from_transaction(txn, SETTINGS)
+
+
+def _transfer(txn: Transaction) -> Any:
+    assert txn.payout is not None
+    return transfer_from_payout(txn.payout, SETTINGS)
+
+
+TRANSFORMS: Dict[str, Callable[[Transaction], Any]] = {
+    "invoice": _invoice,
+    "payment": _payment,
+    "expense": _expense,
+    "transfer": _transfer,
+}
+
+
+def _applies(name: str, txn: Transaction) -> bool:
+    if name == "invoice":
+        return txn.invoice is not None
+    if name == "payment":
+        return txn.charge is not None
+    if name == "transfer":
+        return txn.payout is not None
+    return txn.type in ["charge", "payment", "stripe_fee"]
+
+
+@pytest.fixture
+async def transactions(fake_stripe: FakeStripe) -> List[Transaction]:
+    return await get_transactions_async(
+        ACCOUNT_ID, limit=len(fake_stripe._transactions)
+    )
+
+
+@pytest.mark.parametrize("name", list(TRANSFORMS))
+def bench_transform(bench: Benchmark, transactions: List[Transaction], name: str):
+    """Stripe objects transformed to QBO objects per second by sync_helpers"""
+    transform = TRANSFORMS[name]
+    txns = [txn for txn in transactions if _applies(name, txn)]
+
+    def transform_all() -> None:
+        for txn in txns:
+            transform(txn)
+
+    bench(transform_all, items=len(txns))
+
+
+def bench_transform_all(bench: Benchmark, transactions: List[Transaction]):
+    """Transactions converted per second in one pass by Transformer.transform_all,
+    to compare with calling the functions above for each object"""
+    customer_ids = {txn.id: "1" for txn in transactions if txn.charge}
+
+    def transform_all() -> None:
+        Transformer(SETTINGS, TAX_CODES).transform_all(transactions, customer_ids)
+
+    bench(transform_all, items=len(transactions))
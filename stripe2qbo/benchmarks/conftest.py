@@ -0,0 +1,111 @@
+from typing import Dict, List
+
+import pytest
+import stripe
+from _pytest.terminal import TerminalReporter
+
+from stripe2qbo.benchmarks.fake_qbo import QBO_BASE_URL, FakeQBO
+from stripe2qbo.benchmarks.fake_stripe import STRIPE_API_BASE, FakeStripe
+from stripe2qbo.benchmarks.harness import (
+    Benchmark,
+    BenchmarkResult,
+    load_results,
+    save_results,
+)
+from stripe2qbo.http_client import ClientPool
+from stripe2qbo.qbo import qbo_request
+from stripe2qbo.rate_limit import MemoryRateLimiter
+from stripe2qbo.stripe import stripe_request
+
+# Effectively unlimited, so benchmarks measure our code and not the rate limits
+UNLIMITED = 1e9
+
+results_key = pytest.StashKey[List[BenchmarkResult]]()
+baseline_key = pytest.StashKey[Dict[str, float]]()
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--bench-save", metavar="PATH", help="Save the results to a JSON file"
+    )
+    group.addoption(
+        "--bench-compare",
+        metavar="PATH",
+        help="Fail benchmarks that are slower than the results saved in PATH",
+    )
+    group.addoption(
+        "--bench-max-regression",
+        type=float,
+        default=0.2,
+        help="Slowdown allowed by --bench-compare, as a fraction (default: 0.2)",
+    )
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    results: List[BenchmarkResult] = []
+    config.stash[results_key] = results
+    compare = config.getoption("bench_compare", None)
+    config.stash[baseline_key] = load_results(compare) if compare else {}
+
+
+def pytest_terminal_summary(
+    terminalreporter: TerminalReporter, config: pytest.Config
+) -> None:
+    results: List[BenchmarkResult] = config.stash.get(results_key, [])
+    if len(results) == 0:
+        return
+
+    terminalreporter.section("benchmarks")
+    width = max(len(result.name) for result in results)
+    terminalreporter.write_line(
+        f"{'name':<{width}} {'items':>7} {'best (s)':>10} "
+        + f"{'median (s)':>10} {'items/s':>10}"
+    )
+    for result in results:
+        terminalreporter.write_line(
+            f"{result.name:<{width}} {result.items:>7} {result.best:>10.4f} "
+            + f"{result.median:>10.4f} {result.items_per_second:>10.1f}"
+        )
+
+    path = config.getoption("bench_save", None)
+    if path:
+        save_results(path, results)
+
+
+@pytest.fixture
+def bench(request: pytest.FixtureRequest) -> Benchmark:
+    config = request.config
+    return Benchmark(
+        request.node.name,
+        config.stash[results_key],
+        config.stash[baseline_key],
+        config.getoption("bench_max_regression"),
+    )
+
+
+@pytest.fixture
+def fake_qbo(monkeypatch: pytest.MonkeyPatch) -> FakeQBO:
+    """Send QBO requests to a FakeQBO, without rate limits or retry backoff"""
+    fake = FakeQBO()
+    monkeypatch.setenv("QBO_BASE_URL", QBO_BASE_URL)
+    monkeypatch.setattr(qbo_request, "_clients", ClientPool(fake.client))
+    monkeypatch.setattr(
+        qbo_request, "_rate_limiter", MemoryRateLimiter(UNLIMITED, UNLIMITED)
+    )
+    monkeypatch.setattr(qbo_request, "QBO_RETRY_BACKOFF", 0)
+    return fake
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch: pytest.MonkeyPatch) -> FakeStripe:
+    """Send Stripe requests to a FakeStripe, without rate limits or retry backoff"""
+    fake = FakeStripe()
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    monkeypatch.setattr(stripe, "api_base", STRIPE_API_BASE)
+    monkeypatch.setattr(stripe_request, "_clients", ClientPool(fake.client))
+    monkeypatch.setattr(
+        stripe_request, "_rate_limiter", MemoryRateLimiter(UNLIMITED, UNLIMITED)
+    )
+    monkeypatch.setattr(stripe_request, "STRIPE_RETRY_BACKOFF", 0)
+    return fake
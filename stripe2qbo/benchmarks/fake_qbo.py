@@ -0,0 +1,149 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import json
+import re
+
+import httpx
+
+QBO_BASE_URL = "https://quickbooks.test/v3/company"
+
+ENTITIES = {
+    "account": "Account",
+    "customer": "Customer",
+    "invoice": "Invoice",
+    "item": "Item",
+    "payment": "Payment",
+    "purchase": "Purchase",
+    "transfer": "Transfer",
+    "vendor": "Vendor",
+}
+
+QUERY_PATTERN = re.compile(
+    r"select \* from (?P<entity>\w+)"
+    r"(?: where (?P<where>.*?))?"
+    r"(?: ORDERBY (?P<order_by>[\w.]+))?"
+    r"(?: STARTPOSITION (?P<start>\d+) MAXRESULTS (?P<max>\d+))?$"
+)
+CONDITION_PATTERN = re.compile(r"([\w.]+) (=|>=) '([^']*)'")
+
+EPOCH = datetime(2023, 1, 1)
+
+
+def _field(obj: Dict[str, Any], name: str) -> Any:
+    for part in name.split("."):
+        obj = obj.get(part, {}) if isinstance(obj, dict) else {}
+    return obj
+
+
+class FakeQBO:
+    """In-memory stand-in for the QBO accounting API.
+
+    Serves preferences, queries, creates and /batch for any number of realms.
+    Each response is delayed by `latency` seconds, and every `throttle_every`
+    requests one is rejected with a 429, like QBO does past its rate limits."""
+
+    def __init__(self, latency: float = 0.0, throttle_every: int = 0) -> None:
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled = 0
+        self._realms: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self._next_id = 0
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    def objects(self, realm_id: str, entity: str) -> List[Dict[str, Any]]:
+        realm = self._realms.setdefault(realm_id, {"TaxCode": [self._tax_code()]})
+        return realm.setdefault(entity, [])
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.throttle_every > 0 and self.requests % self.throttle_every == 0:
+            self.throttled += 1
+            return httpx.Response(429, headers={"Retry-After": "0"}, text="Throttled")
+
+        *_, realm_id, endpoint = [part for part in request.url.path.split("/") if part]
+        if endpoint == "preferences":
+            return httpx.Response(200, json=self._preferences())
+        if endpoint == "query":
+            return self._query(realm_id, request.url.params["query"])
+
+        body = json.loads(request.content)
+        if endpoint == "batch":
+            return httpx.Response(200, json=self._batch(realm_id, body))
+        if endpoint in ENTITIES:
+            entity = ENTITIES[endpoint]
+            return httpx.Response(
+                200, json={entity: self._create(realm_id, entity, body)}
+            )
+        return httpx.Response(404, json=self._fault(f"Unknown endpoint {endpoint}"))
+
+    def _create(
+        self, realm_id: str, entity: str, body: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        self._next_id += 1
+        updated = EPOCH + timedelta(seconds=self._next_id)
+        obj = {
+            **body,
+            "Id": str(self._next_id),
+            "MetaData": {"LastUpdatedTime": updated.isoformat()},
+        }
+        self.objects(realm_id, entity).append(obj)
+        return obj
+
+    def _batch(self, realm_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        responses = []
+        for item in body["BatchItemRequest"]:
+            entity = next(key for key in item if key not in ("bId", "operation"))
+            obj = self._create(realm_id, entity, item[entity])
+            responses.append({"bId": item["bId"], entity: obj})
+        return {"BatchItemResponse": responses}
+
+    def _query(self, realm_id: str, query: str) -> httpx.Response:
+        match = QUERY_PATTERN.match(" ".join(query.split()))
+        if match is None:
+            return httpx.Response(400, json=self._fault(f"Invalid query: {query}"))
+
+        conditions: List[Tuple[str, str, str]] = CONDITION_PATTERN.findall(
+            match["where"] or ""
+        )
+        rows = [
+            obj
+            for obj in self.objects(realm_id, match["entity"])
+            if all(
+                str(_field(obj, name)) == value
+                if operator == "="
+                else str(_field(obj, name)) >= value
+                for name, operator, value in conditions
+            )
+        ]
+        if match["order_by"] == "Id":
+            rows.sort(key=lambda obj: int(obj["Id"]))
+
+        start = int(match["start"] or 1) - 1
+        max_results: Optional[int] = int(match["max"]) if match["max"] else None
+        rows = rows[start : start + max_results if max_results else None]
+        return httpx.Response(200, json={"QueryResponse": {match["entity"]: rows}})
+
+    def _preferences(self) -> Dict[str, Any]:
+        return {
+            "Preferences": {
+                "CurrencyPrefs": {"HomeCurrency": {"value": "USD"}},
+                "TaxPrefs": {"UsingSalesTax": True},
+            }
+        }
+
+    def _tax_code(self) -> Dict[str, Any]:
+        return {
+            "Id": "10",
+            "SalesTaxRateList": {
+                "TaxRateDetail": [{"TaxRateRef": {"value": "7", "name": "Sales Tax"}}]
+            },
+        }
+
+    def _fault(self, detail: str) -> Dict[str, Any]:
+        return {"Fault": {"Error": [{"Detail": detail}]}}
@@ -0,0 +1,199 @@
+from typing import Any, Dict, List
+import asyncio
+
+import httpx
+
+STRIPE_API_BASE = "https://stripe.test"
+
+CREATED = 1690000000
+CUSTOMERS = 50
+PRODUCTS = 20
+
+
+class FakeStripe:
+    """In-memory stand-in for the Stripe API of a connected account.
+
+    Holds `count` balance transactions, newest first: mostly charges, one in
+    `invoice_every` of them paying an invoice, plus payouts and Stripe fees.
+    Sources, customers and invoices are always expanded. Each response is
+    delayed by `latency` seconds, and every `throttle_every` requests one is
+    rejected with a 429."""
+
+    def __init__(
+        self,
+        count: int = 1000,
+        invoice_every: int = 4,
+        latency: float = 0.0,
+        throttle_every: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled = 0
+        self.invoice_every = invoice_every
+        self._transactions = [self._transaction(i) for i in reversed(range(count))]
+        self._by_id = {txn["id"]: txn for txn in self._transactions}
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.throttle_every > 0 and self.requests % self.throttle_every == 0:
+            self.throttled += 1
+            return self._error(429, "Too many requests")
+
+        path = request.url.path
+        if path == "/v1/balance_transactions":
+            return httpx.Response(200, json=self._list(request.url.params))
+
+        _, _, resource, object_id = path.split("/")
+        if resource == "balance_transactions" and object_id in self._by_id:
+            return httpx.Response(200, json=self._by_id[object_id])
+        if resource == "products":
+            return httpx.Response(
+                200,
+                json={
+                    "object": "product",
+                    "id": object_id,
+                    "name": f"Product {object_id}",
+                },
+            )
+        if resource == "tax_rates":
+            return httpx.Response(
+                200, json={"object": "tax_rate", "id": object_id, "percentage": 13.0}
+            )
+        return self._error(404, f"No such {resource}: {object_id}")
+
+    def _list(self, params: httpx.QueryParams) -> Dict[str, Any]:
+        gte, lte = params.get("created[gte]"), params.get("created[lte]")
+        transaction_type = params.get("type")
+        txns = [
+            txn
+            for txn in self._transactions
+            if (gte is None or txn["created"] >= int(gte))
+            and (lte is None or txn["created"] <= int(lte))
+            and (transaction_type is None or txn["type"] == transaction_type)
+        ]
+
+        starting_after = params.get("starting_after")
+        if starting_after is not None:
+            ids = [txn["id"] for txn in txns]
+            txns = txns[ids.index(starting_after) + 1 :]
+
+        limit = int(params.get("limit", 10))
+        return {
+            "object": "list",
+            "url": "/v1/balance_transactions",
+            "data": txns[:limit],
+            "has_more": len(txns) > limit,
+        }
+
+    def _transaction(self, i: int) -> Dict[str, Any]:
+        txn: Dict[str, Any] = {
+            "object": "balance_transaction",
+            "id": f"txn_{i}",
+            "created": CREATED + i,
+            "exchange_rate": None,
+            "currency": "usd",
+        }
+        if i % 10 == 9:
+            amount = 10000 + i
+            return {
+                **txn,
+                "type": "payout",
+                "description": "STRIPE PAYOUT",
+                "amount": -amount,
+                "fee": 0,
+                "source": {
+                    "object": "payout",
+                    "id": f"po_{i}",
+                    "amount": amount,
+                    "arrival_date": CREATED + i + 86400,
+                    "created": CREATED + i,
+                    "description": "STRIPE PAYOUT",
+                },
+            }
+        if i % 10 == 8:
+            return {
+                **txn,
+                "type": "stripe_fee",
+                "description": "Billing - Usage Fee",
+                "amount": -500,
+                "fee": 0,
+                "source": None,
+            }
+
+        amount = 1000 + i
+        return {
+            **txn,
+            "type": "charge",
+            "description": f"Charge {i}",
+            "amount": amount,
+            "fee": 59,
+            "source": {
+                "object": "charge",
+                "id": f"ch_{i}",
+                "amount": amount,
+                "created": CREATED + i,
+                "description": f"Charge {i}",
+                "currency": "usd",
+                "customer": {
+                    "object": "customer",
+                    "id": f"cus_{i % CUSTOMERS}",
+                    "name": f"Customer {i % CUSTOMERS}",
+                },
+                "invoice": self._invoice(i, amount)
+                if i % self.invoice_every == 0
+                else None,
+            },
+        }
+
+    def _invoice(self, i: int, amount: int) -> Dict[str, Any]:
+        tax = amount // 10
+        lines: List[Dict[str, Any]] = [
+            {
+                "object": "line_item",
+                "id": f"il_{i}_{j}",
+                "amount": (amount - tax) // 2,
+                "description": f"Line {j}",
+                "quantity": 1,
+                "plan": None,
+                "price": {
+                    "object": "price",
+                    "id": f"price_{(i + j) % PRODUCTS}",
+                    "product": f"prod_{(i + j) % PRODUCTS}",
+                },
+                "tax_amounts": [
+                    {
+                        "amount": tax // 2,
+                        "taxable_amount": (amount - tax) // 2,
+                        "tax_rate": "txr_1",
+                    }
+                ],
+            }
+            for j in range(2)
+        ]
+        return {
+            "object": "invoice",
+            "id": f"in_{i}",
+            "created": CREATED + i,
+            "due_date": None,
+            "amount_due": amount,
+            "currency": "usd",
+            "tax": tax,
+            "number": f"INV-{i:05d}",
+            "lines": {
+                "object": "list",
+                "url": f"/v1/invoices/in_{i}/lines",
+                "data": lines,
+                "has_more": False,
+            },
+        }
+
+    def _error(self, status_code: int, message: str) -> httpx.Response:
+        return httpx.Response(
+            status_code, json={"error": {"type": "api_error", "message": message}}
+        )
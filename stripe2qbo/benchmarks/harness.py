@@ -0,0 +1,97 @@
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, TypeVar
+import json
+import statistics
+import time
+
+T = TypeVar("T")
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    items: int
+    rounds: int
+    best: float  # seconds
+    median: float  # seconds
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.median
+
+
+class RegressionError(AssertionError):
+    pass
+
+
+class Benchmark:
+    """Times a benchmark over several rounds and records its items per second.
+
+    If a baseline was saved for the benchmark, raises a RegressionError when
+    its throughput is more than `max_regression` below the baseline."""
+
+    def __init__(
+        self,
+        name: str,
+        results: List[BenchmarkResult],
+        baseline: Dict[str, float],
+        max_regression: float,
+    ) -> None:
+        self.name = name
+        self._results = results
+        self._baseline = baseline
+        self._max_regression = max_regression
+
+    def __call__(
+        self, func: Callable[[], Any], items: int = 1, rounds: int = 5
+    ) -> BenchmarkResult:
+        func()  # warm up
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return self._record(items, timings)
+
+    async def run_async(
+        self,
+        func: Callable[[T], Awaitable[Any]],
+        setup: Callable[[], Awaitable[T]],
+        items: int = 1,
+        rounds: int = 5,
+    ) -> BenchmarkResult:
+        """Time func over rounds, each with a fresh state from setup,
+        which isn't timed"""
+        timings = []
+        for _ in range(rounds):
+            state = await setup()
+            start = time.perf_counter()
+            await func(state)
+            timings.append(time.perf_counter() - start)
+        return self._record(items, timings)
+
+    def _record(self, items: int, timings: List[float]) -> BenchmarkResult:
+        result = BenchmarkResult(
+            self.name, items, len(timings), min(timings), statistics.median(timings)
+        )
+        self._results.append(result)
+
+        baseline = self._baseline.get(self.name)
+        if baseline is not None:
+            if result.items_per_second < baseline * (1 - self._max_regression):
+                raise RegressionError(
+                    f"{self.name}: {result.items_per_second:.1f} items/s, "
+                    + f"baseline is {baseline:.1f} items/s"
+                )
+        return result
+
+
+def load_results(path: str) -> Dict[str, float]:
+    """Load saved results, as items per second by benchmark name"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(path: str, results: List[BenchmarkResult]) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {result.name: result.items_per_second for result in results}, f, indent=2
+        )
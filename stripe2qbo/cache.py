@@ -0,0 +1,126 @@
+from typing import Any, Optional
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import json
+import os
+import time
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+from stripe2qbo.http_client import ClientPool
+
+load_dotenv()
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+
+
+class Cache(ABC):
+    """Async key-value cache for JSON-serializable values"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None:
+        ...
+
+    async def aclose(self) -> None:
+        """Close the connections opened in the running event loop, if any"""
+
+
+class MemoryCache(Cache):
+    """In-process LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, ttl: float = CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (ttl if ttl is not None else self._ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+
+class RedisCache(Cache):
+    """Cache shared by every process connected to the same Redis server.
+
+    Redis errors are treated as cache misses, so an unavailable server
+    only costs the extra QBO requests."""
+
+    def __init__(self, url: str, ttl: float = CACHE_TTL):
+        self._clients: ClientPool[redis.Redis] = ClientPool(
+            lambda: redis.Redis.from_url(url)
+        )
+        self._ttl = ttl
+
+    @property
+    def _redis(self) -> redis.Redis:
+        return self._clients.get()
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            value = await self._redis.get(key)
+        except redis.RedisError:
+            return None
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            ttl = ttl if ttl is not None else self._ttl
+            await self._redis.set(key, json.dumps(value), px=int(ttl * 1000))
+        except redis.RedisError:
+            pass
+
+    async def delete(self, *keys: str) -> None:
+        try:
+            await self._redis.delete(*keys)
+        except redis.RedisError:
+            pass
+
+    async def aclose(self) -> None:
+        await self._clients.aclose()
+
+
+_cache: Optional[Cache] = None
+
+
+def get_cache() -> Cache:
+    """Get the process-wide cache, backed by Redis if REDIS_URL is set"""
+    global _cache
+    if _cache is None:
+        redis_url = os.getenv("REDIS_URL")
+        _cache = RedisCache(redis_url) if redis_url else MemoryCache()
+    return _cache
+
+
+async def close_cache() -> None:
+    """Close the cache's connections for the running event loop, if any"""
+    if _cache is not None:
+        await _cache.aclose()
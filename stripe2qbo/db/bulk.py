@@ -0,0 +1,46 @@
+from typing import Sequence, cast
+
+from sqlalchemy import CursorResult, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from stripe2qbo.db.models import TransactionSync as TransactionSyncORM
+from stripe2qbo.db.schemas import TransactionSync
+
+
+def insert_new_transactions(
+    db: Session, transactions: Sequence[TransactionSync]
+) -> int:
+    """Insert the transactions that haven't been imported yet.
+
+    Uses a single INSERT ... ON CONFLICT DO NOTHING on Postgres and SQLite,
+    or one lookup and one INSERT on other databases. Does not commit.
+
+    Returns:
+        int: number of transactions inserted"""
+    if len(transactions) == 0:
+        return 0
+
+    rows = [transaction.model_dump() for transaction in transactions]
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        stmt = postgresql.insert(TransactionSyncORM).values(rows)
+        result = db.execute(stmt.on_conflict_do_nothing(index_elements=["id"]))
+        return cast(CursorResult, result).rowcount
+    if dialect == "sqlite":
+        stmt_sqlite = sqlite.insert(TransactionSyncORM).values(rows)
+        result = db.execute(stmt_sqlite.on_conflict_do_nothing(index_elements=["id"]))
+        return cast(CursorResult, result).rowcount
+
+    existing = set(
+        db.scalars(
+            select(TransactionSyncORM.id).where(
+                TransactionSyncORM.id.in_([row["id"] for row in rows])
+            )
+        )
+    )
+    new_rows = [row for row in rows if row["id"] not in existing]
+    if len(new_rows) > 0:
+        db.execute(insert(TransactionSyncORM), new_rows)
+    return len(new_rows)
@@ -0,0 +1,54 @@
+"""Index transactions by status and Stripe account
+
+Revision ID: 2b9e4c7d1f03
+Revises: 8d3a61f0b7c2
+Create Date: 2026-10-18 11:48:33.102954
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "2b9e4c7d1f03"
+down_revision: Union[str, None] = "8d3a61f0b7c2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# On Postgres, indexes are built concurrently, so that syncs and imports can
+# keep writing to transaction_sync while they are built. CREATE INDEX
+# CONCURRENTLY can't run in a transaction, hence the autocommit blocks.
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_transaction_sync_user_id_status",
+            "transaction_sync",
+            ["user_id", "status", "created", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_transaction_sync_stripe_id_id",
+            "transaction_sync",
+            ["stripe_id", "id"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_transaction_sync_stripe_id_id",
+            table_name="transaction_sync",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_transaction_sync_user_id_status",
+            table_name="transaction_sync",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,44 @@
+"""Add sync schedules
+
+Revision ID: 4a9f1c6e2b75
+Revises: c81e5d2a4f60
+Create Date: 2026-10-18 16:40:03.517284
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4a9f1c6e2b75"
+down_revision: Union[str, None] = "c81e5d2a4f60"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sync_schedules",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("interval_minutes", sa.Integer(), nullable=False),
+        sa.Column("next_run_at", sa.Integer(), nullable=False),
+        sa.Column("last_run_at", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    op.create_index(
+        "ix_sync_schedules_next_run_at",
+        "sync_schedules",
+        ["next_run_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_sync_schedules_next_run_at", table_name="sync_schedules")
+    op.drop_table("sync_schedules")
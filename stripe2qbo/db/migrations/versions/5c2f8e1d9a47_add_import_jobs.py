@@ -0,0 +1,46 @@
+"""Add import jobs
+
+Revision ID: 5c2f8e1d9a47
+Revises: 1e41b1c1a118
+Create Date: 2026-10-18 10:12:41.530187
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c2f8e1d9a47"
+down_revision: Union[str, None] = "1e41b1c1a118"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "import_jobs",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum("importing", "done", "failed", native_enum=False),
+            nullable=False,
+        ),
+        sa.Column("from_timestamp", sa.Integer(), nullable=True),
+        sa.Column("to_timestamp", sa.Integer(), nullable=True),
+        sa.Column("starting_after", sa.String(), nullable=True),
+        sa.Column("imported", sa.Integer(), nullable=False),
+        sa.Column("skipped", sa.Integer(), nullable=False),
+        sa.Column("failure_reason", sa.String(), nullable=True),
+        sa.Column("updated_at", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("import_jobs")
@@ -0,0 +1,33 @@
+"""Add Stripe webhook events
+
+Revision ID: 7f4c2a9d3b18
+Revises: 2b9e4c7d1f03
+Create Date: 2026-10-18 14:05:12.418327
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7f4c2a9d3b18"
+down_revision: Union[str, None] = "2b9e4c7d1f03"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stripe_events",
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("account_id", sa.String(), nullable=True),
+        sa.Column("received_at", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("stripe_events")
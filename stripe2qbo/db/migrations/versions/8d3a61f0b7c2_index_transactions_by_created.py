@@ -0,0 +1,42 @@
+"""Index transactions by created
+
+Revision ID: 8d3a61f0b7c2
+Revises: 5c2f8e1d9a47
+Create Date: 2026-10-18 11:02:09.847113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8d3a61f0b7c2"
+down_revision: Union[str, None] = "5c2f8e1d9a47"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Built concurrently on Postgres, so that syncs and imports can keep writing
+# to transaction_sync meanwhile. CREATE INDEX CONCURRENTLY can't run in a
+# transaction, hence the autocommit blocks.
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_transaction_sync_user_id_created",
+            "transaction_sync",
+            ["user_id", "created", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_transaction_sync_user_id_created",
+            table_name="transaction_sync",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,28 @@
+"""Add sync schedule start
+
+Revision ID: 9b3d5f7a1c24
+Revises: 4a9f1c6e2b75
+Create Date: 2026-10-18 19:12:47.260381
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9b3d5f7a1c24"
+down_revision: Union[str, None] = "4a9f1c6e2b75"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "sync_schedules", sa.Column("from_timestamp", sa.Integer(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("sync_schedules", "from_timestamp")
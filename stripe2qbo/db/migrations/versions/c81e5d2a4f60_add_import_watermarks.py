@@ -0,0 +1,39 @@
+"""Add import watermarks
+
+Revision ID: c81e5d2a4f60
+Revises: 7f4c2a9d3b18
+Create Date: 2026-10-18 15:22:47.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c81e5d2a4f60"
+down_revision: Union[str, None] = "7f4c2a9d3b18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "import_watermarks",
+        sa.Column("stripe_id", sa.String(), nullable=False),
+        sa.Column("from_timestamp", sa.Integer(), nullable=True),
+        sa.Column("created", sa.Integer(), nullable=False),
+        sa.Column("transaction_id", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("stripe_id"),
+    )
+    op.add_column(
+        "import_jobs", sa.Column("newest_created", sa.Integer(), nullable=True)
+    )
+    op.add_column("import_jobs", sa.Column("newest_id", sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("import_jobs", "newest_id")
+    op.drop_column("import_jobs", "newest_created")
+    op.drop_table("import_watermarks")
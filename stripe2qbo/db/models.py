@@ -1,5 +1,5 @@
 from typing import Literal
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -72,3 +72,79 @@ class TransactionSync(Base):
 
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     user = relationship("User", back_populates="transactions")
+
+    __table_args__ = (
+        # GET /transaction/ pages through a user's transactions by (created, id)
+        Index("ix_transaction_sync_user_id_created", "user_id", "created", "id"),
+        # same, filtered by status, and status counts
+        Index(
+            "ix_transaction_sync_user_id_status",
+            "user_id",
+            "status",
+            "created",
+            "id",
+        ),
+        # lookups by Stripe account
+        Index("ix_transaction_sync_stripe_id_id", "stripe_id", "id", unique=True),
+    )
+
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    status: Mapped[Literal["importing", "done", "failed"]] = mapped_column(
+        nullable=False
+    )
+    from_timestamp: Mapped[int | None] = mapped_column(nullable=True)
+    to_timestamp: Mapped[int | None] = mapped_column(nullable=True)
+    # id of the last imported transaction, Stripe's pagination cursor
+    starting_after: Mapped[str | None] = mapped_column(nullable=True)
+    # newest transaction listed, which becomes the watermark when done
+    newest_created: Mapped[int | None] = mapped_column(nullable=True)
+    newest_id: Mapped[str | None] = mapped_column(nullable=True)
+    imported: Mapped[int] = mapped_column(nullable=False, default=0)
+    skipped: Mapped[int] = mapped_column(nullable=False, default=0)
+    failure_reason: Mapped[str | None] = mapped_column(nullable=True)
+    updated_at: Mapped[int] = mapped_column(nullable=False)
+
+
+class ImportWatermark(Base):
+    """Newest transaction imported from a Stripe account, and the time since
+    which every transaction up to it was imported (None: since the start)"""
+
+    __tablename__ = "import_watermarks"
+
+    stripe_id: Mapped[str] = mapped_column(primary_key=True)
+    from_timestamp: Mapped[int | None] = mapped_column(nullable=True)
+    created: Mapped[int] = mapped_column(nullable=False)
+    transaction_id: Mapped[str] = mapped_column(nullable=False)
+
+
+class SyncSchedule(Base):
+    """How often a user's new transactions are imported and synced"""
+
+    __tablename__ = "sync_schedules"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    interval_minutes: Mapped[int] = mapped_column(nullable=False)
+    next_run_at: Mapped[int] = mapped_column(nullable=False)
+    last_run_at: Mapped[int | None] = mapped_column(nullable=True)
+    # Import transactions from here until the account has a watermark
+    from_timestamp: Mapped[int | None] = mapped_column(nullable=True)
+
+    __table_args__ = (
+        # Celery beat looks up the schedules that are due
+        Index("ix_sync_schedules_next_run_at", "next_run_at"),
+    )
+
+
+class StripeEvent(Base):
+    """Stripe webhook events that were handled, so that redeliveries are ignored"""
+
+    __tablename__ = "stripe_events"
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    type: Mapped[str] = mapped_column(nullable=False)
+    account_id: Mapped[str | None] = mapped_column(nullable=True)
+    received_at: Mapped[int] = mapped_column(nullable=False)
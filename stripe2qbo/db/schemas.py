@@ -1,5 +1,5 @@
 from typing import Optional, Literal
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 def _snake_to_camel(s: str) -> str:
@@ -49,3 +49,32 @@ class TransactionSync(BaseModel):
     invoice_id: Optional[str] = None
     payment_id: Optional[str] = None
     expense_id: Optional[str] = None
+
+
+class ImportJob(BaseModel):
+    user_id: int
+    status: Literal["importing", "done", "failed"] = "importing"
+    from_timestamp: Optional[int] = None
+    to_timestamp: Optional[int] = None
+    starting_after: Optional[str] = None
+    imported: int = 0
+    skipped: int = 0
+    failure_reason: Optional[str] = None
+
+    model_config = {"from_attributes": True}
+
+
+class SyncSchedule(BaseModel):
+    interval_minutes: int = Field(ge=15, le=7 * 24 * 60)
+    # Required unless transactions were imported already
+    from_timestamp: Optional[int] = None
+    next_run_at: Optional[int] = None
+    last_run_at: Optional[int] = None
+
+    model_config = {"from_attributes": True}
+
+
+class TransactionPage(BaseModel):
+    transactions: list[TransactionSync]
+    # pass as `cursor` to get the next page, None on the last page
+    next_cursor: Optional[str] = None
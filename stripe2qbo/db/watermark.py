@@ -0,0 +1,65 @@
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from stripe2qbo.db.models import ImportJob, ImportWatermark
+
+
+def _start(timestamp: Optional[int]) -> float:
+    return float("-inf") if timestamp is None else timestamp
+
+
+def _end(timestamp: Optional[int]) -> float:
+    return float("inf") if timestamp is None else timestamp
+
+
+def incremental_from_timestamp(
+    db: Session, stripe_id: str, from_timestamp: Optional[int]
+) -> Optional[int]:
+    """Where to start an import from from_timestamp, skipping the transactions
+    that the account's watermark says were already imported"""
+    watermark = db.get(ImportWatermark, stripe_id)
+    if watermark is None:
+        return from_timestamp
+
+    start = _start(from_timestamp)
+    if _start(watermark.from_timestamp) <= start <= watermark.created:
+        # created[gte], so that transactions created in the same second
+        # as the watermark aren't missed. They are skipped on insert.
+        return watermark.created
+    return from_timestamp
+
+
+def advance_watermark(db: Session, stripe_id: str, job: ImportJob) -> None:
+    """Move the account's watermark to the newest transaction of a finished
+    import, if the import overlaps the watermark's range. Does not commit."""
+    if job.newest_created is None or job.newest_id is None:
+        return
+
+    watermark = db.get(ImportWatermark, stripe_id)
+    if watermark is None:
+        db.add(
+            ImportWatermark(
+                stripe_id=stripe_id,
+                from_timestamp=job.from_timestamp,
+                created=job.newest_created,
+                transaction_id=job.newest_id,
+            )
+        )
+        return
+
+    overlaps = _start(job.from_timestamp) <= watermark.created and _end(
+        job.to_timestamp
+    ) >= _start(watermark.from_timestamp)
+    if overlaps:
+        if _start(job.from_timestamp) < _start(watermark.from_timestamp):
+            watermark.from_timestamp = job.from_timestamp
+    elif job.newest_created > watermark.created:
+        # A newer range, not contiguous with the old one
+        watermark.from_timestamp = job.from_timestamp
+    else:
+        return
+
+    if job.newest_created >= watermark.created:
+        watermark.created = job.newest_created
+        watermark.transaction_id = job.newest_id
@@ -1,4 +1,12 @@
+from typing import Optional
+
+
 class QBOException(Exception):
-    """Raised when a QBO request returns an error"""
+    """Raised when a QBO request returns an error.
+
+    intuit_tid is Intuit's id for the request, if QBO sent one, to quote
+    when reporting issues to Intuit."""
 
-    pass
+    def __init__(self, message: str, intuit_tid: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.intuit_tid = intuit_tid
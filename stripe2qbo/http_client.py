@@ -0,0 +1,39 @@
+from typing import Callable, Generic, Protocol, TypeVar
+import asyncio
+import weakref
+
+
+class AsyncClient(Protocol):
+    async def aclose(self) -> None:
+        ...
+
+
+C = TypeVar("C", bound=AsyncClient)
+
+
+class ClientPool(Generic[C]):
+    """One pooled client per event loop.
+
+    httpx and redis.asyncio clients are bound to the loop they were first used
+    on, so sharing one across loops (e.g. separate asyncio.run calls) is not
+    safe. Entries are dropped automatically when a loop is garbage collected."""
+
+    def __init__(self, factory: Callable[[], C]) -> None:
+        self._factory = factory
+        self._clients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, C
+        ] = weakref.WeakKeyDictionary()
+
+    def get(self) -> C:
+        """Get the client for the running event loop, creating it if needed"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or getattr(client, "is_closed", False):
+            client = self._clients[loop] = self._factory()
+        return client
+
+    async def aclose(self) -> None:
+        """Close the client for the running event loop, if any"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
@@ -0,0 +1,158 @@
+from typing import Any, Iterator
+from contextlib import contextmanager
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+try:
+    from opentelemetry import trace  # type: ignore[import]
+except ImportError:  # spans are only recorded if opentelemetry is installed
+    trace = None  # type: ignore
+
+load_dotenv()
+
+# Directory shared by the API and worker processes on a host, where
+# prometheus_client keeps each process's metrics
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Ids in request paths, replaced so each endpoint is a single label value
+ID_PATTERN = re.compile(r"^(?:\d+|[a-z]+_(?=[A-Za-z]*\d)[A-Za-z0-9]+)$")
+
+
+api_requests = Counter(
+    "stripe2qbo_api_requests_total",
+    "Requests to QBO and Stripe, by endpoint, tenant and final status",
+    ["service", "endpoint", "tenant", "status"],
+)
+api_request_duration = Histogram(
+    "stripe2qbo_api_request_duration_seconds",
+    "Time spent on requests to QBO and Stripe, including retries",
+    ["service", "endpoint", "tenant"],
+    buckets=LATENCY_BUCKETS,
+)
+api_request_retries = Counter(
+    "stripe2qbo_api_request_retries_total",
+    "Retries of requests to QBO and Stripe, after throttling or errors",
+    ["service", "endpoint", "tenant"],
+)
+existing_lookups = Counter(
+    "stripe2qbo_existing_lookups_total",
+    "Lookups of previously synced QBO objects, by result: cached, found or missing",
+    ["realm", "object_type", "result"],
+)
+existing_scan_duration = Histogram(
+    "stripe2qbo_existing_scan_duration_seconds",
+    "Time spent scanning QBO for previously synced objects",
+    ["realm", "object_type"],
+    buckets=LATENCY_BUCKETS,
+)
+sync_phase_duration = Histogram(
+    "stripe2qbo_sync_phase_duration_seconds",
+    "Time spent in each phase of syncing a transaction",
+    ["realm", "phase"],
+    buckets=LATENCY_BUCKETS,
+)
+syncs = Counter(
+    "stripe2qbo_syncs_total",
+    "Transactions synced, by type and status",
+    ["realm", "type", "status"],
+)
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Trace the block as an OpenTelemetry span, if opentelemetry is installed"""
+    if trace is None:
+        yield _NoopSpan()
+        return
+
+    tracer = trace.get_tracer("stripe2qbo")
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def endpoint_name(path: str) -> str:
+    """Path of a request, without its query string and with ids replaced,
+    e.g. /v1/charges/{id}"""
+    parts = path.split("?")[0].strip("/").split("/")
+    return "/" + "/".join("{id}" if ID_PATTERN.match(p) else p for p in parts if p)
+
+
+class TrackedRequest:
+    def __init__(self, current_span: Any) -> None:
+        self.span = current_span
+        self.status: Any = "error"
+        self.retries = 0
+
+
+@contextmanager
+def track_request(service: str, endpoint: str, tenant: str) -> Iterator[TrackedRequest]:
+    """Record the count, status, latency and retries of a request, and trace it.
+
+    Set `status` and `retries` on the yielded object. Exceptions with an
+    http_status, like Stripe's, are recorded with that status."""
+    start = time.perf_counter()
+    with span(
+        f"{service} {endpoint}",
+        **{"service": service, "endpoint": endpoint, "tenant": tenant},
+    ) as current:
+        tracked = TrackedRequest(current)
+        try:
+            yield tracked
+        except Exception as e:
+            tracked.status = getattr(e, "http_status", None) or "error"
+            raise
+        finally:
+            api_requests.labels(service, endpoint, tenant, tracked.status).inc()
+            api_request_duration.labels(service, endpoint, tenant).observe(
+                time.perf_counter() - start
+            )
+            if tracked.retries > 0:
+                api_request_retries.labels(service, endpoint, tenant).inc(
+                    tracked.retries
+                )
+            current.set_attribute("http.status_code", str(tracked.status))
+            current.set_attribute("retries", tracked.retries)
+
+
+@contextmanager
+def track_phase(phase: str, realm: str) -> Iterator[None]:
+    """Record the time spent in a phase of a sync, and trace it"""
+    start = time.perf_counter()
+    with span(f"sync {phase}", realm=realm):
+        try:
+            yield
+        finally:
+            sync_phase_duration.labels(realm, phase).observe(
+                time.perf_counter() - start
+            )
+
+
+def collect() -> bytes:
+    """Metrics in the Prometheus text format. With PROMETHEUS_MULTIPROC_DIR
+    set, those of every process writing to it, including exited ones."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
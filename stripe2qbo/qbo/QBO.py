@@ -1,9 +1,13 @@
-from typing import Any, Optional, Mapping
+from typing import Any, AsyncIterator, Iterable, Optional, Mapping, Type, TypeVar
 
+import httpx
 from httpx import Response
+from pydantic import BaseModel
 
+from stripe2qbo.cache import Cache, get_cache
 from stripe2qbo.qbo.auth import Token
-from stripe2qbo.qbo.qbo_request import qbo_request
+from stripe2qbo.qbo.batch import MAX_BATCH_SIZE, QBOBatch
+from stripe2qbo.qbo.qbo_request import get_client, qbo_request
 from stripe2qbo.qbo.models import (
     Customer,
     Expense,
@@ -15,6 +19,11 @@ from stripe2qbo.qbo.models import (
     Transfer,
 )
 
+# QBO returns at most 1000 rows per query
+MAX_QUERY_RESULTS = 1000
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
 
 async def create_qbo(token: Token) -> "QBO":
     qbo = QBO()
@@ -27,12 +36,37 @@ class QBO:
     access_token: str | None = None
     home_currency: QBOCurrency | None = None
     using_sales_tax: bool = False
+    batch: QBOBatch | None = None
+    cache: Cache
 
-    async def set_token(self, token: Token) -> None:
+    def __init__(self, cache: Optional[Cache] = None) -> None:
+        self.cache = cache or get_cache()
+
+    def set_credentials(self, token: Token) -> None:
+        """Set the token without fetching the company's preferences"""
         self.realm_id = token.realm_id
         self.access_token = token.access_token
+
+    async def set_token(self, token: Token) -> None:
+        self.set_credentials(token)
         await self._set_preferences()
 
+    def enable_batching(
+        self, max_size: int = MAX_BATCH_SIZE, linger: float = 0.05
+    ) -> None:
+        """Send invoices, payments, expenses and transfers through QBO's
+        /batch endpoint, grouping concurrent creates into one request"""
+        self.batch = QBOBatch(self, max_size=max_size, linger=linger)
+
+    def _cache_key(self, *parts: str) -> str:
+        """Cache key for reference data (customers, items, ...) in this realm"""
+        return ":".join(["qbo", str(self.realm_id), *parts])
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled HTTP client shared by every QBO instance on this event loop"""
+        return get_client()
+
     async def _request(
         self, path: str, method: str = "GET", body: Optional[Mapping[str, Any]] = None
     ) -> Response:
@@ -45,6 +79,7 @@ class QBO:
             body=body,
             access_token=self.access_token,
             realm_id=self.realm_id,
+            client=self.client,
         )
         return response
 
@@ -54,13 +89,55 @@ class QBO:
             raise Exception(f"Query failed: {response.json()}")
         return response
 
-    async def _set_preferences(self) -> None:
-        response = await self._request(path="/preferences")
-        currency_prefs = response.json()["Preferences"]["CurrencyPrefs"]
-        tax_prefs = response.json()["Preferences"]["TaxPrefs"]
+    async def iter_query(
+        self,
+        entity: str,
+        model: Type[ModelT],
+        where: str = "",
+        order_by: Optional[str] = None,
+        page_size: int = MAX_QUERY_RESULTS,
+    ) -> AsyncIterator[ModelT]:
+        """Query every object of type entity, one page at a time.
+
+        Yields each object as an instance of model as soon as its page arrives."""
+        clauses = f"{where} ORDERBY {order_by}" if order_by else where
+        start_position = 1
+        while True:
+            response = await self._query(
+                f"select * from {entity} {clauses} "
+                + f"STARTPOSITION {start_position} MAXRESULTS {page_size}"
+            )
+            rows = response.json()["QueryResponse"].get(entity, [])
+            for row in rows:
+                yield model.model_validate(row)
+
+            if len(rows) < page_size:
+                break
+            start_position += page_size
 
-        self.home_currency = currency_prefs["HomeCurrency"]["value"]
-        self.using_sales_tax = tax_prefs["UsingSalesTax"]
+    async def _set_preferences(self) -> None:
+        cache_key = self._cache_key("preferences")
+        preferences = await self.cache.get(cache_key)
+        if preferences is None:
+            response = await self._request(path="/preferences")
+            currency_prefs = response.json()["Preferences"]["CurrencyPrefs"]
+            tax_prefs = response.json()["Preferences"]["TaxPrefs"]
+            preferences = {
+                "home_currency": currency_prefs["HomeCurrency"]["value"],
+                "using_sales_tax": tax_prefs["UsingSalesTax"],
+            }
+            await self.cache.set(cache_key, preferences)
+
+        self.home_currency = preferences["home_currency"]
+        self.using_sales_tax = preferences["using_sales_tax"]
+
+    async def invalidate_preferences(self, tax_code_ids: Iterable[str] = ()) -> None:
+        """Forget the cached preferences and tax codes of this realm,
+        so they are fetched again by the next sync"""
+        await self.cache.delete(
+            self._cache_key("preferences"),
+            *[self._cache_key("taxcode", tax_code_id) for tax_code_id in tax_code_ids],
+        )
 
     async def get_exchange_rate(self, currency: QBOCurrency, date: str) -> float:
         if self.home_currency == currency:
@@ -72,14 +149,21 @@ class QBO:
         return response.json()["ExchangeRate"]["Rate"]
 
     async def get_tax_code(self, tax_code_id: str) -> Optional[TaxCode]:
+        cache_key = self._cache_key("taxcode", tax_code_id)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return TaxCode.model_validate(cached)
+
         response = await self._query(
             f"select * from TaxCode where Id = '{tax_code_id}'"
         )
         tax_codes = response.json()["QueryResponse"].get("TaxCode", [])
         if len(tax_codes) == 0:
             return None
-        else:
-            return TaxCode(**tax_codes[0])
+
+        tax_code = TaxCode(**tax_codes[0])
+        await self.cache.set(cache_key, tax_code.model_dump())
+        return tax_code
 
     async def get_or_create_vendor(
         self, vendor_name: str, currency: Optional[QBOCurrency] = None
@@ -137,21 +221,31 @@ class QBO:
         )
         if "Customer" not in response.json():
             raise Exception(f"Error creating customer: {response.json()}")
-        return Customer(**response.json()["Customer"])
+        customer = Customer(**response.json()["Customer"])
+        await self.cache.set(
+            self._cache_key("customer", customer_name, currency), customer.model_dump()
+        )
+        return customer
 
     async def get_or_create_customer(
         self, customer_name: str, currency: QBOCurrency
     ) -> Customer:
+        cache_key = self._cache_key("customer", customer_name, currency)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return Customer.model_validate(cached)
+
         customer = await self.get_customer_by_name(customer_name)
         if customer is None:
             customer = await self.create_customer(customer_name, currency)
 
         if customer.CurrencyRef.value != currency:
             # if already exists with different currency, create a new one
-            return await self.get_or_create_customer(
+            customer = await self.get_or_create_customer(
                 f"{customer_name} ({currency})", currency
             )
 
+        await self.cache.set(cache_key, customer.model_dump())
         return customer
 
     async def get_item_by_name(self, item_name: str) -> Optional[ItemRef]:
@@ -178,15 +272,24 @@ class QBO:
             },
         )
 
-        return ItemRef(
+        item = ItemRef(
             value=response.json()["Item"]["Id"],
             name=response.json()["Item"]["Name"],
         )
+        await self.cache.set(self._cache_key("item", item_name), item.model_dump())
+        return item
 
     async def get_or_create_item(self, item_name: str, account_id: str) -> ItemRef:
+        cache_key = self._cache_key("item", item_name)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return ItemRef.model_validate(cached)
+
         item = await self.get_item_by_name(item_name)
         if item is None:
             item = await self.create_item(item_name, account_id)
+        else:
+            await self.cache.set(cache_key, item.model_dump())
         return item
 
     async def create_account(
@@ -206,7 +309,14 @@ class QBO:
         if account_sub_type is not None:
             body["AccountSubType"] = account_sub_type
         response = await self._request(path="/account", body=body, method="POST")
-        return response.json()["Account"]["Id"]
+        account_id = response.json()["Account"]["Id"]
+        await self.cache.set(
+            self._cache_key(
+                "account", account_name, str(currency or self.home_currency)
+            ),
+            account_id,
+        )
+        return account_id
 
     async def get_account_id(
         self, account_name: str, currency: Optional[QBOCurrency] = None
@@ -237,8 +347,15 @@ class QBO:
     ) -> str:
         if currency is None:
             currency = self.home_currency
+
+        cache_key = self._cache_key("account", account_name, str(currency))
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         account_id = await self.get_account_id(account_name, currency=currency)
         if account_id is not None:
+            await self.cache.set(cache_key, account_id)
             return account_id
         return await self.create_account(
             account_name,
@@ -247,32 +364,25 @@ class QBO:
             account_sub_type=account_sub_type,
         )
 
+    async def _create(self, entity: str, path: str, body: Mapping[str, Any]) -> str:
+        if self.batch is not None:
+            return await self.batch.create(entity, body)
+
+        response = await self._request(path=path, method="POST", body=body)
+        return response.json()[entity]["Id"]
+
     async def create_invoice(self, invoice: Invoice) -> str:
-        response = await self._request(
-            path="invoice",
-            method="POST",
-            body=invoice.model_dump(),
-        )
-        return response.json()["Invoice"]["Id"]
+        return await self._create("Invoice", "invoice", invoice.model_dump())
 
     async def create_payment(
         self,
         payment: Payment,
     ) -> str:
         # TODO: Payment method?
-        response = await self._request(
-            path="/payment", body=payment.model_dump(), method="POST"
-        )
-        return response.json()["Payment"]["Id"]
+        return await self._create("Payment", "/payment", payment.model_dump())
 
     async def create_expense(self, expense: Expense) -> str:
-        response = await self._request(
-            path="/purchase", body=expense.model_dump(), method="POST"
-        )
-        return response.json()["Purchase"]["Id"]
+        return await self._create("Purchase", "/purchase", expense.model_dump())
 
     async def create_transfer(self, transfer: Transfer) -> str:
-        response = await self._request(
-            path="/transfer", body=transfer.model_dump(), method="POST"
-        )
-        return response.json()["Transfer"]["Id"]
+        return await self._create("Transfer", "/transfer", transfer.model_dump())
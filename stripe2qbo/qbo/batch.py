@@ -0,0 +1,128 @@
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, NamedTuple, Set
+from contextlib import contextmanager
+import asyncio
+
+from stripe2qbo.exceptions import QBOException
+
+if TYPE_CHECKING:
+    from stripe2qbo.qbo.QBO import QBO
+
+# QBO rejects batch requests with more than 30 items
+MAX_BATCH_SIZE = 30
+
+
+class BatchItem(NamedTuple):
+    bId: str
+    entity: str
+    body: Mapping[str, Any]
+    future: "asyncio.Future[str]"
+
+
+class QBOBatch:
+    """Collects create operations for a single realm and sends them
+    through QBO's /batch endpoint.
+
+    Each call to `create` waits until its operation has been sent, and returns
+    the id of the created object, or raises a QBOException with the fault
+    returned by QBO for that item. A batch is sent once `max_size` operations
+    are pending, once every caller counted by `caller` is waiting on one,
+    or `linger` seconds after the first one was added."""
+
+    def __init__(
+        self, qbo: "QBO", max_size: int = MAX_BATCH_SIZE, linger: float = 0.05
+    ) -> None:
+        if not 0 < max_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"max_size must be between 1 and {MAX_BATCH_SIZE}")
+        self._qbo = qbo
+        self._max_size = max_size
+        self._linger = linger
+        self._pending: List[BatchItem] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: Set[asyncio.Task] = set()
+        self._next_id = 0
+        self._callers = 0
+
+    async def create(self, entity: str, body: Mapping[str, Any]) -> str:
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[str]" = loop.create_future()
+        self._next_id += 1
+        self._pending.append(BatchItem(str(self._next_id), entity, body, future))
+
+        if len(self._pending) >= self._max_size or self._all_waiting():
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._linger, self._schedule_flush)
+
+        return await future
+
+    @contextmanager
+    def caller(self) -> Iterator[None]:
+        """Count the block as a caller that may add operations, so that once
+        every such caller is waiting on one, the batch is sent without waiting
+        out the linger"""
+        self._callers += 1
+        try:
+            yield
+        finally:
+            self._callers -= 1
+            if len(self._pending) > 0 and self._all_waiting():
+                self._schedule_flush()
+
+    def _all_waiting(self) -> bool:
+        return self._callers > 0 and len(self._pending) >= self._callers
+
+    async def flush(self) -> None:
+        """Send all pending operations now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while len(self._pending) > 0:
+            items = self._pending[: self._max_size]
+            self._pending = self._pending[self._max_size :]
+            await self._send(items)
+
+    async def _send(self, items: List[BatchItem]) -> None:
+        try:
+            response = await self._qbo._request(
+                path="/batch",
+                method="POST",
+                body={
+                    "BatchItemRequest": [
+                        {"bId": item.bId, "operation": "create", item.entity: item.body}
+                        for item in items
+                    ]
+                },
+            )
+            results: Dict[str, Any] = {
+                result["bId"]: result
+                for result in response.json().get("BatchItemResponse", [])
+            }
+        except Exception as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        for item in items:
+            if item.future.done():
+                continue
+            result = results.get(item.bId)
+            if result is None:
+                item.future.set_exception(
+                    QBOException(f"No batch response for {item.entity}")
+                )
+            elif "Fault" in result:
+                item.future.set_exception(
+                    QBOException(
+                        result["Fault"]["Error"][0]["Detail"],
+                        intuit_tid=response.headers.get("intuit_tid"),
+                    )
+                )
+            else:
+                item.future.set_result(result[item.entity]["Id"])
+
+    def _schedule_flush(self) -> None:
+        task = asyncio.ensure_future(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
@@ -1,40 +1,164 @@
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+import asyncio
+import os
+import re
+import time
+import weakref
 
-from stripe2qbo.qbo.QBO import QBO
+from pydantic import BaseModel
 
+from stripe2qbo.metrics import existing_lookups, existing_scan_duration
+from stripe2qbo.qbo.QBO import QBO, MAX_QUERY_RESULTS
+import stripe2qbo.qbo.models as qbo_models
 
-async def check_for_existing(
-    object_type: str,
-    qbo_customer_id: Optional[str] = None,
-    date_string: Optional[str] = None,
-    private_note: Optional[str] = None,
-    qbo: QBO = QBO(),
-) -> Optional[str]:
-    """Query QBO for an object of type object_type.
+# Stripe ids written to the PrivateNote of synced objects:
+# charges (ch_, py_), balance transactions (txn_), payouts (po_) and invoices (in_)
+STRIPE_ID_PATTERN = re.compile(r"\b(?:ch|py|txn|po|in)_[A-Za-z0-9]+\b")
 
-    Returns:
-        str: QBO object id if found, else None"""
-    filter_string = ""
-    filters = []
+PAGE_SIZE = MAX_QUERY_RESULTS
 
-    if date_string is not None:
-        filters.append(f"TxnDate = '{date_string}'")
-    if qbo_customer_id is not None:
-        filters.append(f"CustomerRef = '{qbo_customer_id}'")
+# Ids checked per query for deleted objects, to keep the query URL short
+EXISTS_BATCH_SIZE = 100
 
-    if len(filters) > 0:
-        filter_string = "where " + " and ".join(filters)
+# Seconds during which a miss is trusted without asking QBO for newer objects.
+# Objects created in that time by another process are only found after it,
+# so lower it if several processes sync the same Stripe objects to a realm.
+REFRESH_INTERVAL = float(os.getenv("QBO_INDEX_REFRESH_INTERVAL", "5"))
 
-    response = await qbo._query(f"select * from {object_type} {filter_string}")
-    qbo_items = response.json()["QueryResponse"].get(object_type, [])
 
-    # Cannot query by PrivateNote, so we filter the returned items
-    if private_note is not None:
-        qbo_items = [
-            item for item in qbo_items if private_note in item.get("PrivateNote", "")
-        ]
+class NotedObject(BaseModel):
+    Id: str
+    PrivateNote: str = ""
+    MetaData: Optional[qbo_models.MetaData] = None
 
-    if len(qbo_items) == 0:
-        return None
 
-    return qbo_items[0]["Id"]
+class ExistingIndex:
+    """Index of the Stripe ids found in the PrivateNote of a realm's QBO objects.
+
+    The first lookup for an object type scans every object of that type once.
+    After that, a miss only asks QBO for objects updated since the last scan,
+    at most once every REFRESH_INTERVAL seconds, and objects created by this
+    process are added with `add`. Hits are trusted until the next refresh,
+    which checks in one query that the objects they returned still exist,
+    and drops the deleted ones from the index."""
+
+    def __init__(self) -> None:
+        self._ids: Dict[str, Dict[str, str]] = {}  # object_type: {stripe_id: Id}
+        # object_type: (parsed, original) LastUpdatedTime
+        self._last_updated: Dict[str, Tuple[datetime, str]] = {}
+        self._refreshed_at: Dict[str, float] = {}
+        # object_type: Ids returned by hits since the last refresh
+        self._hits: Dict[str, Set[str]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def add(self, object_type: str, stripe_id: str, qbo_id: str) -> None:
+        self._ids.setdefault(object_type, {})[stripe_id] = qbo_id
+
+    def discard(self, object_type: str, qbo_id: str) -> None:
+        """Forget every Stripe id of a QBO object that no longer exists"""
+        ids = self._ids.get(object_type, {})
+        for stripe_id in [key for key, value in ids.items() if value == qbo_id]:
+            del ids[stripe_id]
+
+    async def find(self, qbo: QBO, object_type: str, stripe_id: str) -> Optional[str]:
+        """Get the id of the QBO object whose PrivateNote contains stripe_id"""
+        qbo_id = self._ids.get(object_type, {}).get(stripe_id)
+        if qbo_id is not None:
+            self._hits.setdefault(object_type, set()).add(qbo_id)
+            existing_lookups.labels(
+                realm=qbo.realm_id, object_type=object_type, result="cached"
+            ).inc()
+            return qbo_id
+
+        await self.refresh(qbo, object_type)
+        qbo_id = self._ids[object_type].get(stripe_id)
+        existing_lookups.labels(
+            realm=qbo.realm_id,
+            object_type=object_type,
+            result="missing" if qbo_id is None else "found",
+        ).inc()
+        return qbo_id
+
+    async def _drop_deleted_hits(self, qbo: QBO, object_type: str) -> None:
+        hits: List[str] = sorted(self._hits.pop(object_type, set()))
+        for i in range(0, len(hits), EXISTS_BATCH_SIZE):
+            batch = hits[i : i + EXISTS_BATCH_SIZE]
+            id_list = ", ".join(f"'{qbo_id}'" for qbo_id in batch)
+            response = await qbo._query(
+                f"select * from {object_type} where Id in ({id_list}) "
+                + f"MAXRESULTS {EXISTS_BATCH_SIZE}"
+            )
+            rows = response.json()["QueryResponse"].get(object_type, [])
+            for qbo_id in set(batch) - {row["Id"] for row in rows}:
+                self.discard(object_type, qbo_id)
+
+    async def refresh(self, qbo: QBO, object_type: str) -> None:
+        requested_at = time.monotonic()
+        lock = self._locks.setdefault(object_type, asyncio.Lock())
+        async with lock:
+            # Another lookup may have refreshed while we were waiting
+            refreshed_at = self._refreshed_at.get(object_type)
+            if refreshed_at is not None and (
+                refreshed_at >= requested_at
+                or time.monotonic() - refreshed_at < REFRESH_INTERVAL
+            ):
+                return
+
+            started_at = time.monotonic()
+            await self._drop_deleted_hits(qbo, object_type)
+            await self._scan(qbo, object_type)
+            self._refreshed_at[object_type] = started_at
+            existing_scan_duration.labels(
+                realm=qbo.realm_id, object_type=object_type
+            ).observe(time.monotonic() - started_at)
+
+    async def _scan(self, qbo: QBO, object_type: str) -> None:
+        ids = self._ids.setdefault(object_type, {})
+        filter_string = ""
+        last_updated = self._last_updated.get(object_type)
+        if last_updated is not None:
+            filter_string = f"where MetaData.LastUpdatedTime >= '{last_updated[1]}'"
+
+        async for item in qbo.iter_query(
+            object_type,
+            NotedObject,
+            where=filter_string,
+            order_by="Id",
+            page_size=PAGE_SIZE,
+        ):
+            for stripe_id in STRIPE_ID_PATTERN.findall(item.PrivateNote):
+                ids.setdefault(stripe_id, item.Id)
+
+            updated = item.MetaData.LastUpdatedTime if item.MetaData else None
+            if updated is not None:
+                parsed = _parse_time(updated)
+                if last_updated is None or parsed > last_updated[0]:
+                    last_updated = (parsed, updated)
+
+        if last_updated is not None:
+            self._last_updated[object_type] = last_updated
+
+
+def _parse_time(value: str) -> datetime:
+    """Parse a QBO timestamp, so that times with different UTC offsets compare
+    by the instant they refer to"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+_indexes: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, Dict[str, ExistingIndex]
+] = weakref.WeakKeyDictionary()
+
+
+def get_existing_index(realm_id: str) -> ExistingIndex:
+    """Get the index for a realm, shared by every syncer on this event loop,
+    since its locks can't be shared between loops"""
+    indexes = _indexes.setdefault(asyncio.get_running_loop(), {})
+    index = indexes.get(realm_id)
+    if index is None:
+        index = indexes[realm_id] = ExistingIndex()
+    return index
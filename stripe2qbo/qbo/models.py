@@ -11,6 +11,11 @@ class CompanyInfo(BaseModel):
     Country: str
 
 
+class MetaData(BaseModel):
+    CreateTime: Optional[str] = None
+    LastUpdatedTime: Optional[str] = None
+
+
 class CurrencyRef(BaseModel):
     value: QBOCurrency
 
@@ -43,6 +48,31 @@ class TaxCode(BaseModel):
     SalesTaxRateList: TaxRateList
 
 
+class TaxCodeInfo(BaseModel):
+    Id: str
+    Name: str
+    Description: Optional[str] = None
+
+    model_config = {"extra": "allow"}
+
+
+class Account(BaseModel):
+    Id: str
+    Name: str
+    AccountType: str
+    CurrencyRef: Optional[ItemRef] = None
+
+    model_config = {"extra": "allow"}
+
+
+class Vendor(BaseModel):
+    Id: str
+    DisplayName: str
+    CurrencyRef: Optional[ItemRef] = None
+
+    model_config = {"extra": "allow"}
+
+
 class TaxLineDetail(BaseModel):
     TaxRateRef: Optional[ItemRef] = None
     PercentBased: bool = True
@@ -1,14 +1,112 @@
-from typing import Any, Optional, Mapping
+from typing import Any, Dict, Optional, Mapping
+import asyncio
 import os
+import re
+import uuid
+import weakref
 from dotenv import load_dotenv
 
 import httpx
 from httpx import Response
 
 from stripe2qbo.exceptions import QBOException
+from stripe2qbo.http_client import ClientPool
+from stripe2qbo.metrics import endpoint_name, track_request
+from stripe2qbo.rate_limit import (
+    RateLimiter,
+    backoff,
+    create_rate_limiter,
+    retry_after,
+)
 
 load_dotenv()
 
+QBO_MAX_CONNECTIONS = int(os.getenv("QBO_MAX_CONNECTIONS", "20"))
+QBO_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("QBO_MAX_KEEPALIVE_CONNECTIONS", str(QBO_MAX_CONNECTIONS))
+)
+QBO_KEEPALIVE_EXPIRY = float(os.getenv("QBO_KEEPALIVE_EXPIRY", "60"))
+QBO_TIMEOUT = float(os.getenv("QBO_TIMEOUT", "30"))
+QBO_HTTP2 = os.getenv("QBO_HTTP2", "true").lower() == "true"
+
+# QBO allows 500 requests per minute and 10 concurrent requests per realm.
+# The bucket refills at QBO_RATE_LIMIT per minute after a burst of QBO_RATE_BURST,
+# so the defaults stay under 500 in any minute.
+QBO_RATE_LIMIT = float(os.getenv("QBO_RATE_LIMIT", "450"))
+QBO_RATE_BURST = float(os.getenv("QBO_RATE_BURST", "50"))
+QBO_MAX_CONCURRENT_REQUESTS = int(os.getenv("QBO_MAX_CONCURRENT_REQUESTS", "10"))
+
+QBO_MAX_RETRIES = int(os.getenv("QBO_MAX_RETRIES", "5"))
+QBO_RETRY_BACKOFF = float(os.getenv("QBO_RETRY_BACKOFF", "1"))
+QBO_RETRY_MAX_BACKOFF = float(os.getenv("QBO_RETRY_MAX_BACKOFF", "60"))
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=QBO_HTTP2,
+        limits=httpx.Limits(
+            max_connections=QBO_MAX_CONNECTIONS,
+            max_keepalive_connections=QBO_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=QBO_KEEPALIVE_EXPIRY,
+        ),
+        timeout=QBO_TIMEOUT,
+    )
+
+
+_clients = ClientPool(_create_client)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared QBO client for the running event loop, creating it if needed.
+
+    Connections are kept alive and reused across requests, so consecutive calls
+    to QBO skip the TCP and TLS handshakes."""
+    return _clients.get()
+
+
+async def close_client() -> None:
+    """Close the shared QBO client, and the rate limiter's connections,
+    for the running event loop, if any."""
+    await _clients.aclose()
+    if _rate_limiter is not None:
+        await _rate_limiter.aclose()
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_semaphores: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]
+] = weakref.WeakKeyDictionary()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get the per-realm QBO rate limiter, shared through Redis if REDIS_URL is set"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = create_rate_limiter(
+            "qbo", rate=QBO_RATE_LIMIT / 60, capacity=QBO_RATE_BURST
+        )
+    return _rate_limiter
+
+
+def _get_semaphore(realm_id: str) -> asyncio.Semaphore:
+    semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    semaphore = semaphores.get(realm_id)
+    if semaphore is None:
+        semaphore = semaphores[realm_id] = asyncio.Semaphore(
+            QBO_MAX_CONCURRENT_REQUESTS
+        )
+    return semaphore
+
+
+def _query_entity(path: str) -> str:
+    """Entity queried by a /query request, e.g. Customer"""
+    match = re.search(r"from (\w+)", path, re.IGNORECASE)
+    return match[1] if match else ""
+
+
+def _should_retry(response: Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
 
 async def qbo_request(
     path: str,
@@ -16,27 +114,79 @@ async def qbo_request(
     body: Optional[Mapping[str, Any]] = None,
     access_token: str = "",
     realm_id: str = "",
+    client: Optional[httpx.AsyncClient] = None,
 ) -> Response:
+    """Make a request to the QBO API for a realm.
+
+    Requests are rate limited per realm. Throttled (429) and server error
+    responses are retried with backoff, waiting for Retry-After if QBO sends it.
+    Writes carry a requestid, so QBO won't apply a retried write twice."""
     if access_token == "":
         raise Exception("No access token provided")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.request(
-                method,
-                url=f"{os.getenv('QBO_BASE_URL', '')}/{realm_id}/{path}",
-                headers={
-                    "Accept": "application/json",
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {access_token}",
-                },
-                json=body,
-            )
-        except Exception as e:
-            raise Exception(f"Error making request: {e}")
-
-    # TODO: get intuit_tid from response headers and log it
-    if "Fault" in response.json():
-        raise QBOException(response.json()["Fault"]["Error"][0]["Detail"])
+    if client is None:
+        client = get_client()
+
+    params = {"requestid": uuid.uuid4().hex} if method != "GET" else None
+
+    endpoint = endpoint_name(path)
+    if endpoint == "/query" and body is None:
+        endpoint = f"/query {_query_entity(path)}"
+
+    with track_request("qbo", endpoint, realm_id) as tracked:
+        attempt = 0
+        while True:
+            await get_rate_limiter().acquire(realm_id)
+            try:
+                async with _get_semaphore(realm_id):
+                    response = await client.request(
+                        method,
+                        url=f"{os.getenv('QBO_BASE_URL', '')}/{realm_id}/{path}",
+                        params=params,
+                        headers={
+                            "Accept": "application/json",
+                            "Content-Type": "application/json",
+                            "Authorization": f"Bearer {access_token}",
+                        },
+                        json=body,
+                    )
+            except httpx.TransportError as e:
+                if attempt >= QBO_MAX_RETRIES:
+                    raise Exception(f"Error making request: {e}")
+                delay = backoff(attempt, QBO_RETRY_BACKOFF, QBO_RETRY_MAX_BACKOFF)
+            except Exception as e:
+                raise Exception(f"Error making request: {e}")
+            else:
+                if not _should_retry(response) or attempt >= QBO_MAX_RETRIES:
+                    break
+                wait = retry_after(response.headers)
+                if wait is not None:
+                    delay = wait
+                else:
+                    delay = backoff(attempt, QBO_RETRY_BACKOFF, QBO_RETRY_MAX_BACKOFF)
+
+            attempt += 1
+            tracked.retries = attempt
+            await asyncio.sleep(delay)
+
+        tracked.status = response.status_code
+        # Intuit's id for the request, to quote when reporting issues to Intuit
+        intuit_tid = response.headers.get("intuit_tid")
+        tracked.span.set_attribute("intuit_tid", intuit_tid or "")
+
+    try:
+        json = response.json()
+    except ValueError:
+        raise _failure(
+            f"QBO request failed with status {response.status_code}", intuit_tid
+        )
+
+    if "Fault" in json:
+        raise _failure(json["Fault"]["Error"][0]["Detail"], intuit_tid)
 
     return response
+
+
+def _failure(message: str, intuit_tid: Optional[str]) -> QBOException:
+    print("QBO request failed:", message, "intuit_tid:", intuit_tid)
+    return QBOException(message, intuit_tid=intuit_tid)
@@ -0,0 +1,137 @@
+from typing import Dict, Mapping, Optional, Tuple
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import asyncio
+import os
+import random
+import time
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+from stripe2qbo.http_client import ClientPool
+
+load_dotenv()
+
+# Atomically refill a bucket and reserve one token from it.
+# Returns the seconds to wait before using the token, as a string
+# since Redis truncates Lua numbers to integers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + (now - updated) * rate) - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+
+class RateLimiter(ABC):
+    """Token bucket per key, refilled at `rate` tokens per second up to `capacity`.
+
+    Each request reserves a token, waiting if the bucket is empty, so waiting
+    requests are served in order instead of retrying against each other."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+
+    async def acquire(self, key: str) -> None:
+        delay = await self.reserve(key)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @abstractmethod
+    async def reserve(self, key: str) -> float:
+        """Reserve a token, returning the seconds to wait before it can be used"""
+
+    async def aclose(self) -> None:
+        """Close the connections opened in the running event loop, if any"""
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Rate limiter for a single process"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        super().__init__(rate, capacity)
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key: (tokens, updated)
+
+    async def reserve(self, key: str) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate) - 1
+        self._buckets[key] = (tokens, now)
+        return max(0.0, -tokens / self.rate)
+
+
+class RedisRateLimiter(RateLimiter):
+    """Rate limiter shared by every process connected to the same Redis server.
+
+    If Redis is unavailable, each process limits itself on its own."""
+
+    def __init__(self, url: str, prefix: str, rate: float, capacity: float) -> None:
+        super().__init__(rate, capacity)
+        self._clients: ClientPool[redis.Redis] = ClientPool(
+            lambda: redis.Redis.from_url(url)
+        )
+        # Run with the running loop's client. Registering doesn't connect.
+        self._script = redis.Redis.from_url(url).register_script(TOKEN_BUCKET_SCRIPT)
+        self._prefix = prefix
+        self._fallback = MemoryRateLimiter(rate, capacity)
+
+    async def reserve(self, key: str) -> float:
+        try:
+            delay = await self._script(
+                keys=[f"{self._prefix}:{key}"],
+                args=[self.rate, self.capacity],
+                client=self._clients.get(),
+            )
+        except redis.RedisError:
+            return await self._fallback.reserve(key)
+        return float(delay)
+
+    async def aclose(self) -> None:
+        await self._clients.aclose()
+
+
+def create_rate_limiter(prefix: str, rate: float, capacity: float) -> RateLimiter:
+    """Create a rate limiter, backed by Redis if REDIS_URL is set"""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisRateLimiter(redis_url, f"ratelimit:{prefix}", rate, capacity)
+    return MemoryRateLimiter(rate, capacity)
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header, if there is one"""
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff(attempt: int, base: float, maximum: float) -> float:
+    """Exponential backoff with full jitter, for retry number `attempt` (from 0)"""
+    return random.uniform(0, min(maximum, base * 2**attempt))
@@ -0,0 +1,208 @@
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
+import asyncio
+import os
+import uuid
+import weakref
+
+import httpx
+import stripe
+from stripe.stripe_object import StripeObject
+from stripe.util import convert_to_stripe_object
+from dotenv import load_dotenv
+
+from stripe2qbo.http_client import ClientPool
+from stripe2qbo.metrics import endpoint_name, track_request
+from stripe2qbo.rate_limit import (
+    RateLimiter,
+    backoff,
+    create_rate_limiter,
+    retry_after,
+)
+
+load_dotenv()
+
+stripe.api_key = os.getenv("STRIPE_API_KEY")
+
+STRIPE_MAX_CONNECTIONS = int(os.getenv("STRIPE_MAX_CONNECTIONS", "20"))
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "80"))
+
+# Stripe allows 100 requests per second in live mode, and 25 in test mode
+STRIPE_RATE_LIMIT = float(os.getenv("STRIPE_RATE_LIMIT", "80"))
+STRIPE_MAX_CONCURRENT_REQUESTS = int(os.getenv("STRIPE_MAX_CONCURRENT_REQUESTS", "20"))
+
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "5"))
+STRIPE_RETRY_BACKOFF = float(os.getenv("STRIPE_RETRY_BACKOFF", "0.5"))
+STRIPE_RETRY_MAX_BACKOFF = float(os.getenv("STRIPE_RETRY_MAX_BACKOFF", "20"))
+
+# Requests made with the stripe SDK retry on their own
+stripe.max_network_retries = STRIPE_MAX_RETRIES
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=STRIPE_MAX_CONNECTIONS,
+            max_keepalive_connections=STRIPE_MAX_CONNECTIONS,
+        ),
+        timeout=STRIPE_TIMEOUT,
+    )
+
+
+_clients = ClientPool(_create_client)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared Stripe client for the running event loop"""
+    return _clients.get()
+
+
+async def close_client() -> None:
+    """Close the shared Stripe client, and the rate limiter's connections,
+    for the running event loop, if any."""
+    await _clients.aclose()
+    if _rate_limiter is not None:
+        await _rate_limiter.aclose()
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_semaphores: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]
+] = weakref.WeakKeyDictionary()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get the per-account Stripe rate limiter, shared through Redis if REDIS_URL
+    is set"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = create_rate_limiter(
+            "stripe", rate=STRIPE_RATE_LIMIT, capacity=STRIPE_RATE_LIMIT
+        )
+    return _rate_limiter
+
+
+def _get_semaphore(account_id: str) -> asyncio.Semaphore:
+    semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    semaphore = semaphores.get(account_id)
+    if semaphore is None:
+        semaphore = semaphores[account_id] = asyncio.Semaphore(
+            STRIPE_MAX_CONCURRENT_REQUESTS
+        )
+    return semaphore
+
+
+def _should_retry(response: httpx.Response) -> bool:
+    # Stripe tells us when it knows better, e.g. for lock timeouts
+    should_retry = response.headers.get("Stripe-Should-Retry")
+    if should_retry is not None:
+        return should_retry == "true"
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def _encode_params(
+    params: Mapping[str, Any], prefix: Optional[str] = None
+) -> Iterator[Tuple[str, str]]:
+    """Encode params the way Stripe expects, e.g. created[gte]=1&expand[0]=source"""
+    for key, value in params.items():
+        if value is None:
+            continue
+        name = f"{prefix}[{key}]" if prefix else key
+        if isinstance(value, Mapping):
+            yield from _encode_params(value, name)
+        elif isinstance(value, (list, tuple)):
+            yield from _encode_params({str(i): v for i, v in enumerate(value)}, name)
+        elif isinstance(value, bool):
+            yield name, str(value).lower()
+        else:
+            yield name, str(value)
+
+
+def _raise_for_error(response: httpx.Response) -> None:
+    if response.status_code < 400:
+        return
+
+    try:
+        json_body = response.json()
+        error: Dict[str, Any] = json_body.get("error", {})
+    except ValueError:
+        json_body, error = None, {}
+
+    message = error.get("message", response.text)
+    args = (message, response.text, response.status_code, json_body, response.headers)
+    if response.status_code == 429:
+        raise stripe.error.RateLimitError(*args)
+    if response.status_code in [400, 404]:
+        raise stripe.error.InvalidRequestError(
+            message, error.get("param"), error.get("code"), *args[1:]
+        )
+    if response.status_code == 401:
+        raise stripe.error.AuthenticationError(*args)
+    if response.status_code == 403:
+        raise stripe.error.PermissionError(*args)
+    raise stripe.error.APIError(*args)
+
+
+async def stripe_request(
+    path: str,
+    params: Optional[Mapping[str, Any]] = None,
+    account_id: Optional[str] = None,
+    method: str = "GET",
+    client: Optional[httpx.AsyncClient] = None,
+) -> StripeObject:
+    """Call the Stripe API without blocking the event loop.
+
+    Requests are rate limited per connected account. Rate limited and failed
+    requests are retried with backoff, with the same Idempotency-Key for writes.
+    Returns the same StripeObjects as the stripe SDK, and raises the same errors."""
+    if client is None:
+        client = get_client()
+
+    headers = {"Authorization": f"Bearer {stripe.api_key}"}
+    if account_id:
+        headers["Stripe-Account"] = account_id
+    if stripe.api_version:
+        headers["Stripe-Version"] = stripe.api_version
+    if method != "GET":
+        headers["Idempotency-Key"] = str(uuid.uuid4())
+
+    encoded = tuple(_encode_params(params or {}))
+    key = account_id or "platform"
+
+    with track_request("stripe", endpoint_name(path), key) as tracked:
+        attempt = 0
+        while True:
+            await get_rate_limiter().acquire(key)
+            try:
+                async with _get_semaphore(key):
+                    response = await client.request(
+                        method,
+                        url=f"{stripe.api_base}{path}",
+                        headers=headers,
+                        params=encoded if method == "GET" else None,
+                        data=dict(encoded) if method != "GET" else None,
+                    )
+            except httpx.HTTPError as e:
+                if attempt >= STRIPE_MAX_RETRIES:
+                    raise stripe.error.APIConnectionError(f"Error making request: {e}")
+                delay = backoff(attempt, STRIPE_RETRY_BACKOFF, STRIPE_RETRY_MAX_BACKOFF)
+            else:
+                if not _should_retry(response) or attempt >= STRIPE_MAX_RETRIES:
+                    break
+                wait = retry_after(response.headers)
+                if wait is not None:
+                    delay = wait
+                else:
+                    delay = backoff(
+                        attempt, STRIPE_RETRY_BACKOFF, STRIPE_RETRY_MAX_BACKOFF
+                    )
+
+            attempt += 1
+            tracked.retries = attempt
+            await asyncio.sleep(delay)
+
+        tracked.status = response.status_code
+
+    _raise_for_error(response)
+    return convert_to_stripe_object(
+        response.json(), stripe.api_key, stripe.api_version, account_id
+    )
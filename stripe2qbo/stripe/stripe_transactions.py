@@ -1,5 +1,10 @@
-from typing import List, Optional, Dict, Any
+from typing import cast, Iterable, List, Optional, Dict, Any, Set, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import threading
+import weakref
 import stripe
 
 from stripe2qbo.stripe.models import (
@@ -11,6 +16,8 @@ from stripe2qbo.stripe.models import (
     Product,
     Transaction,
 )
+from stripe2qbo.stripe.stripe_request import stripe_request
+from stripe2qbo.metrics import track_request
 
 from dotenv import load_dotenv
 
@@ -18,8 +25,167 @@ load_dotenv()
 
 stripe.api_key = os.getenv("STRIPE_API_KEY")
 
+# Max concurrent requests when fetching products and tax rates for a page
+STRIPE_FETCH_CONCURRENCY = int(os.getenv("STRIPE_FETCH_CONCURRENCY", "8"))
+EXPANSION_CACHE_SIZE = 4096
+
+TRANSACTION_EXPAND = [
+    "source",
+    "source.customer",
+    "source.invoice",
+    "source.charge",
+]
+TRANSACTIONS_EXPAND = [f"data.{field}" for field in TRANSACTION_EXPAND]
+
+_RESOURCES: Dict[str, Tuple[Any, str]] = {
+    "product": (stripe.Product, "/v1/products"),
+    "tax_rate": (stripe.TaxRate, "/v1/tax_rates"),
+}
+
+Expansions = Dict[Tuple[str, str], Dict[str, Any]]
+
+
+class ExpansionCache:
+    """Products and tax rates by (kind, id, account_id), evicting the least
+    recently used once there are more than EXPANSION_CACHE_SIZE"""
+
+    def __init__(self) -> None:
+        self._items: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Tuple[str, str, str], value: Dict[str, Any]) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > EXPANSION_CACHE_SIZE:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+# Shared by the threads of prefetch_expansions, hence the lock
+_expansions = ExpansionCache()
+_expansions_lock = threading.Lock()
+
+# One per event loop, only ever used from the loop's thread
+_loop_expansions: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, ExpansionCache
+] = weakref.WeakKeyDictionary()
+
+
+def _retrieve(kind: str, object_id: str, account_id: str) -> Dict[str, Any]:
+    key = (kind, object_id, account_id)
+    with _expansions_lock:
+        cached = _expansions.get(key)
+    if cached is not None:
+        return cached
+
+    resource, path = _RESOURCES[kind]
+    with track_request("stripe", f"{path}/{{id}}", account_id) as tracked:
+        value = resource.retrieve(object_id, stripe_account=account_id).to_dict()
+        tracked.status = 200
+    with _expansions_lock:
+        _expansions.put(key, value)
+    return value
+
+
+async def _retrieve_async(kind: str, object_id: str, account_id: str) -> Dict[str, Any]:
+    cache = _loop_expansions.setdefault(asyncio.get_running_loop(), ExpansionCache())
+    key = (kind, object_id, account_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    _, path = _RESOURCES[kind]
+    value = (
+        await stripe_request(f"{path}/{object_id}", account_id=account_id)
+    ).to_dict()
+    cache.put(key, value)
+    return value
+
+
+def _line_product_id(line: stripe.InvoiceLineItem) -> Optional[str]:
+    if line.plan:
+        return line.plan.product
+    elif line.price:
+        return line.price.product
+    return None
+
+
+def _expansion_ids(txns: Iterable[stripe.BalanceTransaction]) -> Set[Tuple[str, str]]:
+    ids: Set[Tuple[str, str]] = set()
+    for txn in txns:
+        source = txn.get("source")
+        if txn.type not in ["charge", "payment"] or not source:
+            continue
+        if not source.get("invoice"):
+            continue
+        for line in source.invoice.lines.data:
+            product_id = _line_product_id(line)
+            if product_id is not None:
+                ids.add(("product", product_id))
+            for tax_amount in line.tax_amounts:
+                ids.add(("tax_rate", tax_amount.tax_rate))
+    return ids
+
+
+def prefetch_expansions(
+    txns: Iterable[stripe.BalanceTransaction], account_id: str
+) -> Expansions:
+    """Fetch the products and tax rates of every invoice line in txns.
+
+    Each unique id is fetched once, in parallel, and cached. They are
+    returned by (kind, id) for build_transaction, so that it doesn't have to
+    request them one by one."""
+    ids = _expansion_ids(txns)
+    if len(ids) == 0:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=STRIPE_FETCH_CONCURRENCY) as executor:
+        futures = {
+            (kind, object_id): executor.submit(_retrieve, kind, object_id, account_id)
+            for kind, object_id in ids
+        }
+        return {key: future.result() for key, future in futures.items()}
+
+
+async def prefetch_expansions_async(
+    txns: Iterable[stripe.BalanceTransaction], account_id: str
+) -> Expansions:
+    """Same as prefetch_expansions, without blocking the event loop.
+
+    The cache is kept per event loop, so each worker loop has its own."""
+    semaphore = asyncio.Semaphore(STRIPE_FETCH_CONCURRENCY)
+
+    async def _fetch(kind: str, object_id: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await _retrieve_async(kind, object_id, account_id)
+
+    ids = list(_expansion_ids(txns))
+    values = await asyncio.gather(*[_fetch(kind, object_id) for kind, object_id in ids])
+    return dict(zip(ids, values))
+
+
+def build_transaction(
+    txn: stripe.BalanceTransaction,
+    account_id: str,
+    expansions: Optional[Expansions] = None,
+) -> Transaction:
+    """Build a Transaction from an expanded balance transaction.
+
+    Products and tax rates are taken from expansions, as returned by
+    prefetch_expansions, or retrieved one by one when it isn't given."""
+
+    def expansion(kind: str, object_id: str) -> Dict[str, Any]:
+        if expansions is not None:
+            return expansions[(kind, object_id)]
+        return _retrieve(kind, object_id, account_id)
 
-def build_transaction(txn: stripe.BalanceTransaction, account_id: str) -> Transaction:
     description = txn.description or ""
     del txn.description
     transaction = Transaction(**txn.to_dict(), description=description)
@@ -32,23 +198,14 @@ def build_transaction(txn: stripe.BalanceTransaction, account_id: str) -> Transa
         if inv:
             lines: List[InvoiceLine] = []
             for line in inv.lines.data:
-                product: Dict[str, Any] = {}
-                if line.plan:
-                    product = stripe.Product.retrieve(
-                        line.plan.product, stripe_account=account_id
-                    ).to_dict()
-                elif line.price:
-                    product = stripe.Product.retrieve(
-                        line.price.product, stripe_account=account_id
-                    ).to_dict()
-                else:
-                    product = {"name": "Unknown"}
+                product: Dict[str, Any] = {"name": "Unknown"}
+                product_id = _line_product_id(line)
+                if product_id is not None:
+                    product = expansion("product", product_id)
                 tax_amounts = []
                 for tax_amount in line.tax_amounts:
                     amt = tax_amount
-                    amt.tax_rate = stripe.TaxRate.retrieve(
-                        tax_amount.tax_rate, stripe_account=account_id
-                    )
+                    amt.tax_rate = expansion("tax_rate", tax_amount.tax_rate)
                     tax_amounts.append(amt)
                 line.tax_amounts = tax_amounts
                 line = InvoiceLine(**line, product=Product(**product))
@@ -61,19 +218,32 @@ def build_transaction(txn: stripe.BalanceTransaction, account_id: str) -> Transa
 
 
 def get_transaction(transaction_id: str, account_id: str) -> Transaction:
-    txn = stripe.BalanceTransaction.retrieve(
-        transaction_id,
-        expand=[
-            "source",
-            "source.customer",
-            "source.invoice",
-            "source.charge",
-        ],
-        stripe_account=account_id,
-    )
+    with track_request(
+        "stripe", "/v1/balance_transactions/{id}", account_id
+    ) as tracked:
+        txn = stripe.BalanceTransaction.retrieve(
+            transaction_id,
+            expand=TRANSACTION_EXPAND,
+            stripe_account=account_id,
+        )
+        tracked.status = 200
     return build_transaction(txn, account_id)
 
 
+async def get_transaction_async(transaction_id: str, account_id: str) -> Transaction:
+    """Same as get_transaction, without blocking the event loop"""
+    txn = cast(
+        stripe.BalanceTransaction,
+        await stripe_request(
+            f"/v1/balance_transactions/{transaction_id}",
+            params={"expand": TRANSACTION_EXPAND},
+            account_id=account_id,
+        ),
+    )
+    expansions = await prefetch_expansions_async([txn], account_id)
+    return build_transaction(txn, account_id, expansions)
+
+
 def get_transactions(
     account_id: str,
     from_timestamp: Optional[int] = None,
@@ -84,24 +254,51 @@ def get_transactions(
     starting_after: Optional[str] = None,
 ) -> List[Transaction]:
     # TODO: paginatition when N > 100
-    txns = stripe.BalanceTransaction.list(
-        limit=limit,
-        currency=currency,
-        created={"gte": from_timestamp, "lte": to_timestamp},
-        type=transaction_type,
-        expand=[
-            "data.source.customer",
-            "data.source.invoice",
-            "data.source.charge",
-            "data.source",
-        ],
-        starting_after=starting_after,
-        stripe_account=account_id,
-    )
+    with track_request("stripe", "/v1/balance_transactions", account_id) as tracked:
+        txns = stripe.BalanceTransaction.list(
+            limit=limit,
+            currency=currency,
+            created={"gte": from_timestamp, "lte": to_timestamp},
+            type=transaction_type,
+            expand=TRANSACTIONS_EXPAND,
+            starting_after=starting_after,
+            stripe_account=account_id,
+        )
+        tracked.status = 200
+
+    expansions = prefetch_expansions(txns, account_id)
 
     transactions = []
     for txn in txns:
-        transaction = build_transaction(txn, account_id)
+        transaction = build_transaction(txn, account_id, expansions)
         transactions.append(transaction)
 
     return transactions
+
+
+async def get_transactions_async(
+    account_id: str,
+    from_timestamp: Optional[int] = None,
+    to_timestamp: Optional[int] = None,
+    transaction_type: Optional[str] = None,
+    currency: Optional[str] = None,
+    limit: Optional[int] = 100,
+    starting_after: Optional[str] = None,
+) -> List[Transaction]:
+    """Same as get_transactions, without blocking the event loop"""
+    txns = await stripe_request(
+        "/v1/balance_transactions",
+        params={
+            "limit": limit,
+            "currency": currency,
+            "created": {"gte": from_timestamp, "lte": to_timestamp},
+            "type": transaction_type,
+            "expand": TRANSACTIONS_EXPAND,
+            "starting_after": starting_after,
+        },
+        account_id=account_id,
+    )
+
+    expansions = await prefetch_expansions_async(txns.data, account_id)
+
+    return [build_transaction(txn, account_id, expansions) for txn in txns.data]
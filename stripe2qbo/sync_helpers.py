@@ -1,4 +1,5 @@
-from typing import Dict, cast, Optional
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Tuple, cast, Optional
+from functools import cached_property
 import datetime
 
 from stripe2qbo.db.schemas import Settings
@@ -10,89 +11,313 @@ def _timestamp_to_date(timestamp: int) -> datetime.datetime:
     return datetime.datetime.fromtimestamp(timestamp)
 
 
+class DateFormatter:
+    """Formats timestamps as local dates (YYYY-MM-DD).
+
+    Remembers the bounds of the last day formatted, so consecutive timestamps
+    from the same day are formatted once."""
+
+    def __init__(self) -> None:
+        self._day: Tuple[float, float, str] = (0, 0, "")  # start, end, date
+
+    def __call__(self, timestamp: int) -> str:
+        start, end, date = self._day
+        if start <= timestamp < end:
+            return date
+
+        day = _timestamp_to_date(timestamp).date()
+        midnight = datetime.datetime.combine(day, datetime.time())
+        self._day = (
+            midnight.timestamp(),
+            (midnight + datetime.timedelta(days=1)).timestamp(),
+            day.isoformat(),
+        )
+        return self._day[2]
+
+
+class TransactionPayloads(NamedTuple):
+    """QBO objects to create for a Stripe transaction"""
+
+    transaction_id: str
+    invoice: Optional[qbo_models.Invoice] = None
+    payment: Optional[qbo_models.Payment] = None
+    expense: Optional[qbo_models.Expense] = None
+    transfer: Optional[qbo_models.Transfer] = None
+
+
+class Transformer:
+    """Converts Stripe objects to QBO objects, for one realm's settings.
+
+    References to the accounts in the settings are built once and shared by
+    every object, so converting many objects with one Transformer is cheaper
+    than calling the functions below for each. (Models are still validated:
+    with pydantic 2, model_construct is slower for models this small.)"""
+
+    def __init__(
+        self,
+        settings: Settings,
+        tax_codes: Optional[Dict[str, qbo_models.TaxCode | None]] = None,
+    ) -> None:
+        self.settings = settings
+        self.tax_codes = tax_codes or {}
+        self._format_date = DateFormatter()
+        self._currencies: Dict[str, qbo_models.CurrencyRef] = {}
+
+    # Built on first use, so that converting a single object stays cheap
+    @cached_property
+    def _clearing_account(self) -> qbo_models.ItemRef:
+        return qbo_models.ItemRef(value=self.settings.stripe_clearing_account_id)
+
+    @cached_property
+    def _payout_account(self) -> qbo_models.ItemRef:
+        return qbo_models.ItemRef(value=self.settings.stripe_payout_account_id)
+
+    @cached_property
+    def _fee_account(self) -> qbo_models.ItemRef:
+        return qbo_models.ItemRef(value=self.settings.stripe_fee_account_id)
+
+    @cached_property
+    def _vendor(self) -> qbo_models.ItemRef:
+        return qbo_models.ItemRef(value=self.settings.stripe_vendor_id)
+
+    @cached_property
+    def _default_tax_code(self) -> qbo_models.TaxCodeRef:
+        return qbo_models.TaxCodeRef(value=self.settings.default_tax_code_id)
+
+    @cached_property
+    def _exempt_tax_code(self) -> qbo_models.TaxCodeRef:
+        return qbo_models.TaxCodeRef(value=self.settings.exempt_tax_code_id)
+
+    def _currency(self, currency: str) -> qbo_models.CurrencyRef:
+        currency_ref = self._currencies.get(currency)
+        if currency_ref is None:
+            currency_ref = qbo_models.CurrencyRef(
+                value=cast(qbo_models.QBOCurrency, currency.upper())
+            )
+            self._currencies[currency] = currency_ref
+        return currency_ref
+
+    def transfer(self, payout: stripe_models.Payout) -> qbo_models.Transfer:
+        if payout.amount > 0:
+            amount = payout.amount
+            to_account = self._payout_account
+            from_account = self._clearing_account
+        else:
+            amount = payout.amount * -1
+            to_account = self._clearing_account
+            from_account = self._payout_account
+
+        return qbo_models.Transfer(
+            Amount=amount / 100,
+            FromAccountRef=from_account,
+            ToAccountRef=to_account,
+            # TODO: use arrival date?
+            TxnDate=self._format_date(payout.created),
+            PrivateNote=f"{payout.description}\n{payout.id}",
+        )
+
+    def expense(self, transaction: stripe_models.Transaction) -> qbo_models.Expense:
+        if transaction.type in ["charge", "payment"]:
+            charge = cast(stripe_models.Charge, transaction.charge)
+            amount = transaction.fee / 100
+            description = f"Stripe fee for charge {charge.id}"
+        else:
+            amount = -transaction.amount / 100
+            description = transaction.description or ""
+
+        return qbo_models.Expense(
+            TotalAmt=amount,
+            ExchangeRate=transaction.exchange_rate or 1.0,
+            CurrencyRef=self._currency(transaction.currency),
+            AccountRef=self._clearing_account,
+            EntityRef=self._vendor,
+            TxnDate=self._format_date(transaction.created),
+            PrivateNote=f"""
+            {description}
+            {transaction.id}
+            {transaction.charge.id if transaction.charge else None}
+        """,
+            Line=[
+                qbo_models.ExpenseLine(
+                    Amount=amount,
+                    AccountBasedExpenseLineDetail=(
+                        qbo_models.AccountBasedExpenseLineDetail(
+                            AccountRef=self._fee_account
+                        )
+                    ),
+                    Description=transaction.description,
+                )
+            ],
+        )
+
+    def invoice_line(self, line: stripe_models.InvoiceLine) -> qbo_models.InvoiceLine:
+        return qbo_models.InvoiceLine(
+            Amount=line.amount / 100,
+            Description=line.description,
+            SalesItemLineDetail=qbo_models.SalesItemLineDetail(
+                ItemRef=qbo_models.ProductItemRef(name=line.product.name),
+                TaxCodeRef=self._default_tax_code
+                if line.tax_amounts
+                else self._exempt_tax_code,
+            ),
+        )
+
+    def _tax_rate_ref(self, tax_code_id: str) -> qbo_models.ItemRef:
+        tax_code = cast(qbo_models.TaxCode, self.tax_codes[tax_code_id])
+        return tax_code.SalesTaxRateList.TaxRateDetail[0].TaxRateRef
+
+    def tax_detail(self, invoice: stripe_models.Invoice) -> qbo_models.TaxDetail:
+        total_tax = invoice.tax or 0
+        total_taxable_amount = 0
+        tax_details: Dict[str, qbo_models.TaxLineModel] = {}
+
+        tax_code_id = self.settings.default_tax_code_id
+        for line in invoice.lines:
+            for tax_amount in line.tax_amounts:
+                assert tax_amount.tax_rate is not None
+                total_taxable_amount += tax_amount.taxable_amount
+
+                if tax_code_id == "TAX" or tax_code_id == "":
+                    # Don't need TaxLineDetail if using default tax code
+                    continue
+
+                detail = tax_details.get(tax_code_id)
+                if detail is not None:
+                    detail.Amount += tax_amount.amount / 100
+                    detail.TaxLineDetail.NetAmountTaxable += (
+                        tax_amount.taxable_amount / 100
+                    )
+                else:
+                    tax_details[tax_code_id] = qbo_models.TaxLineModel(
+                        Amount=tax_amount.amount / 100,
+                        TaxLineDetail=qbo_models.TaxLineDetail(
+                            TaxRateRef=self._tax_rate_ref(tax_code_id),
+                            NetAmountTaxable=tax_amount.taxable_amount / 100,
+                            TaxPercent=tax_amount.tax_rate.percentage,
+                        ),
+                    )
+
+        untaxed_amount = invoice.amount_due - total_tax - total_taxable_amount
+        exempt_tax_code_id = self.settings.exempt_tax_code_id
+        if untaxed_amount > 0 and exempt_tax_code_id not in ("NON", ""):
+            tax_details[exempt_tax_code_id] = qbo_models.TaxLineModel(
+                Amount=0,
+                TaxLineDetail=qbo_models.TaxLineDetail(
+                    TaxRateRef=self._tax_rate_ref(exempt_tax_code_id),
+                    NetAmountTaxable=(untaxed_amount) / 100,
+                    TaxPercent=0,
+                ),
+            )
+
+        return qbo_models.TaxDetail(
+            TaxLine=list(tax_details.values()),
+            TotalTax=total_tax / 100,
+        )
+
+    def invoice(
+        self,
+        invoice: stripe_models.Invoice,
+        customer_id: str,
+        exchange_rate: float = 1.0,
+    ) -> qbo_models.Invoice:
+        return qbo_models.Invoice(
+            CustomerRef=qbo_models.ItemRef(value=customer_id),
+            CurrencyRef=self._currency(invoice.currency),
+            ExchangeRate=exchange_rate,
+            TxnDate=self._format_date(invoice.created),
+            DueDate=self._format_date(invoice.due_date) if invoice.due_date else None,
+            Line=[self.invoice_line(line) for line in invoice.lines],
+            DocNumber=invoice.number,
+            PrivateNote=f"{invoice.number}\n{invoice.id}",
+            TxnTaxDetail=self.tax_detail(invoice),
+        )
+
+    def payment(
+        self,
+        charge: stripe_models.Charge,
+        customer_id: str,
+        invoice_id: Optional[str] = None,
+        exchange_rate: float = 1.0,
+    ) -> qbo_models.Payment:
+        amount = charge.amount / 100
+        lines = None
+        if invoice_id:
+            lines = [
+                qbo_models.PaymentLine(
+                    Amount=amount,
+                    LinkedTxn=[qbo_models.LinkedTxn(TxnId=invoice_id)],
+                )
+            ]
+
+        return qbo_models.Payment(
+            TotalAmt=amount,
+            CurrencyRef=self._currency(charge.currency),
+            CustomerRef=qbo_models.ItemRef(value=customer_id),
+            DepositToAccountRef=self._clearing_account,
+            TxnDate=self._format_date(charge.created),
+            PrivateNote=f"{charge.description}\n{charge.id}",
+            ExchangeRate=exchange_rate,
+            Line=lines,
+        )
+
+    def transform_all(
+        self,
+        transactions: Iterable[stripe_models.Transaction],
+        customer_ids: Mapping[str, str],
+        invoice_ids: Optional[Mapping[str, str]] = None,
+    ) -> List[TransactionPayloads]:
+        """Convert transactions to the QBO objects that sync them, in one pass.
+
+        customer_ids maps the id of each transaction with a charge to its QBO
+        customer, and invoice_ids maps Stripe invoice ids to QBO invoices
+        created already, to link their payments."""
+        invoice_ids = invoice_ids or {}
+        payloads: List[TransactionPayloads] = []
+        for transaction in transactions:
+            exchange_rate = transaction.exchange_rate or 1.0
+            invoice = payment = expense = transfer = None
+            if transaction.charge:
+                customer_id = customer_ids[transaction.id]
+                if transaction.invoice:
+                    invoice = self.invoice(
+                        transaction.invoice, customer_id, exchange_rate
+                    )
+                payment = self.payment(
+                    transaction.charge,
+                    customer_id,
+                    invoice_ids.get(transaction.invoice.id)
+                    if transaction.invoice
+                    else None,
+                    exchange_rate,
+                )
+            if transaction.charge or transaction.type == "stripe_fee":
+                expense = self.expense(transaction)
+            if transaction.payout:
+                transfer = self.transfer(transaction.payout)
+            payloads.append(
+                TransactionPayloads(transaction.id, invoice, payment, expense, transfer)
+            )
+        return payloads
+
+
 def transfer_from_payout(
     payout: stripe_models.Payout, settings: Settings
 ) -> qbo_models.Transfer:
-    if payout.amount > 0:
-        amount = payout.amount
-        to_account = settings.stripe_payout_account_id
-        from_account = settings.stripe_clearing_account_id
-    else:
-        amount = payout.amount * -1
-        to_account = settings.stripe_clearing_account_id
-        from_account = settings.stripe_payout_account_id
-
-    return qbo_models.Transfer(
-        Amount=amount / 100,
-        FromAccountRef=qbo_models.ItemRef(value=from_account),
-        ToAccountRef=qbo_models.ItemRef(value=to_account),
-        # TODO: use arrival date?
-        TxnDate=_timestamp_to_date(payout.created).strftime("%Y-%m-%d"),
-        PrivateNote=f"{payout.description}\n{payout.id}",
-    )
+    return Transformer(settings).transfer(payout)
 
 
 def expense_from_transaction(
     transaction: stripe_models.Transaction,
     settings: Settings,
 ) -> qbo_models.Expense:
-    if transaction.type in ["charge", "payment"]:
-        charge = cast(stripe_models.Charge, transaction.charge)
-        amount = transaction.fee / 100
-        description = f"Stripe fee for charge {charge.id}"
-    else:
-        amount = -transaction.amount / 100
-        description = transaction.description or ""
-
-    currency = cast(qbo_models.QBOCurrency, transaction.currency.upper())
-    account_id = settings.stripe_clearing_account_id
-    vendor_id = settings.stripe_vendor_id
-
-    return qbo_models.Expense(
-        TotalAmt=amount,
-        ExchangeRate=transaction.exchange_rate or 1.0,
-        CurrencyRef=qbo_models.CurrencyRef(value=currency),
-        AccountRef=qbo_models.ItemRef(value=account_id),
-        EntityRef=qbo_models.ItemRef(value=vendor_id),
-        TxnDate=_timestamp_to_date(transaction.created).strftime("%Y-%m-%d"),
-        PrivateNote=f"""
-            {description}
-            {transaction.id}
-            {transaction.charge.id if transaction.charge else None}
-        """,
-        Line=[
-            qbo_models.ExpenseLine(
-                Amount=amount,
-                AccountBasedExpenseLineDetail=qbo_models.AccountBasedExpenseLineDetail(
-                    AccountRef=qbo_models.ItemRef(value=settings.stripe_fee_account_id),
-                ),
-                Description=transaction.description,
-            )
-        ],
-    )
+    return Transformer(settings).expense(transaction)
 
 
 def qbo_invoice_line_from_stripe_invoice_line(
     line: stripe_models.InvoiceLine,
     settings: Settings,
 ) -> qbo_models.InvoiceLine:
-    if line.tax_amounts:
-        tax_code_id = settings.default_tax_code_id
-    else:
-        tax_code_id = settings.exempt_tax_code_id
-
-    product = qbo_models.ProductItemRef(
-        name=line.product.name,
-    )
-
-    return qbo_models.InvoiceLine(
-        Amount=line.amount / 100,
-        Description=line.description,
-        SalesItemLineDetail=qbo_models.SalesItemLineDetail(
-            ItemRef=product,
-            TaxCodeRef=qbo_models.TaxCodeRef(value=tax_code_id),
-        ),
-    )
+    return Transformer(settings).invoice_line(line)
 
 
 def tax_detail_from_invoice(
@@ -113,61 +338,7 @@ def tax_detail_from_invoice(
     Returns:
         qbo.TaxDetail: QBO TaxDetail object
     """
-    total_tax = invoice.tax or 0
-    total_taxable_amount = 0
-    tax_details: Dict[str, qbo_models.TaxLineModel] = {}  # tax_code_id: TaxLineModel
-
-    for line in invoice.lines:
-        for tax_amount in line.tax_amounts:
-            assert tax_amount.tax_rate is not None
-            total_taxable_amount += tax_amount.taxable_amount
-
-            tax_code_id = settings.default_tax_code_id
-
-            if tax_code_id == "TAX" or tax_code_id == "":
-                # Don't need TaxLineDetail if using default tax code
-                continue
-
-            tax_code = cast(qbo_models.TaxCode, tax_codes[tax_code_id])
-            tax_rate_ref = tax_code.SalesTaxRateList.TaxRateDetail[0].TaxRateRef
-
-            detail = tax_details.get(tax_code_id)
-            if detail is not None:
-                detail.Amount += tax_amount.amount / 100
-                detail.TaxLineDetail.NetAmountTaxable += tax_amount.taxable_amount / 100
-            else:
-                tax_details[tax_code_id] = qbo_models.TaxLineModel(
-                    Amount=tax_amount.amount / 100,
-                    TaxLineDetail=qbo_models.TaxLineDetail(
-                        TaxRateRef=tax_rate_ref,
-                        NetAmountTaxable=tax_amount.taxable_amount / 100,
-                        TaxPercent=tax_amount.tax_rate.percentage,
-                    ),
-                )
-
-    untaxed_amount = invoice.amount_due - total_tax - total_taxable_amount
-
-    if (
-        untaxed_amount > 0
-        and settings.exempt_tax_code_id != "NON"
-        and settings.exempt_tax_code_id != ""
-    ):
-        tax_code_id = settings.exempt_tax_code_id
-        tax_code = cast(qbo_models.TaxCode, tax_codes[tax_code_id])
-        tax_rate_ref = tax_code.SalesTaxRateList.TaxRateDetail[0].TaxRateRef
-        tax_details[tax_code_id] = qbo_models.TaxLineModel(
-            Amount=0,
-            TaxLineDetail=qbo_models.TaxLineDetail(
-                TaxRateRef=tax_rate_ref,
-                NetAmountTaxable=(untaxed_amount) / 100,
-                TaxPercent=0,
-            ),
-        )
-
-    return qbo_models.TaxDetail(
-        TaxLine=list(tax_details.values()),
-        TotalTax=total_tax / 100,
-    )
+    return Transformer(settings, tax_codes).tax_detail(invoice)
 
 
 def qbo_invoice_from_stripe_invoice(
@@ -177,34 +348,10 @@ def qbo_invoice_from_stripe_invoice(
     settings: Settings,
     exchange_rate: float = 1.0,
 ) -> qbo_models.Invoice:
-    invoice_lines = [
-        qbo_invoice_line_from_stripe_invoice_line(
-            line,
-            settings,
-        )
-        for line in invoice.lines
-    ]
-
-    tax_detail = tax_detail_from_invoice(invoice, tax_codes, settings)
-
-    qbo_invoice = qbo_models.Invoice(
-        CustomerRef=qbo_models.ItemRef(value=customer_id),
-        CurrencyRef={
-            "value": invoice.currency.upper(),  # type: ignore
-        },
-        ExchangeRate=exchange_rate,
-        TxnDate=_timestamp_to_date(invoice.created).strftime("%Y-%m-%d"),
-        Line=invoice_lines,
-        DocNumber=invoice.number,
-        PrivateNote=f"{invoice.number}\n{invoice.id}",
-        TxnTaxDetail=tax_detail,
+    return Transformer(settings, tax_codes).invoice(
+        invoice, customer_id, exchange_rate=exchange_rate
     )
 
-    if invoice.due_date:
-        qbo_invoice.DueDate = _timestamp_to_date(invoice.due_date).strftime("%Y-%m-%d")
-
-    return qbo_invoice
-
 
 def payment_from_charge(
     charge: stripe_models.Charge,
@@ -213,26 +360,6 @@ def payment_from_charge(
     invoice_id: Optional[str] = None,
     exchange_rate: float = 1.0,
 ) -> qbo_models.Payment:
-    currency = cast(qbo_models.QBOCurrency, charge.currency.upper())
-
-    payment = qbo_models.Payment(
-        TotalAmt=charge.amount / 100,
-        CurrencyRef=qbo_models.CurrencyRef(value=currency),
-        CustomerRef=qbo_models.ItemRef(value=customer_id),
-        DepositToAccountRef=qbo_models.ItemRef(
-            value=settings.stripe_clearing_account_id
-        ),
-        TxnDate=_timestamp_to_date(charge.created).strftime("%Y-%m-%d"),
-        PrivateNote=f"{charge.description}\n{charge.id}",
-        ExchangeRate=cast(float, exchange_rate),
+    return Transformer(settings).payment(
+        charge, customer_id, invoice_id=invoice_id, exchange_rate=exchange_rate
     )
-
-    if invoice_id:
-        payment.Line = [
-            qbo_models.PaymentLine(
-                Amount=payment.TotalAmt,
-                LinkedTxn=[qbo_models.LinkedTxn(TxnId=invoice_id)],
-            )
-        ]
-
-    return payment
@@ -1,14 +1,18 @@
 import os
 import json
 from datetime import datetime
+from typing import Callable, Iterator
 
 import pytest
 import stripe
 from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from stripe2qbo.api.auth import get_password_hash
 
 from stripe2qbo.qbo.QBO import QBO, create_qbo
-from stripe2qbo.db.models import User
+from stripe2qbo.db.models import Base, User
 from stripe2qbo.db.schemas import Settings
 from stripe2qbo.qbo.auth import (
     Token,
@@ -18,6 +22,8 @@ from stripe2qbo.qbo.auth import (
 )
 from stripe2qbo.stripe.models import Transaction
 from stripe2qbo.stripe.stripe_transactions import get_transaction
+from stripe2qbo.workers import fair_queue, sync_worker
+from stripe2qbo.workers.fair_queue import RedisFairQueue
 
 
 stripe.api_key = os.getenv("TEST_STRIPE_API_KEY", "")
@@ -26,6 +32,57 @@ ACCOUNT_ID = os.getenv("TEST_STRIPE_ACCOUNT_ID", "")
 load_dotenv()
 
 
+@pytest.fixture
+def db_sessionmaker(monkeypatch: pytest.MonkeyPatch) -> Iterator[sessionmaker]:
+    """Sessions of an in-memory database, used by the worker, with user 1
+    connected to Stripe account acct_123"""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    monkeypatch.setattr(sync_worker, "SessionLocal", SessionLocal)
+
+    with SessionLocal() as db:
+        db.add(
+            User(
+                id=1,
+                email="test@example.com",
+                hashed_password="x",
+                stripe_user_id="acct_123",
+            )
+        )
+        db.commit()
+
+    yield SessionLocal
+    engine.dispose()
+
+
+@pytest.fixture
+def redis_fair_queue(
+    monkeypatch: pytest.MonkeyPatch,
+) -> Callable[[int, int], RedisFairQueue]:
+    """Create RedisFairQueues on an empty fake Redis server that runs their
+    Lua scripts. Skipped if fakeredis or lupa isn't installed."""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        fair_queue.redis,
+        "Redis",
+        lambda connection_pool: fakeredis.FakeRedis(server=server),
+    )
+
+    def create(max_running: int, lease_timeout: int) -> RedisFairQueue:
+        return RedisFairQueue(
+            "redis://localhost:6379/0", "syncqueue", max_running, lease_timeout
+        )
+
+    return create
+
+
 @pytest.fixture
 def test_customer():
     stripe_customer = stripe.Customer.create(
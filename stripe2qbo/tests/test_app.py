@@ -1,6 +1,22 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
 from fastapi.testclient import TestClient
+from httpx import Request, Response
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from stripe2qbo.api.app import app
+from stripe2qbo.api.routers import transaction_router
+from stripe2qbo.api.auth import get_current_user_from_token
+from stripe2qbo.api.dependencies import get_db, get_qbo
+from stripe2qbo.db.models import Base, TransactionSync, User
+from stripe2qbo.db.schemas import TransactionSync as TransactionSyncSchema
+from stripe2qbo.qbo.QBO import QBO
 
 client = TestClient(app)
 
@@ -30,3 +46,156 @@ def test_save_settings_unauthorized():
 def test_sync_single_transaction_unauthorized():
     response = client.post("/api/sync")
     assert response.status_code == 401
+
+
+class AccountsQBO(QBO):
+    """QBO stub that serves 1500 accounts from query pages"""
+
+    async def _query(self, query: str) -> Response:
+        start = int(query.split("STARTPOSITION ")[1].split(" ")[0])
+        size = int(query.split("MAXRESULTS ")[1])
+        accounts = [
+            {"Id": str(i), "Name": f"Account {i}", "AccountType": "Bank"}
+            for i in range(start, min(start + size, 1501))
+        ]
+        return Response(
+            200,
+            json={"QueryResponse": {"Account": accounts}},
+            request=Request("GET", "/query"),
+        )
+
+
+def test_get_accounts_streams_every_page():
+    app.dependency_overrides[get_qbo] = lambda: AccountsQBO()
+    try:
+        response = client.get("/api/qbo/accounts")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    accounts = response.json()
+    assert len(accounts) == 1500
+    assert accounts[0] == {
+        "Id": "1",
+        "Name": "Account 1",
+        "AccountType": "Bank",
+        "CurrencyRef": None,
+    }
+    assert accounts[-1]["Id"] == "1500"
+
+
+@pytest.fixture
+def transactions_db():
+    """250 transactions, 240 of them for user 1, served to the API as user 1"""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as db:
+        db.add(User(id=1, email="test@example.com", hashed_password="x"))
+        db.add(User(id=2, email="other@example.com", hashed_password="x"))
+        for i in range(250):
+            db.add(
+                TransactionSync(
+                    id=f"txn_{i:03}",
+                    user_id=1 if i < 240 else 2,
+                    created=1690000000 + i // 2,  # pairs share a created time
+                    type="charge" if i % 3 else "payout",
+                    fee=0,
+                    currency="usd",
+                    amount=1000,
+                    description="",
+                    stripe_id="acct_123",
+                    status="failed" if i % 10 == 0 else "pending",
+                    failure_reason="Server error" if i % 10 == 0 else None,
+                    invoice_id=str(i) if i % 10 else None,
+                )
+            )
+        db.commit()
+
+    def _get_db():
+        with SessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_current_user_from_token] = lambda: User(id=1)
+    yield
+    app.dependency_overrides.clear()
+
+
+def test_get_transactions_pages_by_created(transactions_db):
+    ids = []
+    cursor = None
+    while True:
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/transaction/", params=params).json()
+        ids.extend(t["id"] for t in page["transactions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert ids == [f"txn_{i:03}" for i in reversed(range(240))]
+
+    filtered = client.get(
+        "/api/transaction/",
+        params={"status": "failed", "type": "payout", "order": "asc"},
+    ).json()
+    assert [t["id"] for t in filtered["transactions"]] == [
+        f"txn_{i:03}" for i in range(0, 240, 30)
+    ]
+    assert filtered["next_cursor"] is None
+
+    count = client.get("/api/transaction/count", params={"status": "failed"})
+    assert count.json() == 24
+
+    bad_cursor = client.get("/api/transaction/", params={"cursor": "x"})
+    assert bad_cursor.status_code == 400
+
+
+def test_export_transactions_csv(transactions_db):
+    response = client.get("/api/transaction/export", params={"type": "payout"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "transactions.csv" in response.headers["content-disposition"]
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 80
+    assert rows[0]["id"] == "txn_000"
+    assert rows[0]["failure_reason"] == "Server error"
+    assert rows[0]["invoice_id"] == ""
+    assert rows[1]["invoice_id"] == "3"
+    assert list(rows[0]) == list(TransactionSyncSchema.model_fields)
+
+
+def test_export_transactions_ndjson(transactions_db, monkeypatch):
+    # Several database batches per export
+    monkeypatch.setattr(transaction_router, "EXPORT_BATCH_SIZE", 7)
+    response = client.get("/api/transaction/export", params={"format": "ndjson"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [f"txn_{i:03}" for i in range(240)]
+    assert TransactionSyncSchema(**rows[1]).invoice_id == "1"
+
+
+def test_export_transactions_includes_to_date(transactions_db):
+    day = datetime.fromtimestamp(1690000000)
+    params = {"from_date": day.strftime("%Y-%m-%d"), "format": "ndjson"}
+
+    response = client.get(
+        "/api/transaction/export", params={**params, "to_date": params["from_date"]}
+    )
+    assert len(response.text.splitlines()) == 240
+
+    day_before = (day - timedelta(days=1)).strftime("%Y-%m-%d")
+    response = client.get(
+        "/api/transaction/export", params={"to_date": day_before, "format": "ndjson"}
+    )
+    assert response.text == ""
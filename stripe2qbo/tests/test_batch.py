@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Mapping, Optional
+import asyncio
+
+from httpx import Request, Response
+import pytest
+
+from stripe2qbo.exceptions import QBOException
+from stripe2qbo.qbo.QBO import QBO
+from stripe2qbo.qbo.models import CurrencyRef, Expense, ItemRef
+
+
+class BatchQBO(QBO):
+    """QBO stub that answers /batch requests without calling the QBO API"""
+
+    def __init__(self, faults: Optional[List[str]] = None) -> None:
+        self.requests: List[Dict[str, Any]] = []
+        self.faults = faults or []
+
+    async def _request(
+        self, path: str, method: str = "GET", body: Optional[Mapping[str, Any]] = None
+    ) -> Response:
+        assert path == "/batch"
+        assert body is not None
+        self.requests.append(dict(body))
+
+        results = []
+        for item in body["BatchItemRequest"]:
+            entity = next(key for key in item if key not in ["bId", "operation"])
+            if item[entity]["PrivateNote"] in self.faults:
+                results.append(
+                    {
+                        "bId": item["bId"],
+                        "Fault": {"Error": [{"Detail": f"Invalid {entity}"}]},
+                    }
+                )
+            else:
+                results.append(
+                    {"bId": item["bId"], entity: {"Id": item[entity]["PrivateNote"]}}
+                )
+
+        return Response(
+            200,
+            json={"BatchItemResponse": results},
+            request=Request(method, path),
+        )
+
+
+def _expense(note: str) -> Expense:
+    return Expense(
+        CurrencyRef=CurrencyRef(value="USD"),
+        TotalAmt=1,
+        AccountRef=ItemRef(value="1"),
+        EntityRef=ItemRef(value="1"),
+        TxnDate="2023-01-01",
+        PrivateNote=note,
+        Line=[],
+    )
+
+
+async def test_concurrent_creates_are_batched():
+    qbo = BatchQBO()
+    qbo.enable_batching()
+
+    ids = await asyncio.gather(
+        *[qbo.create_expense(_expense(f"txn_{i}")) for i in range(45)]
+    )
+
+    assert ids == [f"txn_{i}" for i in range(45)]
+    assert [len(r["BatchItemRequest"]) for r in qbo.requests] == [30, 15]
+
+
+async def test_batch_item_fault_raises_for_that_item_only():
+    qbo = BatchQBO(faults=["txn_1"])
+    qbo.enable_batching()
+
+    results = await asyncio.gather(
+        *[qbo.create_expense(_expense(f"txn_{i}")) for i in range(3)],
+        return_exceptions=True,
+    )
+
+    assert results[0] == "txn_0"
+    assert isinstance(results[1], QBOException)
+    assert str(results[1]) == "Invalid Purchase"
+    assert results[2] == "txn_2"
+    assert len(qbo.requests) == 1
+
+
+def test_batch_size_is_limited():
+    with pytest.raises(ValueError):
+        BatchQBO().enable_batching(max_size=31)
+
+
+async def test_batch_is_sent_once_every_caller_waits():
+    qbo = BatchQBO()
+    qbo.enable_batching(linger=60)
+    assert qbo.batch is not None
+    batch = qbo.batch
+
+    async def sync(note: str) -> str:
+        with batch.caller():
+            await asyncio.sleep(0)
+            return await qbo.create_expense(_expense(note))
+
+    ids = await asyncio.wait_for(
+        asyncio.gather(sync("txn_1"), sync("txn_2"), sync("txn_3")), timeout=1
+    )
+
+    assert ids == ["txn_1", "txn_2", "txn_3"]
+    assert [len(r["BatchItemRequest"]) for r in qbo.requests] == [3]
@@ -0,0 +1,53 @@
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import Session
+
+from stripe2qbo.db.bulk import insert_new_transactions
+from stripe2qbo.db.models import Base, TransactionSync as TransactionSyncORM, User
+from stripe2qbo.db.schemas import TransactionSync
+
+
+def _transaction(id: str, status: str = "pending") -> TransactionSync:
+    return TransactionSync(
+        id=id,
+        user_id=1,
+        created=1690000000,
+        type="charge",
+        amount=1000,
+        fee=59,
+        currency="usd",
+        stripe_id="acct_123",
+        status=status,  # type: ignore
+    )
+
+
+def test_insert_new_transactions() -> None:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+
+    statements = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    with Session(engine) as db:
+        db.add(User(id=1, email="test@example.com", hashed_password="x"))
+        db.add(TransactionSyncORM(**_transaction("txn_0", "success").model_dump()))
+        db.commit()
+
+        statements.clear()
+        page = [_transaction(f"txn_{i}") for i in range(100)]
+        inserted = insert_new_transactions(db, page)
+        db.commit()
+
+        assert inserted == 99
+        assert len([s for s in statements if s.startswith("INSERT")]) == 1
+        assert not any(s.startswith("SELECT") for s in statements)
+
+        assert db.scalar(select(func.count()).select_from(TransactionSyncORM)) == 100
+        existing = db.get(TransactionSyncORM, "txn_0")
+        assert existing is not None and existing.status == "success"
+
+        assert insert_new_transactions(db, page) == 0
+        assert insert_new_transactions(db, []) == 0
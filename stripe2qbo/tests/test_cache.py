@@ -0,0 +1,168 @@
+from typing import Any, Dict, List, Mapping, Optional
+import asyncio
+
+from httpx import Request, Response
+
+from stripe2qbo.cache import MemoryCache
+from stripe2qbo.http_client import ClientPool
+from stripe2qbo.qbo.QBO import QBO
+from stripe2qbo.qbo.auth import Token
+
+
+async def test_memory_cache_expires_entries():
+    cache = MemoryCache(ttl=60)
+
+    await cache.set("a", 1)
+    await cache.set("b", 2, ttl=-1)
+
+    assert await cache.get("a") == 1
+    assert await cache.get("b") is None
+
+    await cache.delete("a")
+    assert await cache.get("a") is None
+
+
+async def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_size=2)
+
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.get("a")
+    await cache.set("c", 3)
+
+    assert await cache.get("a") == 1
+    assert await cache.get("b") is None
+    assert await cache.get("c") == 3
+
+
+class CustomerQBO(QBO):
+    """QBO stub with no customers, that records the requests it receives"""
+
+    def __init__(self, realm_id: str) -> None:
+        super().__init__(cache=MemoryCache())
+        self.realm_id = realm_id
+        self.requests: List[str] = []
+
+    async def _request(
+        self, path: str, method: str = "GET", body: Optional[Mapping[str, Any]] = None
+    ) -> Response:
+        self.requests.append(f"{method} {path}")
+        if method == "POST":
+            assert body is not None
+            json = {
+                "Customer": {
+                    "Id": str(len(self.requests)),
+                    "DisplayName": body["DisplayName"],
+                    "CurrencyRef": body["CurrencyRef"],
+                }
+            }
+        else:
+            json = {"QueryResponse": {}}
+        return Response(200, json=json, request=Request(method, path))
+
+
+async def test_get_or_create_customer_is_cached():
+    qbo = CustomerQBO("realm-1")
+
+    customer = await qbo.get_or_create_customer("Jane", "USD")
+    assert qbo.requests == [
+        "GET /query?query=select * from Customer where DisplayName = 'Jane'",
+        "POST customer",
+    ]
+
+    for _ in range(10):
+        assert await qbo.get_or_create_customer("Jane", "USD") == customer
+    assert len(qbo.requests) == 2
+
+    await qbo.get_or_create_customer("Jane", "CAD")
+    assert len(qbo.requests) == 4
+
+
+async def test_cache_is_scoped_to_realm():
+    cache = MemoryCache()
+    qbo_a = CustomerQBO("realm-a")
+    qbo_b = CustomerQBO("realm-b")
+    qbo_a.cache = qbo_b.cache = cache
+
+    await qbo_a.get_or_create_customer("Jane", "USD")
+    await qbo_b.get_or_create_customer("Jane", "USD")
+
+    assert len(qbo_a.requests) == 2
+    assert len(qbo_b.requests) == 2
+
+
+class PreferencesQBO(QBO):
+    """QBO stub that serves preferences and tax codes, and counts requests"""
+
+    def __init__(self, cache: MemoryCache) -> None:
+        super().__init__(cache=cache)
+        self.requests: List[str] = []
+
+    async def _request(
+        self, path: str, method: str = "GET", body: Optional[Mapping[str, Any]] = None
+    ) -> Response:
+        self.requests.append(path)
+        if path == "/preferences":
+            json: Dict[str, Any] = {
+                "Preferences": {
+                    "CurrencyPrefs": {"HomeCurrency": {"value": "CAD"}},
+                    "TaxPrefs": {"UsingSalesTax": True},
+                }
+            }
+        else:
+            tax_code = {
+                "Id": "5",
+                "SalesTaxRateList": {
+                    "TaxRateDetail": [{"TaxRateRef": {"value": "7", "name": "GST"}}]
+                },
+            }
+            json = {"QueryResponse": {"TaxCode": [tax_code]}}
+        return Response(200, json=json, request=Request(method, path))
+
+
+async def test_preferences_are_cached_per_realm():
+    cache = MemoryCache()
+    token = Token(
+        realm_id="realm-1",
+        access_token="access",
+        refresh_token="refresh",
+        expires_at="",
+        refresh_token_expires_at="",
+    )
+
+    qbos = [PreferencesQBO(cache) for _ in range(5)]
+    for qbo in qbos:
+        await qbo.set_token(token)
+        await qbo.get_tax_code("5")
+        assert qbo.home_currency == "CAD"
+        assert qbo.using_sales_tax is True
+
+    assert sum(len(qbo.requests) for qbo in qbos) == 2
+
+    await qbos[0].invalidate_preferences(["5"])
+
+    qbo = PreferencesQBO(cache)
+    await qbo.set_token(token)
+    await qbo.get_tax_code("5")
+    assert len(qbo.requests) == 2
+
+
+def test_client_pool_creates_one_client_per_loop():
+    class Client:
+        closed = False
+
+        async def aclose(self) -> None:
+            self.closed = True
+
+    clients = ClientPool(Client)
+
+    async def get_twice_and_close() -> Client:
+        first = clients.get()
+        assert clients.get() is first
+        await clients.aclose()
+        return first
+
+    first = asyncio.run(get_twice_and_close())
+    second = asyncio.run(get_twice_and_close())
+    assert first is not second
+    assert first.closed and second.closed
@@ -0,0 +1,153 @@
+from typing import Any, Dict, List
+from datetime import datetime
+import asyncio
+import time
+
+from httpx import Request, Response
+
+from stripe2qbo.qbo.QBO import QBO
+from stripe2qbo.qbo import check_for_existing
+from stripe2qbo.qbo.check_for_existing import ExistingIndex
+
+
+class QueryQBO(QBO):
+    """QBO stub that serves query pages from an in-memory list of purchases"""
+
+    def __init__(self, purchases: List[Dict[str, Any]]) -> None:
+        self.purchases = purchases
+        self.queries: List[str] = []
+
+    async def _query(self, query: str) -> Response:
+        self.queries.append(query)
+        if "where Id in " in query:
+            ids = query.split("Id in (")[1].split(")")[0].replace("'", "").split(", ")
+            rows = [r for r in self.purchases if r["Id"] in ids]
+            return Response(
+                200,
+                json={"QueryResponse": {"Purchase": rows}},
+                request=Request("GET", "/query"),
+            )
+
+        start = int(query.split("STARTPOSITION ")[1].split(" ")[0])
+        size = int(query.split("MAXRESULTS ")[1])
+        rows = self.purchases
+        if "LastUpdatedTime >= " in query:
+            since = query.split("LastUpdatedTime >= '")[1].split("'")[0]
+            rows = [
+                r
+                for r in rows
+                if datetime.fromisoformat(r["MetaData"]["LastUpdatedTime"])
+                >= datetime.fromisoformat(since)
+            ]
+        page = rows[start - 1 : start - 1 + size]
+        return Response(
+            200,
+            json={"QueryResponse": {"Purchase": page}},
+            request=Request("GET", "/query"),
+        )
+
+
+def _purchase(i: int, updated: str = "2023-01-01T00:00:00-07:00") -> Dict[str, Any]:
+    return {
+        "Id": str(i),
+        "PrivateNote": f"Stripe fee for charge ch_{i}\ntxn_{i}\nch_{i}",
+        "MetaData": {"LastUpdatedTime": updated},
+    }
+
+
+async def test_index_scans_every_page_once(monkeypatch):
+    monkeypatch.setattr(check_for_existing, "PAGE_SIZE", 10)
+    qbo = QueryQBO([_purchase(i) for i in range(25)])
+    index = ExistingIndex()
+
+    assert await index.find(qbo, "Purchase", "txn_24") == "24"
+    assert len(qbo.queries) == 3
+
+    assert await index.find(qbo, "Purchase", "txn_3") == "3"
+    assert await index.find(qbo, "Purchase", "ch_12") == "12"
+    assert len(qbo.queries) == 3
+
+
+async def test_index_miss_only_fetches_updated_objects(monkeypatch):
+    monkeypatch.setattr(check_for_existing, "PAGE_SIZE", 10)
+    monkeypatch.setattr(check_for_existing, "REFRESH_INTERVAL", 0)
+    qbo = QueryQBO([_purchase(i) for i in range(25)])
+    index = ExistingIndex()
+
+    assert await index.find(qbo, "Purchase", "txn_2") == "2"
+    qbo.purchases.append(_purchase(99, updated="2023-02-01T00:00:00-07:00"))
+
+    assert await index.find(qbo, "Purchase", "txn_99") == "99"
+    assert "LastUpdatedTime >= '2023-01-01T00:00:00-07:00'" in qbo.queries[-1]
+
+    assert await index.find(qbo, "Purchase", "txn_1000") is None
+    assert "LastUpdatedTime >= '2023-02-01T00:00:00-07:00'" in qbo.queries[-1]
+
+
+async def test_index_miss_trusted_for_refresh_interval(monkeypatch):
+    monkeypatch.setattr(check_for_existing, "REFRESH_INTERVAL", 60)
+    qbo = QueryQBO([_purchase(1)])
+    index = ExistingIndex()
+
+    assert await index.find(qbo, "Purchase", "txn_2") is None
+    qbo.purchases.append(_purchase(2, updated="2023-02-01T00:00:00-07:00"))
+    assert await index.find(qbo, "Purchase", "txn_2") is None
+    assert len(qbo.queries) == 1
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert await index.find(qbo, "Purchase", "txn_2") == "2"
+
+
+async def test_index_compares_update_times_across_offsets(monkeypatch):
+    monkeypatch.setattr(check_for_existing, "REFRESH_INTERVAL", 0)
+    # 01:30-06:00 is after 01:00-07:00 as a string, but half an hour before it
+    qbo = QueryQBO(
+        [
+            _purchase(1, updated="2023-11-05T01:00:00-07:00"),
+            _purchase(2, updated="2023-11-05T01:30:00-06:00"),
+        ]
+    )
+    index = ExistingIndex()
+
+    assert await index.find(qbo, "Purchase", "txn_3") is None
+    assert await index.find(qbo, "Purchase", "txn_3") is None
+    assert "LastUpdatedTime >= '2023-11-05T01:00:00-07:00'" in qbo.queries[-1]
+
+
+async def test_index_drops_deleted_hits_on_refresh(monkeypatch):
+    monkeypatch.setattr(check_for_existing, "REFRESH_INTERVAL", 0)
+    qbo = QueryQBO([_purchase(1), _purchase(2)])
+    index = ExistingIndex()
+    assert await index.find(qbo, "Purchase", "txn_1") == "1"
+    assert await index.find(qbo, "Purchase", "txn_2") == "2"
+
+    del qbo.purchases[0]
+    # Trusted until the next refresh
+    assert await index.find(qbo, "Purchase", "txn_1") == "1"
+
+    assert await index.find(qbo, "Purchase", "txn_3") is None
+    checks = [query for query in qbo.queries if "where Id in " in query]
+    assert checks == ["select * from Purchase where Id in ('1', '2') MAXRESULTS 100"]
+    assert await index.find(qbo, "Purchase", "txn_1") is None
+    assert await index.find(qbo, "Purchase", "ch_1") is None
+    assert await index.find(qbo, "Purchase", "txn_2") == "2"
+
+
+async def test_index_add():
+    qbo = QueryQBO([])
+    index = ExistingIndex()
+
+    index.add("Purchase", "po_1", "42")
+
+    assert await index.find(qbo, "Purchase", "po_1") == "42"
+    assert qbo.queries == []
+
+
+def test_indexes_are_kept_per_event_loop():
+    async def get_index() -> ExistingIndex:
+        index = check_for_existing.get_existing_index("1")
+        assert check_for_existing.get_existing_index("1") is index
+        return index
+
+    assert asyncio.run(get_index()) is not asyncio.run(get_index())
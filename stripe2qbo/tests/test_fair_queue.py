@@ -0,0 +1,154 @@
+from typing import Callable, List, Tuple
+import time
+
+import pytest
+from redis import RedisError
+
+from stripe2qbo.workers import fair_queue, sync_worker
+from stripe2qbo.workers.fair_queue import RedisFairQueue
+
+CreateQueue = Callable[[int, int], RedisFairQueue]
+
+
+def test_takes_chunks_from_each_user_in_turn(redis_fair_queue: CreateQueue):
+    queue = redis_fair_queue(10, 60)
+    queue.push(1, [f"txn_1_{i}" for i in range(1000)])
+    queue.push(2, ["txn_2_0", "txn_2_1", "txn_2_2"])
+    queue.push(3, ["txn_3_0"])
+
+    chunks = [queue.pop(2) for _ in range(5)]
+
+    assert [chunk.user_id for chunk in chunks if chunk] == [3, 2, 1, 2, 1]
+    assert [chunk.transaction_ids for chunk in chunks if chunk][:4] == [
+        ["txn_3_0"],
+        ["txn_2_0", "txn_2_1"],
+        ["txn_1_0", "txn_1_1"],
+        ["txn_2_2"],
+    ]
+
+
+def test_limits_running_chunks_per_user(redis_fair_queue: CreateQueue):
+    queue = redis_fair_queue(2, 60)
+    queue.push(1, [f"txn_{i}" for i in range(10)])
+
+    first = queue.pop(2)
+    second = queue.pop(2)
+    assert first is not None and second is not None
+    assert queue.pop(2) is None
+
+    queue.done(first)
+    third = queue.pop(2)
+    assert third is not None and third.transaction_ids == ["txn_4", "txn_5"]
+
+
+def test_lost_chunks_stop_running_after_lease_timeout(
+    redis_fair_queue: CreateQueue, monkeypatch
+):
+    queue = redis_fair_queue(1, 60)
+    queue.push(1, ["txn_1", "txn_2"])
+    assert queue.pop(1) is not None
+    assert queue.pop(1) is None
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+
+    chunk = queue.pop(1)
+    assert chunk is not None and chunk.transaction_ids == ["txn_2"]
+
+
+async def test_sync_next_runs_small_users_during_backfill(
+    redis_fair_queue: CreateQueue, monkeypatch: pytest.MonkeyPatch
+):
+    queue = redis_fair_queue(2, 60)
+    monkeypatch.setattr(sync_worker, "_fair_queue", queue)
+    monkeypatch.setattr(sync_worker, "SYNC_CHUNK_SIZE", 10)
+    tasks: List[None] = []
+    monkeypatch.setattr(
+        sync_worker.sync_next_worker, "delay", lambda: tasks.append(None)
+    )
+    synced: List[Tuple[int, int]] = []
+
+    async def sync_transactions(transaction_ids: List[str], user_id: int):
+        synced.append((user_id, len(transaction_ids)))
+
+    monkeypatch.setattr(sync_worker, "sync_transactions", sync_transactions)
+
+    assert sync_worker._push_fair(1, [f"txn_1_{i}" for i in range(1000)])
+    assert len(tasks) == 2  # one per chunk user 1 may run at once
+    assert await sync_worker.sync_next()
+
+    assert sync_worker._push_fair(2, [f"txn_2_{i}" for i in range(5)])
+    assert len(tasks) == 4  # one more after the first chunk, one for user 2
+    assert await sync_worker.sync_next()
+    assert await sync_worker.sync_next()
+
+    assert synced == [(1, 10), (2, 5), (1, 10)]
+
+
+def test_resume_sync_next_restarts_chains_while_queued(
+    redis_fair_queue: CreateQueue, monkeypatch: pytest.MonkeyPatch
+):
+    queue = redis_fair_queue(2, 60)
+    monkeypatch.setattr(sync_worker, "_fair_queue", queue)
+    tasks: List[None] = []
+    monkeypatch.setattr(
+        sync_worker.sync_next_worker, "delay", lambda: tasks.append(None)
+    )
+
+    sync_worker.resume_sync_next()
+    assert tasks == []
+
+    # Queued, but the chains that would have taken them ended
+    queue.push(1, ["txn_1", "txn_2"])
+    sync_worker.resume_sync_next()
+    assert len(tasks) == 2
+
+
+def test_drained_users_leave_the_ring(redis_fair_queue: CreateQueue):
+    queue = redis_fair_queue(10, 60)
+    queue.push(1, ["txn_1_0"])
+    queue.push(2, ["txn_2_0", "txn_2_1"])
+
+    assert [chunk.user_id for chunk in [queue.pop(1), queue.pop(1)] if chunk] == [
+        2,
+        1,
+    ]
+    assert queue.pop(1) is not None
+    assert queue.pop(1) is None
+    assert not queue.has_queued()
+
+    # Joins the front of the ring again
+    queue.push(1, ["txn_1_1"])
+    queue.push(3, ["txn_3_0"])
+    assert [chunk.user_id for chunk in [queue.pop(1), queue.pop(1)] if chunk] == [
+        3,
+        1,
+    ]
+
+
+def test_push_queues_every_batch_or_none(
+    redis_fair_queue: CreateQueue, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(fair_queue, "PUSH_BATCH_SIZE", 2)
+    queue = redis_fair_queue(10, 60)
+    ids = [f"txn_{i}" for i in range(5)]
+
+    calls = 0
+    push = queue._push
+
+    def fail_second_batch(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise RedisError("Connection lost")
+        return push(*args, **kwargs)
+
+    monkeypatch.setattr(queue, "_push", fail_second_batch)
+    with pytest.raises(RedisError):
+        queue.push(1, ids)
+    assert not queue.has_queued()
+
+    monkeypatch.setattr(queue, "_push", push)
+    queue.push(1, ids)
+    chunk = queue.pop(10)
+    assert chunk is not None and chunk.transaction_ids == ids
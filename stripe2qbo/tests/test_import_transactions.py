@@ -0,0 +1,141 @@
+from typing import List, Optional
+
+import pytest
+import stripe
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from stripe2qbo.db.models import ImportJob, ImportWatermark, TransactionSync
+from stripe2qbo.db.schemas import ImportJob as ImportJobSchema
+from stripe2qbo.db.watermark import advance_watermark, incremental_from_timestamp
+from stripe2qbo.stripe.models import Transaction
+from stripe2qbo.workers import sync_worker
+
+PAGES = [[f"txn_{page}_{i}" for i in range(n)] for page, n in enumerate([100, 100, 20])]
+
+
+def _transaction(id: str) -> Transaction:
+    return Transaction(
+        id=id,
+        created=1690000000,
+        type="charge",
+        amount=1000,
+        fee=59,
+        exchange_rate=None,
+        currency="usd",
+    )
+
+
+@pytest.fixture
+def db_sessionmaker(db_sessionmaker: sessionmaker) -> sessionmaker:
+    with db_sessionmaker() as db:
+        db.add(
+            ImportJob(
+                user_id=1, status="importing", imported=0, skipped=0, updated_at=0
+            )
+        )
+        db.commit()
+
+    return db_sessionmaker
+
+
+async def test_import_resumes_from_last_page(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    requested_cursors: List[Optional[str]] = []
+    fail_on_cursor: Optional[str] = PAGES[1][-1]
+
+    async def get_transactions_async(
+        account_id: str, starting_after: Optional[str] = None, **kwargs
+    ) -> List[Transaction]:
+        requested_cursors.append(starting_after)
+        if starting_after == fail_on_cursor:
+            raise stripe.error.APIConnectionError("Connection reset")
+
+        page = 0 if starting_after is None else int(starting_after.split("_")[1]) + 1
+        return [_transaction(id) for id in PAGES[page]]
+
+    notifications: List[ImportJobSchema] = []
+    monkeypatch.setattr(sync_worker, "get_transactions_async", get_transactions_async)
+    monkeypatch.setattr(
+        sync_worker, "notify_import", lambda _, job: notifications.append(job)
+    )
+
+    await sync_worker.import_transactions(1)
+
+    assert requested_cursors == [None, PAGES[0][-1], PAGES[1][-1]]
+    assert [n.imported for n in notifications] == [100, 200, 200]
+    assert notifications[-1].status == "failed"
+    assert notifications[-1].starting_after == PAGES[1][-1]
+
+    # Resume where the failed job left off, as the import route does
+    with db_sessionmaker() as db:
+        job = db.get(ImportJob, 1)
+        assert job is not None
+        job.status = "importing"
+        db.commit()
+
+    fail_on_cursor = None
+    requested_cursors.clear()
+    await sync_worker.import_transactions(1)
+
+    assert requested_cursors == [PAGES[1][-1]]
+    assert notifications[-1].status == "done"
+    assert notifications[-1].imported == 220
+    assert notifications[-1].skipped == 0
+
+    with db_sessionmaker() as db:
+        count = db.scalar(select(func.count()).select_from(TransactionSync))
+        assert count == 220
+
+        watermark = db.get(ImportWatermark, "acct_123")
+        assert watermark is not None
+        assert watermark.transaction_id == PAGES[0][0]
+        assert watermark.from_timestamp is None
+
+
+def _finished_job(
+    from_timestamp: Optional[int], to_timestamp: Optional[int], newest: int
+) -> ImportJob:
+    return ImportJob(
+        user_id=1,
+        status="done",
+        from_timestamp=from_timestamp,
+        to_timestamp=to_timestamp,
+        newest_created=newest,
+        newest_id=f"txn_{newest}",
+        imported=0,
+        skipped=0,
+        updated_at=0,
+    )
+
+
+def test_watermark_skips_imported_range(db_sessionmaker: sessionmaker) -> None:
+    with db_sessionmaker() as db:
+        assert incremental_from_timestamp(db, "acct_123", 100) == 100
+
+        advance_watermark(db, "acct_123", _finished_job(100, None, 500))
+        assert incremental_from_timestamp(db, "acct_123", 100) == 500
+        assert incremental_from_timestamp(db, "acct_123", 300) == 500
+        # Not everything before 100 was imported
+        assert incremental_from_timestamp(db, "acct_123", 50) == 50
+        assert incremental_from_timestamp(db, "acct_123", None) is None
+        assert incremental_from_timestamp(db, "acct_123", 600) == 600
+
+        # An incremental import moves the watermark up
+        advance_watermark(db, "acct_123", _finished_job(500, None, 700))
+        # An older import that reaches the watermark's range extends it down
+        advance_watermark(db, "acct_123", _finished_job(None, 200, 150))
+        assert incremental_from_timestamp(db, "acct_123", None) == 700
+
+        # A newer import with a gap before it starts a new range
+        advance_watermark(db, "acct_123", _finished_job(1000, None, 1200))
+        assert incremental_from_timestamp(db, "acct_123", 1000) == 1200
+        assert incremental_from_timestamp(db, "acct_123", None) is None
+
+        # An older import with a gap after it is ignored
+        advance_watermark(db, "acct_123", _finished_job(None, 900, 800))
+        watermark = db.get(ImportWatermark, "acct_123")
+        assert watermark is not None
+        assert watermark.from_timestamp == 1000
+        assert watermark.transaction_id == "txn_1200"
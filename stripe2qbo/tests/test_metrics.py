@@ -0,0 +1,110 @@
+from pathlib import Path
+import subprocess
+import sys
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from stripe2qbo import metrics
+from stripe2qbo.api import app as app_module
+from stripe2qbo.exceptions import QBOException
+from stripe2qbo.metrics import endpoint_name, track_request
+from stripe2qbo.qbo import qbo_request as qbo_request_module
+from stripe2qbo.qbo.qbo_request import qbo_request
+
+
+def _sample(name: str, **labels: str):
+    return REGISTRY.get_sample_value(name, labels)
+
+
+def test_endpoint_name():
+    assert endpoint_name("/v1/balance_transactions") == "/v1/balance_transactions"
+    assert endpoint_name("/v1/products/prod_1AbC") == "/v1/products/{id}"
+    assert endpoint_name("/invoice/123?minorversion=65") == "/invoice/{id}"
+    assert endpoint_name("/customer") == "/customer"
+
+
+def test_collect_keeps_counts_of_exited_processes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # A worker process that counts a request and exits
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from stripe2qbo import metrics; "
+            "metrics.syncs.labels(realm='1', type='charge', status='success').inc()",
+        ],
+        env={"PROMETHEUS_MULTIPROC_DIR": str(tmp_path)},
+        cwd=Path(__file__).parents[2],
+        check=True,
+    )
+    monkeypatch.setattr(metrics, "PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+    text = metrics.collect().decode()
+
+    assert "# TYPE stripe2qbo_syncs_total counter" in text
+    assert (
+        'stripe2qbo_syncs_total{realm="1",status="success",type="charge"} 1.0' in text
+    )
+
+
+def test_track_request_records_exception_status():
+    class NotFound(Exception):
+        http_status = 404
+
+    with pytest.raises(NotFound):
+        with track_request("stripe", "/v1/charges/{id}", "acct_metrics"):
+            raise NotFound()
+
+    assert (
+        _sample(
+            "stripe2qbo_api_requests_total",
+            service="stripe",
+            endpoint="/v1/charges/{id}",
+            tenant="acct_metrics",
+            status="404",
+        )
+        == 1
+    )
+
+
+async def test_qbo_request_records_status_and_retries(monkeypatch):
+    monkeypatch.setenv("QBO_BASE_URL", "https://quickbooks.test/v3/company")
+    monkeypatch.setattr(qbo_request_module, "QBO_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(qbo_request_module, "QBO_MAX_RETRIES", 1)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "0"}, text="Throttled"),
+        httpx.Response(500, text="Internal Server Error"),
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return responses.pop(0)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(QBOException):
+            await qbo_request(
+                "/invoice/7", access_token="token", realm_id="metrics", client=client
+            )
+
+    labels = {"service": "qbo", "endpoint": "/invoice/{id}", "tenant": "metrics"}
+    assert _sample("stripe2qbo_api_requests_total", **labels, status="500") == 1
+    assert _sample("stripe2qbo_api_request_retries_total", **labels) == 1
+    assert _sample("stripe2qbo_api_request_duration_seconds_count", **labels) == 1
+
+
+def test_metrics_endpoint_requires_token(monkeypatch):
+    client = TestClient(app_module.app)
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", None)
+    assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer other"})
+    assert response.status_code == 401
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert "# TYPE stripe2qbo_api_requests_total counter" in response.text
@@ -0,0 +1,110 @@
+from typing import List
+import asyncio
+
+import httpx
+import pytest
+
+from stripe2qbo.exceptions import QBOException
+from stripe2qbo.qbo import qbo_request as qbo_request_module
+from stripe2qbo.qbo.qbo_request import close_client, get_client, qbo_request
+from stripe2qbo.qbo.QBO import QBO
+
+
+async def test_client_is_shared_on_event_loop():
+    client = get_client()
+
+    assert get_client() is client
+    assert QBO().client is client
+    assert QBO().client is QBO().client
+
+    await close_client()
+
+    assert client.is_closed
+    assert get_client() is not client
+    await close_client()
+
+
+def test_client_is_not_shared_across_event_loops():
+    async def _get_client():
+        client = get_client()
+        await close_client()
+        return client
+
+    client_a = asyncio.run(_get_client())
+    client_b = asyncio.run(_get_client())
+
+    assert client_a is not client_b
+
+
+async def test_retries_throttled_write_with_same_request_id(monkeypatch):
+    monkeypatch.setenv("QBO_BASE_URL", "https://quickbooks.test/v3/company")
+    monkeypatch.setattr(qbo_request_module, "QBO_RETRY_BACKOFF", 0)
+    requests: List[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"}, text="Throttled")
+        if len(requests) == 2:
+            return httpx.Response(503, text="Service Unavailable")
+        return httpx.Response(200, json={"Invoice": {"Id": "1"}})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        response = await qbo_request(
+            "/invoice",
+            method="POST",
+            body={},
+            access_token="token",
+            realm_id="123",
+            client=client,
+        )
+
+    assert response.json() == {"Invoice": {"Id": "1"}}
+    assert len(requests) == 3
+    request_ids = {request.url.params["requestid"] for request in requests}
+    assert len(request_ids) == 1
+
+
+async def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setenv("QBO_BASE_URL", "https://quickbooks.test/v3/company")
+    monkeypatch.setattr(qbo_request_module, "QBO_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(qbo_request_module, "QBO_MAX_RETRIES", 2)
+    requests: List[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(500, text="Internal Server Error")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(QBOException):
+            await qbo_request(
+                "/companyinfo/123", access_token="token", realm_id="123", client=client
+            )
+
+    assert len(requests) == 3
+    assert "requestid" not in requests[0].url.params
+
+
+async def test_fault_carries_intuit_tid(monkeypatch, capsys):
+    monkeypatch.setenv("QBO_BASE_URL", "https://quickbooks.test/v3/company")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            400,
+            headers={"intuit_tid": "1-abc"},
+            json={"Fault": {"Error": [{"Detail": "Invalid reference"}]}},
+        )
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(QBOException) as exc_info:
+            await qbo_request(
+                "/invoice",
+                "POST",
+                {},
+                access_token="token",
+                realm_id="1",
+                client=client,
+            )
+
+    assert exc_info.value.intuit_tid == "1-abc"
+    assert "1-abc" in capsys.readouterr().out
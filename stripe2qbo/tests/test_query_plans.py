@@ -0,0 +1,126 @@
+from typing import Any, Dict, Iterator, List, Tuple
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, create_engine, event, update
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from stripe2qbo.api.app import app
+from stripe2qbo.api.auth import get_current_user_from_token
+from stripe2qbo.api.dependencies import get_db
+from stripe2qbo.db.models import Base, TransactionSync, User
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def engine() -> Iterator[Engine]:
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as db:
+        for user_id in [1, 2]:
+            db.add(
+                User(id=user_id, email=f"{user_id}@example.com", hashed_password="x")
+            )
+            for i in range(200):
+                db.add(
+                    TransactionSync(
+                        id=f"txn_{user_id}_{i}",
+                        user_id=user_id,
+                        created=1690000000 + i,
+                        type="charge",
+                        fee=0,
+                        currency="usd",
+                        amount=1000,
+                        description="",
+                        stripe_id=f"acct_{user_id}",
+                        status=["pending", "success", "failed", "syncing"][i % 4],
+                    )
+                )
+        db.commit()
+
+    # Let the planner see how selective each index is, as Postgres does
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+
+    def _get_db():
+        with SessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_current_user_from_token] = lambda: User(id=1)
+    yield engine
+    app.dependency_overrides.clear()
+
+
+def _plan(engine: Engine, statement: str, parameters: Any = ()) -> List[str]:
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in rows]
+
+
+def _assert_uses_index(plan: List[str], index: str) -> None:
+    """A query that searches an index, and doesn't sort, costs the same
+    however many rows the table has"""
+    assert all(step.startswith("SEARCH") for step in plan), plan
+    assert any(re.search(rf"INDEX {index}\b", step) for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+BY_CREATED = "ix_transaction_sync_user_id_created"
+BY_STATUS = "ix_transaction_sync_user_id_status"
+BY_USER = r"ix_transaction_sync_user_id_\w+"
+CURSOR = "1690000100:txn_1_100"
+
+
+@pytest.mark.parametrize(
+    "path, params, index",
+    [
+        ("/api/transaction/", {}, BY_CREATED),
+        ("/api/transaction/", {"cursor": CURSOR}, BY_CREATED),
+        ("/api/transaction/", {"order": "asc", "cursor": CURSOR}, BY_CREATED),
+        ("/api/transaction/", {"status": "failed"}, BY_STATUS),
+        ("/api/transaction/", {"status": "failed", "cursor": CURSOR}, BY_STATUS),
+        ("/api/transaction/count", {}, BY_USER),
+        ("/api/transaction/count", {"status": "failed"}, BY_STATUS),
+    ],
+)
+def test_listing_queries_use_index(
+    engine: Engine, path: str, params: Dict[str, str], index: str
+) -> None:
+    statements: List[Tuple[str, Any]] = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _capture)
+    try:
+        response = client.get(path, params=params)
+    finally:
+        event.remove(engine, "before_cursor_execute", _capture)
+
+    assert response.status_code == 200
+    assert len(statements) == 1
+    _assert_uses_index(_plan(engine, *statements[0]), index)
+
+
+def test_status_update_uses_index(engine: Engine) -> None:
+    # As in POST /sync and the sync worker
+    statement = (
+        update(TransactionSync)
+        .where(TransactionSync.id.in_(["txn_1_1", "txn_1_2"]))
+        .values(status="syncing")
+        .compile(engine, compile_kwargs={"literal_binds": True})
+    )
+    _assert_uses_index(
+        _plan(engine, str(statement)), "sqlite_autoindex_transaction_sync_1"
+    )
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from stripe2qbo import rate_limit
+from stripe2qbo.rate_limit import MemoryRateLimiter, backoff, retry_after
+
+
+async def test_memory_rate_limiter_queues_after_burst(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now)
+    limiter = MemoryRateLimiter(rate=10, capacity=2)
+
+    delays = [await limiter.reserve("realm") for _ in range(5)]
+    assert delays == pytest.approx([0, 0, 0.1, 0.2, 0.3])
+
+    # Buckets are per key
+    assert await limiter.reserve("other realm") == 0
+
+    # Refills at `rate` tokens per second, up to capacity
+    now += 10
+    delays = [await limiter.reserve("realm") for _ in range(3)]
+    assert delays == pytest.approx([0, 0, 0.1])
+
+
+def test_retry_after():
+    assert retry_after({}) is None
+    assert retry_after({"Retry-After": "2"}) == 2
+    assert retry_after({"Retry-After": "soon"}) is None
+
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    delay = retry_after({"Retry-After": format_datetime(retry_at, usegmt=True)})
+    assert delay is not None and 28 < delay <= 30
+
+
+def test_backoff_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff(attempt, base=1, maximum=8) <= min(8, 2**attempt)
@@ -0,0 +1,231 @@
+from typing import List, Optional, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from stripe2qbo.api.app import app
+from stripe2qbo.api.auth import get_current_user_from_token
+from stripe2qbo.api.dependencies import get_db, get_stripe_user_id
+from stripe2qbo.db.models import (
+    ImportJob,
+    ImportWatermark,
+    SyncSchedule,
+    TransactionSync,
+    User,
+)
+from stripe2qbo.stripe.models import Transaction
+from stripe2qbo.workers import sync_worker
+from stripe2qbo.workers.sync_worker import next_scheduled_run
+
+NOW = 1690000000
+
+
+@pytest.fixture
+def db_sessionmaker(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+) -> sessionmaker:
+    monkeypatch.setattr(sync_worker.time, "time", lambda: NOW)
+    with db_sessionmaker() as db:
+        db.add(
+            User(
+                id=2,
+                email="2@example.com",
+                hashed_password="x",
+                stripe_user_id="acct_2",
+            )
+        )
+        db.commit()
+
+    return db_sessionmaker
+
+
+def _watermark() -> ImportWatermark:
+    return ImportWatermark(
+        stripe_id="acct_123",
+        from_timestamp=None,
+        created=NOW - 3600,
+        transaction_id="txn_old",
+    )
+
+
+def test_save_schedule_requires_watermark_or_start(db_sessionmaker: sessionmaker):
+    def _get_db():
+        with db_sessionmaker() as db:
+            yield db
+
+    with db_sessionmaker() as db:
+        user = db.get(User, 1)
+    app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_current_user_from_token] = lambda: user
+    app.dependency_overrides[get_stripe_user_id] = lambda: "acct_123"
+    client = TestClient(app)
+    try:
+        response = client.put("/api/schedule", json={"interval_minutes": 60})
+        assert response.status_code == 400
+
+        response = client.put(
+            "/api/schedule",
+            json={"interval_minutes": 60, "from_timestamp": NOW - 86400},
+        )
+        assert response.status_code == 200
+        assert response.json()["from_timestamp"] == NOW - 86400
+
+        with db_sessionmaker() as db:
+            db.add(_watermark())
+            db.commit()
+        response = client.put("/api/schedule", json={"interval_minutes": 60})
+        assert response.status_code == 200
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_next_scheduled_run_spreads_users_over_interval():
+    runs = [next_scheduled_run(user_id, 60, NOW) for user_id in range(1000)]
+
+    assert all(NOW < run <= NOW + 3600 for run in runs)
+    # Offsets are spread over the hour, not bunched at its start
+    minutes = {(run - NOW) // 60 for run in runs}
+    assert len(minutes) == 60
+    # and each user keeps the same offset
+    assert next_scheduled_run(1, 60, runs[1]) == runs[1] + 3600
+
+
+def test_run_due_schedules(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    started: List[int] = []
+
+    def delay(user_id: int) -> None:
+        started.append(user_id)
+        if len(started) == 1:
+            # Another copy of the task, running while this one starts syncs
+            sync_worker.run_due_schedules()
+
+    monkeypatch.setattr(sync_worker.scheduled_sync_worker, "delay", delay)
+    with db_sessionmaker() as db:
+        db.add(SyncSchedule(user_id=1, interval_minutes=60, next_run_at=NOW - 5))
+        db.add(SyncSchedule(user_id=2, interval_minutes=60, next_run_at=NOW + 5))
+        db.commit()
+
+    sync_worker.run_due_schedules()
+
+    assert started == [1]
+    with db_sessionmaker() as db:
+        schedule = db.get(SyncSchedule, 1)
+        assert schedule is not None
+        assert schedule.last_run_at == NOW
+        assert schedule.next_run_at == next_scheduled_run(1, 60, NOW)
+
+
+async def test_scheduled_sync_imports_from_watermark(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    requested: List[Optional[int]] = []
+    dispatched: List[Tuple[int, List[str]]] = []
+
+    async def get_transactions_async(
+        account_id: str, from_timestamp: Optional[int] = None, **kwargs
+    ) -> List[Transaction]:
+        requested.append(from_timestamp)
+        return [
+            Transaction(
+                id="txn_new",
+                created=NOW,
+                type="charge",
+                amount=1000,
+                fee=59,
+                exchange_rate=None,
+                currency="usd",
+            )
+        ]
+
+    monkeypatch.setattr(sync_worker, "get_transactions_async", get_transactions_async)
+    monkeypatch.setattr(sync_worker, "notify_import", lambda *args: None)
+    monkeypatch.setattr(
+        sync_worker,
+        "dispatch_sync",
+        lambda db, user_id, ids: dispatched.append((user_id, ids)),
+    )
+    with db_sessionmaker() as db:
+        db.add(_watermark())
+        db.add(
+            TransactionSync(
+                id="txn_old",
+                created=NOW - 3600,
+                type="charge",
+                fee=59,
+                currency="usd",
+                amount=1000,
+                description="",
+                stripe_id="acct_123",
+                user_id=1,
+                status="pending",
+            )
+        )
+        db.commit()
+
+    await sync_worker.scheduled_sync(1)
+
+    assert requested == [NOW - 3600]
+    assert [(user_id, sorted(ids)) for user_id, ids in dispatched] == [
+        (1, ["txn_new", "txn_old"])
+    ]
+    with db_sessionmaker() as db:
+        job = db.get(ImportJob, 1)
+        assert job is not None and job.status == "done"
+        watermark = db.get(ImportWatermark, "acct_123")
+        assert watermark is not None and watermark.transaction_id == "txn_new"
+        assert set(db.scalars(select(TransactionSync.id))) == {"txn_new", "txn_old"}
+
+
+async def test_scheduled_sync_imports_from_schedule_start(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    requested: List[Optional[int]] = []
+
+    async def get_transactions_async(
+        account_id: str, from_timestamp: Optional[int] = None, **kwargs
+    ) -> List[Transaction]:
+        requested.append(from_timestamp)
+        return []
+
+    monkeypatch.setattr(sync_worker, "get_transactions_async", get_transactions_async)
+    monkeypatch.setattr(sync_worker, "notify_import", lambda *args: None)
+    with db_sessionmaker() as db:
+        db.add(
+            SyncSchedule(
+                user_id=1,
+                interval_minutes=60,
+                next_run_at=NOW,
+                from_timestamp=NOW - 86400,
+            )
+        )
+        db.commit()
+
+    await sync_worker.scheduled_sync(1)
+
+    assert requested == [NOW - 86400]
+
+
+async def test_scheduled_sync_skipped_without_watermark_or_start(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    async def get_transactions_async(*args, **kwargs) -> List[Transaction]:
+        raise AssertionError("Nothing should be imported")
+
+    monkeypatch.setattr(sync_worker, "get_transactions_async", get_transactions_async)
+    monkeypatch.setattr(
+        sync_worker,
+        "dispatch_sync",
+        lambda db, user_id, ids: pytest.fail("Nothing should be synced"),
+    )
+    with db_sessionmaker() as db:
+        db.add(SyncSchedule(user_id=1, interval_minutes=60, next_run_at=NOW))
+        db.commit()
+
+    await sync_worker.scheduled_sync(1)
+
+    with db_sessionmaker() as db:
+        assert db.get(ImportJob, 1) is None
@@ -0,0 +1,214 @@
+from typing import Any, Dict, List, Mapping, Optional
+import asyncio
+
+from httpx import Request, Response
+
+from stripe2qbo.cache import MemoryCache
+from stripe2qbo.db.models import User
+from stripe2qbo.db.schemas import Settings
+from stripe2qbo.qbo.QBO import QBO
+from stripe2qbo.qbo.auth import Token
+import stripe2qbo.Stripe2QBO as stripe2qbo_module
+from stripe2qbo.Stripe2QBO import Stripe2QBO, get_stripe2qbo
+from stripe2qbo.stripe.models import Charge, Customer, Transaction
+
+SETTINGS = Settings(
+    stripe_clearing_account_id="1",
+    stripe_payout_account_id="2",
+    stripe_vendor_id="3",
+    stripe_fee_account_id="4",
+    default_income_account_id="5",
+    default_tax_code_id="10",
+    exempt_tax_code_id="NON",
+)
+
+
+def _token(realm_id: str) -> Token:
+    return Token(
+        realm_id=realm_id,
+        access_token="access",
+        refresh_token="refresh",
+        expires_at="",
+        refresh_token_expires_at="",
+    )
+
+
+class RealmQBO(QBO):
+    """QBO stub for an empty realm whose tax codes are named after it"""
+
+    def __init__(self, realm_id: str) -> None:
+        super().__init__(cache=MemoryCache())
+        self.realm_id = realm_id
+        self.access_token = "access"
+        self.home_currency = "USD"
+        self.using_sales_tax = True
+        self.created: List[Mapping[str, Any]] = []
+
+    async def _request(
+        self, path: str, method: str = "GET", body: Optional[Mapping[str, Any]] = None
+    ) -> Response:
+        await asyncio.sleep(0)  # let concurrent syncs interleave
+        json: Dict[str, Any] = {"QueryResponse": {}}
+        if path == "/preferences":
+            json = {
+                "Preferences": {
+                    "CurrencyPrefs": {"HomeCurrency": {"value": "USD"}},
+                    "TaxPrefs": {"UsingSalesTax": True},
+                }
+            }
+        elif "from TaxCode" in path:
+            tax_code = {
+                "Id": "10",
+                "SalesTaxRateList": {
+                    "TaxRateDetail": [
+                        {"TaxRateRef": {"value": "7", "name": self.realm_id}}
+                    ]
+                },
+            }
+            json = {"QueryResponse": {"TaxCode": [tax_code]}}
+        elif method == "POST":
+            assert body is not None
+            self.created.append({"path": path, **body})
+            entity = path.strip("/").capitalize()
+            json = {entity: {"Id": str(len(self.created)), **body}}
+        return Response(200, json=json, request=Request(method, path))
+
+
+def _charge(index: int) -> Transaction:
+    return Transaction(
+        id=f"txn_{index}",
+        created=1690000000 + index,
+        type="charge",
+        amount=1000 * index,
+        fee=30,
+        exchange_rate=1 + index / 10,
+        currency="usd",
+        charge=Charge(
+            id=f"ch_{index}",
+            amount=1000 * index,
+            created=1690000000 + index,
+            description=None,
+            currency="usd",
+        ),
+        customer=Customer(id="cus_1", name="Jane"),
+    )
+
+
+async def test_tax_codes_are_per_realm():
+    syncer_a = Stripe2QBO(SETTINGS)
+    syncer_b = Stripe2QBO(SETTINGS)
+    await syncer_a.use_qbo(RealmQBO("tax-realm-a"))
+    await syncer_b.use_qbo(RealmQBO("tax-realm-b"))
+
+    tax_code_a = syncer_a._tax_codes["10"]
+    tax_code_b = syncer_b._tax_codes["10"]
+    assert tax_code_a is not None and tax_code_b is not None
+    assert tax_code_a.SalesTaxRateList.TaxRateDetail[0].TaxRateRef.name == (
+        "tax-realm-a"
+    )
+    assert tax_code_b.SalesTaxRateList.TaxRateDetail[0].TaxRateRef.name == (
+        "tax-realm-b"
+    )
+
+
+async def test_concurrent_syncs_share_a_syncer():
+    qbo = RealmQBO("concurrent-realm")
+    syncer = Stripe2QBO(SETTINGS)
+    await syncer.use_qbo(qbo)
+
+    transactions = [_charge(index) for index in range(1, 6)]
+    syncs = await asyncio.gather(
+        *[
+            syncer.sync(transaction, User(id=1, stripe_user_id="acct_1"))
+            for transaction in transactions
+        ]
+    )
+
+    assert [sync.status for sync in syncs] == ["success"] * 5
+    assert [sync.id for sync in syncs] == [txn.id for txn in transactions]
+
+    customers = [body for body in qbo.created if body["path"] == "customer"]
+    assert len(customers) == 1
+
+    payments = {
+        body["PrivateNote"].split("\n")[1]: body
+        for body in qbo.created
+        if body["path"] == "/payment"
+    }
+    for transaction in transactions:
+        assert transaction.charge is not None
+        payment = payments[transaction.charge.id]
+        assert payment["TotalAmt"] == transaction.amount / 100
+        assert payment["ExchangeRate"] == transaction.exchange_rate
+
+
+async def test_get_stripe2qbo_shares_syncer_per_realm(monkeypatch):
+    async def create_qbo(token: Token) -> QBO:
+        return RealmQBO(token.realm_id)
+
+    monkeypatch.setattr(stripe2qbo_module, "create_qbo", create_qbo)
+
+    syncer = await get_stripe2qbo(SETTINGS, _token("shared-realm-a"))
+    assert await get_stripe2qbo(SETTINGS, _token("shared-realm-a")) is syncer
+    assert await get_stripe2qbo(SETTINGS, _token("shared-realm-b")) is not syncer
+
+    settings = SETTINGS.model_copy(update={"default_tax_code_id": "TAX"})
+    updated = await get_stripe2qbo(settings, _token("shared-realm-a"))
+    assert updated is not syncer
+    assert updated._tax_codes == {"TAX": None, "NON": None}
+
+
+async def test_get_stripe2qbo_clears_cached_preferences_on_new_settings(monkeypatch):
+    cache = MemoryCache()
+    requests: List[str] = []
+
+    class CachedQBO(RealmQBO):
+        def __init__(self, realm_id: str) -> None:
+            super().__init__(realm_id)
+            self.cache = cache
+
+        async def _request(
+            self,
+            path: str,
+            method: str = "GET",
+            body: Optional[Mapping[str, Any]] = None,
+        ) -> Response:
+            requests.append(path)
+            return await super()._request(path, method, body)
+
+    async def create_qbo(token: Token) -> QBO:
+        qbo = CachedQBO(token.realm_id)
+        await qbo.set_token(token)
+        return qbo
+
+    monkeypatch.setattr(stripe2qbo_module, "create_qbo", create_qbo)
+
+    await get_stripe2qbo(SETTINGS, _token("settings-realm"))
+    await get_stripe2qbo(SETTINGS, _token("settings-realm"))
+    assert requests.count("/preferences") == 1
+
+    # Saved in another process, whose cache isn't shared
+    settings = SETTINGS.model_copy(update={"stripe_fee_account_id": "40"})
+    await get_stripe2qbo(settings, _token("settings-realm"))
+    assert requests.count("/preferences") == 2
+
+
+async def test_get_stripe2qbo_reloads_tax_codes_of_shared_syncer(monkeypatch):
+    qbo = RealmQBO("tax-reload-realm")
+
+    async def create_qbo(token: Token) -> QBO:
+        return qbo
+
+    monkeypatch.setattr(stripe2qbo_module, "create_qbo", create_qbo)
+
+    syncer = await get_stripe2qbo(SETTINGS, _token("tax-reload-realm"))
+    assert syncer._tax_codes["10"] is not None
+
+    # The realm stopped using sales tax, seen once its preferences expire
+    async def _set_preferences() -> None:
+        qbo.using_sales_tax = False
+
+    monkeypatch.setattr(qbo, "_set_preferences", _set_preferences)
+
+    assert await get_stripe2qbo(SETTINGS, _token("tax-reload-realm")) is syncer
+    assert syncer._tax_codes == {}
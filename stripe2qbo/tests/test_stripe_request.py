@@ -0,0 +1,105 @@
+import httpx
+import pytest
+import stripe
+
+from stripe2qbo.stripe import stripe_request as stripe_request_module
+from stripe2qbo.stripe.stripe_request import stripe_request
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(stripe_request_module, "STRIPE_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(stripe_request_module, "STRIPE_MAX_RETRIES", 2)
+
+
+async def test_stripe_request_encodes_params_and_builds_stripe_objects():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200,
+            json={
+                "object": "list",
+                "data": [{"object": "balance_transaction", "id": "txn_1"}],
+                "has_more": False,
+            },
+        )
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        txns = await stripe_request(
+            "/v1/balance_transactions",
+            params={
+                "limit": 100,
+                "created": {"gte": 1, "lte": None},
+                "expand": ["data.source", "data.source.customer"],
+                "starting_after": None,
+            },
+            account_id="acct_1",
+            client=client,
+        )
+
+    assert isinstance(txns.data[0], stripe.BalanceTransaction)
+    assert txns.data[0].id == "txn_1"
+    assert requests[0].url.path == "/v1/balance_transactions"
+    assert list(requests[0].url.params.multi_items()) == [
+        ("limit", "100"),
+        ("created[gte]", "1"),
+        ("expand[0]", "data.source"),
+        ("expand[1]", "data.source.customer"),
+    ]
+    assert requests[0].headers["Stripe-Account"] == "acct_1"
+
+
+async def test_stripe_request_raises_stripe_errors(no_backoff):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(429, json={"error": {"message": "Too many requests"}})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(stripe.error.RateLimitError, match="Too many requests"):
+            await stripe_request("/v1/balance_transactions/txn_1", client=client)
+
+    assert len(requests) == 3
+
+
+async def test_stripe_request_retries_with_idempotency_key(no_backoff):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"}, json={})
+        if len(requests) == 2:
+            raise httpx.ConnectError("Connection reset")
+        return httpx.Response(200, json={"object": "customer", "id": "cus_1"})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        customer = await stripe_request(
+            "/v1/customers", params={"name": "Test"}, method="POST", client=client
+        )
+
+    assert customer.id == "cus_1"
+    assert len(requests) == 3
+    keys = {request.headers["Idempotency-Key"] for request in requests}
+    assert len(keys) == 1
+
+
+async def test_stripe_request_honors_should_retry_header(no_backoff):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            500,
+            headers={"Stripe-Should-Retry": "false"},
+            json={"error": {"message": "Something went wrong"}},
+        )
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(stripe.error.APIError):
+            await stripe_request("/v1/balance_transactions/txn_1", client=client)
+
+    assert len(requests) == 1
@@ -1,10 +1,20 @@
+from typing import List
+import asyncio
 import os
 from dotenv import load_dotenv
 
 import pytest
 import stripe
+from stripe.util import convert_to_stripe_object
 
-from stripe2qbo.stripe.stripe_transactions import get_transaction
+from stripe2qbo.stripe import stripe_transactions
+from stripe2qbo.stripe.stripe_transactions import (
+    _expansions,
+    _retrieve_async,
+    build_transaction,
+    get_transaction,
+    prefetch_expansions,
+)
 
 load_dotenv()
 
@@ -107,3 +117,129 @@ def test_payout_transaction():
     assert transaction.customer is None
     assert transaction.charge is None
     assert transaction.invoice is None
+
+
+def _invoice_balance_transaction(i: int, product_ids: List[str]):
+    lines = [
+        {
+            "object": "line_item",
+            "id": f"il_{i}_{j}",
+            "amount": 1000,
+            "description": f"Product {product_id}",
+            "quantity": 1,
+            "plan": None,
+            "price": {"object": "price", "id": "price_1", "product": product_id},
+            "tax_amounts": [
+                {"amount": 130, "taxable_amount": 1000, "tax_rate": "txr_1"}
+            ],
+        }
+        for j, product_id in enumerate(product_ids)
+    ]
+    return convert_to_stripe_object(
+        {
+            "object": "balance_transaction",
+            "id": f"txn_{i}",
+            "created": 1690000000,
+            "description": None,
+            "type": "charge",
+            "amount": 2260,
+            "fee": 100,
+            "exchange_rate": None,
+            "currency": "usd",
+            "source": {
+                "object": "charge",
+                "id": f"ch_{i}",
+                "amount": 2260,
+                "created": 1690000000,
+                "description": None,
+                "currency": "usd",
+                "customer": None,
+                "invoice": {
+                    "object": "invoice",
+                    "id": f"in_{i}",
+                    "created": 1690000000,
+                    "amount_due": 2260,
+                    "currency": "usd",
+                    "lines": {"object": "list", "data": lines},
+                },
+            },
+        }
+    )
+
+
+def test_prefetch_fetches_each_product_and_tax_rate_once(monkeypatch):
+    retrieved: List[str] = []
+
+    def retrieve(id: str, stripe_account: str):
+        retrieved.append(id)
+        if id.startswith("txr_"):
+            return convert_to_stripe_object(
+                {"object": "tax_rate", "id": id, "percentage": 13.0}
+            )
+        return convert_to_stripe_object(
+            {"object": "product", "id": id, "name": f"Product {id}"}
+        )
+
+    monkeypatch.setattr(stripe.Product, "retrieve", retrieve)
+    monkeypatch.setattr(stripe.TaxRate, "retrieve", retrieve)
+    _expansions.clear()
+
+    txns = [
+        _invoice_balance_transaction(i, ["prod_a", "prod_b" if i % 2 else "prod_c"])
+        for i in range(20)
+    ]
+    expansions = prefetch_expansions(txns, "acct_1")
+    transactions = [build_transaction(txn, "acct_1", expansions) for txn in txns]
+
+    assert sorted(retrieved) == ["prod_a", "prod_b", "prod_c", "txr_1"]
+    assert transactions[1].invoice is not None
+    assert [line.product.name for line in transactions[1].invoice.lines] == [
+        "Product prod_a",
+        "Product prod_b",
+    ]
+    tax_rate = transactions[1].invoice.lines[0].tax_amounts[0].tax_rate
+    assert tax_rate is not None
+    assert tax_rate.percentage == 13.0
+
+
+@pytest.fixture
+def requested(monkeypatch: pytest.MonkeyPatch) -> List[str]:
+    """Paths requested from Stripe by _retrieve_async"""
+    paths: List[str] = []
+
+    async def stripe_request(path: str, account_id: str):
+        paths.append(path)
+        return convert_to_stripe_object({"object": "product", "id": path})
+
+    monkeypatch.setattr(stripe_transactions, "stripe_request", stripe_request)
+    return paths
+
+
+async def test_cache_evicts_least_recently_used(
+    requested: List[str], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(stripe_transactions, "EXPANSION_CACHE_SIZE", 2)
+    stripe_transactions._loop_expansions.clear()
+
+    for product_id in ["prod_a", "prod_b", "prod_a", "prod_c", "prod_a", "prod_b"]:
+        await _retrieve_async("product", product_id, "acct_1")
+
+    # prod_a was used again before prod_c was added, so prod_b went first
+    assert requested == [
+        "/v1/products/prod_a",
+        "/v1/products/prod_b",
+        "/v1/products/prod_c",
+        "/v1/products/prod_b",
+    ]
+
+
+def test_cache_is_kept_per_event_loop(requested: List[str]):
+    loops = [asyncio.new_event_loop() for _ in range(2)]
+    try:
+        for loop in loops + loops:
+            loop.run_until_complete(_retrieve_async("product", "prod_a", "acct_1"))
+    finally:
+        for loop in loops:
+            loop.close()
+
+    assert requested == ["/v1/products/prod_a"] * 2
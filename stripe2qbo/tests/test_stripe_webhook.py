@@ -0,0 +1,239 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from stripe2qbo.api.app import app
+from stripe2qbo.api.dependencies import get_db
+from stripe2qbo.api.routers import stripe_router
+from stripe2qbo.db.models import ImportWatermark, StripeEvent, TransactionSync
+from stripe2qbo.stripe.models import Transaction
+from stripe2qbo.workers import sync_worker
+
+SECRET = "whsec_test"
+
+client = TestClient(app)
+
+
+def _transaction(id: str) -> Transaction:
+    return Transaction(
+        id=id,
+        created=1690000000,
+        type="charge",
+        amount=1000,
+        fee=59,
+        exchange_rate=None,
+        currency="usd",
+    )
+
+
+def _post_event(event: Dict[str, Any], secret: str = SECRET):
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return client.post(
+        "/api/stripe/webhook",
+        content=payload,
+        headers={"Stripe-Signature": f"t={timestamp},v1={signature}"},
+    )
+
+
+def _event(id: str, type: str, obj: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": id,
+        "object": "event",
+        "type": type,
+        "account": "acct_123",
+        "data": {"object": obj},
+    }
+
+
+@pytest.fixture
+def db_sessionmaker(db_sessionmaker: sessionmaker) -> Iterator[sessionmaker]:
+    def _get_db():
+        with db_sessionmaker() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = _get_db
+    yield db_sessionmaker
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def enqueued(monkeypatch: pytest.MonkeyPatch) -> List[Tuple[int, Optional[List[str]]]]:
+    calls: List[Tuple[int, Optional[List[str]]]] = []
+    monkeypatch.setattr(stripe_router, "STRIPE_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(
+        stripe_router.import_new_transactions_worker,
+        "delay",
+        lambda user_id, transaction_ids, event_id: calls.append(
+            (user_id, transaction_ids)
+        ),
+    )
+    return calls
+
+
+def test_webhook_rejects_invalid_signature(db_sessionmaker, enqueued):
+    event = _event("evt_1", "charge.succeeded", {"balance_transaction": "txn_1"})
+
+    response = _post_event(event, secret="whsec_other")
+
+    assert response.status_code == 400
+    assert enqueued == []
+
+
+def test_webhook_imports_each_event_once(db_sessionmaker, enqueued):
+    charge = _event("evt_1", "charge.succeeded", {"balance_transaction": "txn_1"})
+    balance = _event("evt_2", "balance.available", {"object": "balance"})
+
+    assert _post_event(charge).json() == "ok"
+    assert _post_event(charge).json() == "duplicate"
+    assert _post_event(balance).json() == "ok"
+    assert _post_event(_event("evt_3", "customer.created", {})).json() == "ignored"
+
+    assert enqueued == [(1, ["txn_1"]), (1, None)]
+    with db_sessionmaker() as db:
+        assert set(db.scalars(select(StripeEvent.id))) == {"evt_1", "evt_2"}
+
+
+async def test_import_new_transactions_pages_from_watermark(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    pages = [[f"txn_{page}_{i}" for i in range(100)] for page in range(3)]
+    pages[2] = pages[2][:30]
+    requests: List[Tuple[Optional[int], Optional[str]]] = []
+
+    async def get_transactions_async(
+        account_id: str,
+        from_timestamp: Optional[int] = None,
+        starting_after: Optional[str] = None,
+        **kwargs,
+    ) -> List[Transaction]:
+        requests.append((from_timestamp, starting_after))
+        page = 0 if starting_after is None else int(starting_after.split("_")[1]) + 1
+        return [
+            _transaction(id).model_copy(update={"created": 1690000100 - page})
+            for id in pages[page]
+        ]
+
+    monkeypatch.setattr(sync_worker, "get_transactions_async", get_transactions_async)
+    with db_sessionmaker() as db:
+        db.add(
+            ImportWatermark(
+                stripe_id="acct_123",
+                from_timestamp=None,
+                created=1690000000,
+                transaction_id="txn_old",
+            )
+        )
+        # Imported rows in the middle don't hide the older ones after them
+        for id in pages[1][50:]:
+            db.add(
+                TransactionSync(
+                    id=id,
+                    created=1690000000,
+                    type="charge",
+                    fee=59,
+                    currency="usd",
+                    amount=1000,
+                    description="",
+                    stripe_id="acct_123",
+                    user_id=1,
+                    status="success",
+                )
+            )
+        db.commit()
+
+    new_ids = await sync_worker.import_new_transactions(1)
+
+    assert new_ids == pages[0] + pages[1][:50] + pages[2]
+    assert requests == [
+        (1690000000, None),
+        (1690000000, pages[0][-1]),
+        (1690000000, pages[1][-1]),
+    ]
+    with db_sessionmaker() as db:
+        rows = db.execute(select(TransactionSync.id, TransactionSync.status))
+        statuses = {id: status for id, status in rows}
+        watermark = db.get(ImportWatermark, "acct_123")
+        assert watermark is not None
+        assert (watermark.created, watermark.transaction_id) == (
+            1690000100,
+            pages[0][0],
+        )
+    assert len(statuses) == 230
+    assert statuses[pages[1][-1]] == "success"
+
+
+async def test_import_new_transactions_needs_watermark(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    async def get_transactions_async(*args, **kwargs) -> List[Transaction]:
+        raise AssertionError("Listed the account's whole history")
+
+    monkeypatch.setattr(sync_worker, "get_transactions_async", get_transactions_async)
+
+    assert await sync_worker.import_new_transactions(1) == []
+
+
+async def test_import_new_transactions_dispatches_sync(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    async def get_transaction_async(id: str, account_id: str) -> Transaction:
+        return _transaction(id)
+
+    queued: List[List[str]] = []
+    monkeypatch.setattr(sync_worker, "get_transaction_async", get_transaction_async)
+    monkeypatch.setattr(sync_worker, "STRIPE_WEBHOOK_SYNC", True)
+    monkeypatch.setattr(sync_worker, "_fair_queue", None)
+    monkeypatch.setattr(
+        sync_worker.sync_transactions_worker,
+        "delay",
+        lambda ids, user_id: queued.append(ids),
+    )
+
+    assert await sync_worker.import_new_transactions(1, ["txn_1"]) == ["txn_1"]
+
+    assert queued == [["txn_1"]]
+    with db_sessionmaker() as db:
+        synced = db.get(TransactionSync, "txn_1")
+        assert synced is not None and synced.status == "syncing"
+
+
+def test_failed_import_forgets_event_after_retries(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    attempts: List[int] = []
+
+    async def import_new_transactions(user_id: int, transaction_ids=None):
+        attempts.append(user_id)
+        raise Exception("Stripe is down")
+
+    monkeypatch.setattr(sync_worker, "import_new_transactions", import_new_transactions)
+    with db_sessionmaker() as db:
+        db.add(
+            StripeEvent(
+                id="evt_1",
+                type="charge.succeeded",
+                account_id="acct_123",
+                received_at=1690000000,
+            )
+        )
+        db.commit()
+
+    result = sync_worker.import_new_transactions_worker.apply(
+        args=(1, ["txn_1"], "evt_1")
+    )
+
+    assert result.failed()
+    assert len(attempts) == sync_worker.WEBHOOK_IMPORT_MAX_RETRIES + 1
+    with db_sessionmaker() as db:
+        assert db.get(StripeEvent, "evt_1") is None
@@ -0,0 +1,194 @@
+from typing import Callable, List, Tuple
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from stripe2qbo.db.models import TransactionSync, User
+from stripe2qbo.db.schemas import TransactionSync as TransactionSyncSchema
+from stripe2qbo.stripe.models import Transaction
+from stripe2qbo.workers import sync_worker
+from stripe2qbo.workers.fair_queue import RedisFairQueue
+
+IDS = [f"txn_{i}" for i in range(5)]
+
+
+@pytest.fixture
+def db_sessionmaker(db_sessionmaker: sessionmaker) -> sessionmaker:
+    with db_sessionmaker() as db:
+        for id in IDS:
+            db.add(
+                TransactionSync(
+                    id=id,
+                    created=1690000000,
+                    type="charge",
+                    fee=59,
+                    currency="usd",
+                    amount=1000,
+                    description="",
+                    stripe_id="acct_123",
+                    user_id=1,
+                    status="pending",
+                )
+            )
+        db.commit()
+
+    return db_sessionmaker
+
+
+def _statuses(db_sessionmaker: sessionmaker) -> List[Tuple[str, str, str | None]]:
+    with db_sessionmaker() as db:
+        rows = db.execute(
+            select(
+                TransactionSync.id,
+                TransactionSync.status,
+                TransactionSync.failure_reason,
+            ).order_by(TransactionSync.id)
+        )
+        return [(id, status, reason) for id, status, reason in rows]
+
+
+def test_dispatch_sync_queues_chunks(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(sync_worker, "_fair_queue", None)
+    monkeypatch.setattr(sync_worker, "SYNC_CHUNK_SIZE", 2)
+    queued: List[List[str]] = []
+    monkeypatch.setattr(
+        sync_worker.sync_transactions_worker,
+        "delay",
+        lambda ids, user_id: queued.append(ids),
+    )
+
+    with db_sessionmaker() as db:
+        sync_worker.dispatch_sync(db, 1, IDS)
+
+    assert queued == [IDS[0:2], IDS[2:4], IDS[4:]]
+    assert {status for _, status, _ in _statuses(db_sessionmaker)} == {"syncing"}
+
+
+def test_dispatch_sync_resets_only_unqueued_chunks(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(sync_worker, "_fair_queue", None)
+    monkeypatch.setattr(sync_worker, "SYNC_CHUNK_SIZE", 2)
+    queued: List[List[str]] = []
+
+    def delay(ids: List[str], user_id: int) -> None:
+        if len(queued) == 1:
+            raise ConnectionError("Broker unavailable")
+        queued.append(ids)
+
+    monkeypatch.setattr(sync_worker.sync_transactions_worker, "delay", delay)
+
+    with db_sessionmaker() as db, pytest.raises(ConnectionError):
+        sync_worker.dispatch_sync(db, 1, IDS)
+
+    assert [status for _, status, _ in _statuses(db_sessionmaker)] == [
+        "syncing",
+        "syncing",
+        "pending",
+        "pending",
+        "pending",
+    ]
+
+
+def test_dispatch_sync_keeps_pushed_ids_if_tasks_fail_to_start(
+    db_sessionmaker: sessionmaker,
+    redis_fair_queue: Callable[[int, int], RedisFairQueue],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    queue = redis_fair_queue(2, 60)
+    monkeypatch.setattr(sync_worker, "_fair_queue", queue)
+
+    def delay() -> None:
+        raise ConnectionError("Broker unavailable")
+
+    monkeypatch.setattr(sync_worker.sync_next_worker, "delay", delay)
+
+    with db_sessionmaker() as db:
+        sync_worker.dispatch_sync(db, 1, IDS)
+
+    # Left for resume_sync_next to start
+    assert queue.has_queued()
+    assert {status for _, status, _ in _statuses(db_sessionmaker)} == {"syncing"}
+
+
+class FakeSyncer:
+    async def sync(self, transaction: Transaction, user: User) -> TransactionSyncSchema:
+        if transaction.id == "txn_3":
+            raise ValueError("Boom")
+        return TransactionSyncSchema(
+            **transaction.model_dump(),
+            user_id=user.id,
+            stripe_id="acct_123",
+            status="success",
+            payment_id=transaction.id.replace("txn", "payment"),
+        )
+
+
+async def test_sync_transactions_loads_once_and_reports_each_result(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    loads: List[int] = []
+    notified: List[str] = []
+
+    async def get_syncer(db, user_id: int):
+        loads.append(user_id)
+        return FakeSyncer(), db.get(User, user_id), "acct_123"
+
+    async def get_transaction_async(transaction_id: str, account_id: str):
+        return Transaction(
+            id=transaction_id,
+            created=1690000000,
+            type="charge",
+            amount=1000,
+            fee=59,
+            exchange_rate=None,
+            currency="usd",
+        )
+
+    monkeypatch.setattr(sync_worker, "_get_syncer", get_syncer)
+    monkeypatch.setattr(sync_worker, "get_transaction_async", get_transaction_async)
+    monkeypatch.setattr(
+        sync_worker, "notify", lambda user_id, result: notified.append(result.id)
+    )
+
+    results = await sync_worker.sync_transactions(IDS, 1)
+
+    assert loads == [1]
+    assert [(r.id, r.status) for r in results] == [
+        ("txn_0", "success"),
+        ("txn_1", "success"),
+        ("txn_2", "success"),
+        ("txn_3", "failed"),
+        ("txn_4", "success"),
+    ]
+    assert sorted(notified) == IDS
+    assert _statuses(db_sessionmaker)[3] == ("txn_3", "failed", "Server error")
+    with db_sessionmaker() as db:
+        synced = db.get(TransactionSync, "txn_4")
+        assert synced is not None and synced.payment_id == "payment_4"
+
+
+async def test_sync_transactions_fails_chunk_if_setup_fails(
+    db_sessionmaker: sessionmaker, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(sync_worker, "notify", lambda user_id, result: None)
+
+    # User 1 has no QBO token or settings
+    results = await sync_worker.sync_transactions(IDS[:2], 1)
+
+    assert [(r.id, r.status) for r in results] == [
+        ("txn_0", "failed"),
+        ("txn_1", "failed"),
+    ]
+    statuses = _statuses(db_sessionmaker)
+    assert [status for _, status, _ in statuses] == [
+        "failed",
+        "failed",
+        "pending",
+        "pending",
+        "pending",
+    ]
+    assert statuses[0][2] is not None
@@ -3,6 +3,7 @@ import pytest
 from stripe2qbo.api.routers.transaction_router import (
     get_all_transactions,
     get_transaction_by_id,
+    transaction_filters,
 )
 from stripe2qbo.qbo.auth import Token
 from stripe2qbo.db.models import TransactionSync, User, QBOToken
@@ -41,7 +42,7 @@ def test_transaction(test_user: User, test_token: Token):
 
 
 async def test_get_all_transactions(test_user: User, test_transaction: None):
-    test_value = get_all_transactions(test_user, db)
+    test_value = get_all_transactions(transaction_filters(test_user), db).transactions
 
     assert len(test_value) == 1
     assert test_value[0].user_id == test_user.id
@@ -8,9 +8,20 @@ import stripe
 from stripe2qbo.db.schemas import Settings
 from stripe2qbo.qbo.QBO import QBO
 from stripe2qbo.qbo.models import TaxCode
-from stripe2qbo.stripe.models import Transaction
+from stripe2qbo.stripe.models import (
+    Charge,
+    Invoice,
+    InvoiceLine,
+    Payout,
+    Product,
+    TaxAmount,
+    TaxRate,
+    Transaction,
+)
 from stripe2qbo.stripe.stripe_transactions import build_transaction, get_transaction
 from stripe2qbo.sync_helpers import (
+    DateFormatter,
+    Transformer,
     payment_from_charge,
     qbo_invoice_from_stripe_invoice,
     transfer_from_payout,
@@ -299,3 +310,139 @@ def test_payment_from_charge(test_customer, test_settings):
     assert payment.ExchangeRate == transaction.exchange_rate
 
     assert payment.Line is None
+
+
+def test_date_formatter_formats_each_day():
+    format_date = DateFormatter()
+    midnight = datetime(2023, 7, 1)
+    timestamps = [
+        int(midnight.timestamp()) + offset
+        for offset in [0, 1, 3600, 86399, 86400, 90000, -1]
+    ]
+
+    assert [format_date(timestamp) for timestamp in timestamps] == [
+        datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+        for timestamp in timestamps
+    ]
+
+
+def test_transform_all():
+    settings = Settings(
+        stripe_clearing_account_id="1",
+        stripe_payout_account_id="2",
+        stripe_vendor_id="3",
+        stripe_fee_account_id="4",
+        default_income_account_id="5",
+        default_tax_code_id="10",
+        exempt_tax_code_id="11",
+    )
+    tax_code = TaxCode.model_validate(
+        {
+            "Id": "10",
+            "SalesTaxRateList": {
+                "TaxRateDetail": [{"TaxRateRef": {"value": "7", "name": "GST"}}]
+            },
+        }
+    )
+    created = 1690000000
+    charge = Transaction(
+        id="txn_1",
+        created=created,
+        type="charge",
+        amount=1500,
+        fee=74,
+        exchange_rate=None,
+        currency="usd",
+        charge=Charge(
+            id="ch_1", amount=1500, created=created, description=None, currency="usd"
+        ),
+        invoice=Invoice(
+            id="in_1",
+            created=created,
+            due_date=created + 86400 * 30,
+            amount_due=1500,
+            currency="usd",
+            tax=100,
+            number="INV-1",
+            lines=[
+                InvoiceLine(
+                    id="il_1",
+                    amount=1000,
+                    description="Taxed",
+                    quantity=1,
+                    product=Product(name="Product 1"),
+                    tax_amounts=[
+                        TaxAmount(
+                            amount=100,
+                            taxable_amount=1000,
+                            tax_rate=TaxRate(id="txr_1", percentage=10),
+                        )
+                    ],
+                ),
+                InvoiceLine(
+                    id="il_2",
+                    amount=400,
+                    description="Exempt",
+                    quantity=1,
+                    product=Product(name="Product 2"),
+                ),
+            ],
+        ),
+    )
+    payout = Transaction(
+        id="txn_2",
+        created=created,
+        type="payout",
+        amount=-2000,
+        fee=0,
+        exchange_rate=None,
+        currency="usd",
+        payout=Payout(
+            id="po_1",
+            amount=2000,
+            arrival_date=created,
+            created=created,
+            description="STRIPE PAYOUT",
+        ),
+    )
+    fee = Transaction(
+        id="txn_3",
+        created=created,
+        type="stripe_fee",
+        amount=-500,
+        fee=0,
+        exchange_rate=None,
+        currency="usd",
+    )
+
+    transformer = Transformer(settings, {"10": tax_code, "11": tax_code})
+    payloads = transformer.transform_all(
+        [charge, payout, fee], {"txn_1": "42"}, {"in_1": "43"}
+    )
+
+    assert [payload.transaction_id for payload in payloads] == [
+        "txn_1",
+        "txn_2",
+        "txn_3",
+    ]
+    invoice, payment, expense, transfer = payloads[0][1:]
+    assert invoice is not None and payment is not None and expense is not None
+    assert transfer is None
+    assert payloads[1][1:4] == (None, None, None)
+    assert payloads[2].expense is not None and payloads[2].transfer is None
+    assert payloads[1].transfer == transfer_from_payout(payout.payout, settings)
+
+    assert invoice.CustomerRef.value == "42"
+    assert [line.SalesItemLineDetail.TaxCodeRef.value for line in invoice.Line] == [
+        "10",
+        "11",
+    ]
+    assert payment.Line is not None
+    assert payment.Line[0].LinkedTxn[0].TxnId == "43"
+    assert expense.TotalAmt == 0.74
+
+    # Dumping and validating again round-trips to the same models
+    for model in [invoice, payment, expense, payloads[1].transfer]:
+        assert model is not None
+        validated = type(model).model_validate(model.model_dump())
+        assert validated.model_dump() == model.model_dump()
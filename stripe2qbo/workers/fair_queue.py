@@ -0,0 +1,154 @@
+from typing import List, NamedTuple, Optional, cast
+from abc import ABC, abstractmethod
+import os
+import uuid
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Max chunks synced at the same time for one user, and so one QBO realm
+SYNC_MAX_TASKS_PER_REALM = int(os.getenv("SYNC_MAX_TASKS_PER_REALM", "2"))
+
+# Seconds after which a chunk that wasn't marked done stops counting as running,
+# in case its worker was lost
+SYNC_LEASE_TIMEOUT = int(os.getenv("SYNC_LEASE_TIMEOUT", "900"))
+
+# Ids pushed per call, to stay under Lua's limit on unpacked arguments
+PUSH_BATCH_SIZE = 1000
+
+# Append ids to a user's queue, and add the user to the front of the ring
+# if it isn't in it
+PUSH_SCRIPT = """
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+if redis.call('SADD', KEYS[3], ARGV[1]) == 1 then
+    redis.call('LPUSH', KEYS[2], ARGV[1])
+end
+"""
+
+# Take a chunk from the next user in the ring with fewer than max_running
+# chunks running, moving them to the back of the ring.
+# Users with nothing queued are dropped from the ring.
+POP_SCRIPT = """
+local prefix = ARGV[1]
+local max_running = tonumber(ARGV[2])
+local size = tonumber(ARGV[3])
+local lease = ARGV[4]
+local timeout = tonumber(ARGV[5])
+local now = tonumber(redis.call('TIME')[1])
+
+for i = 1, redis.call('LLEN', KEYS[1]) do
+    local user = redis.call('LPOP', KEYS[1])
+    local queue = prefix .. ':queue:' .. user
+    if redis.call('LLEN', queue) == 0 then
+        redis.call('SREM', KEYS[2], user)
+    else
+        redis.call('RPUSH', KEYS[1], user)
+        local running = prefix .. ':running:' .. user
+        redis.call('ZREMRANGEBYSCORE', running, '-inf', now)
+        if redis.call('ZCARD', running) < max_running then
+            local ids = redis.call('LRANGE', queue, 0, size - 1)
+            redis.call('LTRIM', queue, size, -1)
+            redis.call('ZADD', running, now + timeout, lease)
+            redis.call('EXPIRE', running, timeout)
+            return {user, unpack(ids)}
+        end
+    end
+end
+return false
+"""
+
+
+class Chunk(NamedTuple):
+    user_id: int
+    transaction_ids: List[str]
+    lease: str
+
+
+class FairQueue(ABC):
+    """Transactions waiting to be synced, in a queue per user.
+
+    Chunks are taken from each user's queue in turn, so that one user's
+    backlog doesn't hold up everyone else, and at most `max_running` chunks
+    of a user are synced at once, to stay within their QBO realm's limits.
+    Users without queued transactions join at the front of the turns,
+    so their first chunk is taken next."""
+
+    def __init__(self, max_running: int, lease_timeout: int) -> None:
+        self.max_running = max_running
+        self.lease_timeout = lease_timeout
+
+    @abstractmethod
+    def push(self, user_id: int, transaction_ids: List[str]) -> None:
+        """Queue ids at the back of the user's queue, all of them or none"""
+
+    @abstractmethod
+    def pop(self, size: int) -> Optional[Chunk]:
+        """Take up to `size` ids from the next user's queue, if any user has
+        ids queued and fewer than max_running chunks running.
+        The chunk counts as running until `done` is called."""
+
+    @abstractmethod
+    def done(self, chunk: Chunk) -> None:
+        ...
+
+    @abstractmethod
+    def has_queued(self) -> bool:
+        """Whether any user may have ids queued"""
+
+
+class RedisFairQueue(FairQueue):
+    """Fair queue shared by every process connected to the same Redis server"""
+
+    def __init__(
+        self, url: str, prefix: str, max_running: int, lease_timeout: int
+    ) -> None:
+        super().__init__(max_running, lease_timeout)
+        self._redis = redis.Redis(connection_pool=redis.ConnectionPool.from_url(url))
+        self._push = self._redis.register_script(PUSH_SCRIPT)
+        self._pop = self._redis.register_script(POP_SCRIPT)
+        self._prefix = prefix
+
+    def push(self, user_id: int, transaction_ids: List[str]) -> None:
+        keys = [
+            f"{self._prefix}:queue:{user_id}",
+            f"{self._prefix}:ring",
+            f"{self._prefix}:active",
+        ]
+        # In one transaction, so that either every id is queued or none is
+        pipe = self._redis.pipeline(transaction=True)
+        for i in range(0, len(transaction_ids), PUSH_BATCH_SIZE):
+            batch = transaction_ids[i : i + PUSH_BATCH_SIZE]
+            self._push(keys=keys, args=[user_id, *batch], client=pipe)
+        pipe.execute()
+
+    def pop(self, size: int) -> Optional[Chunk]:
+        lease = uuid.uuid4().hex
+        result = self._pop(
+            keys=[f"{self._prefix}:ring", f"{self._prefix}:active"],
+            args=[self._prefix, self.max_running, size, lease, self.lease_timeout],
+        )
+        if not result:
+            return None
+        user_id, *ids = [value.decode() for value in result]
+        return Chunk(int(user_id), ids, lease)
+
+    def done(self, chunk: Chunk) -> None:
+        self._redis.zrem(f"{self._prefix}:running:{chunk.user_id}", chunk.lease)
+
+    def has_queued(self) -> bool:
+        return cast(int, self._redis.llen(f"{self._prefix}:ring")) > 0
+
+
+def create_fair_queue() -> Optional[FairQueue]:
+    """Create the fair queue shared by the API and workers, if REDIS_URL is set.
+
+    Without Redis, there is nowhere for them to share it, and syncs are
+    queued on Celery directly, in the order they were requested."""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisFairQueue(
+            redis_url, "syncqueue", SYNC_MAX_TASKS_PER_REALM, SYNC_LEASE_TIMEOUT
+        )
+    return None
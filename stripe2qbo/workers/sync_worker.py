@@ -1,20 +1,75 @@
+from typing import Collection, List, Optional, Set, Tuple
+import math
 import asyncio
 import os
 import hmac
 import hashlib
+import time
 
 from celery import Celery  # type:ignore
+from celery.signals import worker_process_shutdown  # type:ignore
+from pydantic import BaseModel
+from redis import RedisError
 from requests import request
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
 
+from stripe2qbo.cache import close_cache
 from stripe2qbo.db.database import SessionLocal
-from stripe2qbo.db.models import User, TransactionSync
-from stripe2qbo.stripe.stripe_transactions import get_transaction
-from stripe2qbo.Stripe2QBO import create_stripe2qbo
+from stripe2qbo.db.bulk import insert_new_transactions
+from stripe2qbo.db.watermark import advance_watermark, incremental_from_timestamp
+from stripe2qbo.db.models import (
+    ImportJob,
+    ImportWatermark,
+    StripeEvent,
+    SyncSchedule,
+    TransactionSync,
+    User,
+)
+from stripe2qbo.db.schemas import (
+    ImportJob as ImportJobSchema,
+    TransactionSync as TransactionSyncSchema,
+)
+from stripe2qbo.stripe.stripe_transactions import (
+    get_transaction_async,
+    get_transactions_async,
+)
+from stripe2qbo.stripe import stripe_request
+from stripe2qbo.Stripe2QBO import Stripe2QBO, get_stripe2qbo
 from stripe2qbo.api.dependencies import get_qbo_token
 from stripe2qbo.api.routers.settings import get_settings
+from stripe2qbo.workers.fair_queue import create_fair_queue
+from stripe2qbo.qbo import qbo_request
+from stripe2qbo.rate_limit import backoff
 
 BROKER_URL = os.getenv("BROKER_URL", "amqp://localhost")
 
+# Max transactions synced at the same time by one task
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "5"))
+
+# Send the QBO objects created by concurrent syncs together through QBO's /batch
+# endpoint. Only worth it with a SYNC_CONCURRENCY high enough to fill batches,
+# since each create waits briefly for others to join its batch.
+SYNC_QBO_BATCH = os.getenv("SYNC_QBO_BATCH", "false").lower() == "true"
+
+# Transactions synced by each task. The user's token, settings and syncer
+# are loaded once per task.
+SYNC_CHUNK_SIZE = int(os.getenv("SYNC_CHUNK_SIZE", "50"))
+
+IMPORT_PAGE_SIZE = 100
+
+# Seconds between Celery beat's checks for scheduled syncs that are due
+SCHEDULE_CHECK_INTERVAL = int(os.getenv("SCHEDULE_CHECK_INTERVAL", "60"))
+
+# Seconds without progress after which a running import is assumed lost
+IMPORT_STALE_AFTER = int(os.getenv("IMPORT_STALE_AFTER", "600"))
+
+# Retries of a failed import for a Stripe webhook event, e.g. after Stripe errors
+WEBHOOK_IMPORT_MAX_RETRIES = 5
+
+# Sync transactions as soon as they are imported from a Stripe webhook event
+STRIPE_WEBHOOK_SYNC = os.getenv("STRIPE_WEBHOOK_SYNC", "false").lower() == "true"
+
 app = Celery(
     "syncbooks",
     broker=BROKER_URL,
@@ -23,17 +78,150 @@ app = Celery(
     task_serializer="json",
 )
 
+_loop: asyncio.AbstractEventLoop | None = None
+
+_fair_queue = create_fair_queue()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop reused by every task in this worker process.
+
+    Keeping one loop alive lets tasks share the pooled QBO and Stripe
+    connections instead of opening new ones for each task."""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+@worker_process_shutdown.connect
+def shutdown_event_loop(**kwargs) -> None:
+    global _loop
+    if _loop is None or _loop.is_closed():
+        return
+    _loop.run_until_complete(qbo_request.close_client())
+    _loop.run_until_complete(stripe_request.close_client())
+    _loop.run_until_complete(close_cache())
+    _loop.close()
+    _loop = None
+
 
 @app.task
 def sync_transaction_worker(transaction_id: str, user_id: int):
-    asyncio.run(sync_transaction(transaction_id, user_id))
+    get_event_loop().run_until_complete(sync_transactions([transaction_id], user_id))
 
 
-async def sync_transaction(transaction_id: str, user_id: int):
-    db = SessionLocal()
-    if db is None:
-        raise Exception("DB is not set")
+@app.task
+def sync_transactions_worker(transaction_ids: List[str], user_id: int):
+    results = get_event_loop().run_until_complete(
+        sync_transactions(transaction_ids, user_id)
+    )
+    return [
+        result.model_dump(include={"id", "status", "failure_reason"})
+        for result in results
+    ]
+
+
+def _push_fair(user_id: int, transaction_ids: List[str]) -> bool:
+    if _fair_queue is None:
+        return False
+    try:
+        _fair_queue.push(user_id, transaction_ids)
+    except RedisError:
+        return False
+
+    chunks = math.ceil(len(transaction_ids) / SYNC_CHUNK_SIZE)
+    try:
+        for _ in range(min(chunks, _fair_queue.max_running)):
+            sync_next_worker.delay()
+    except Exception as e:
+        # The ids are queued already, and resume_sync_next starts their tasks
+        print("Failed to start sync_next_worker", e)
+    return True
+
+
+def dispatch_sync(db: Session, user_id: int, transaction_ids: List[str]) -> None:
+    """Mark transactions as syncing, commit, and queue them to be synced.
+
+    With a fair queue, the transactions wait in the user's own queue, and
+    each sync_next_worker task syncs a chunk from the next user in turn.
+    Enough tasks are started to run the user's max concurrent chunks.
+    Otherwise, a task is queued for each chunk of SYNC_CHUNK_SIZE. If
+    queueing fails, the transactions not queued are marked pending again."""
+    # Before queueing, so that a chunk synced right away isn't marked again
+    db.query(TransactionSync).filter(TransactionSync.id.in_(transaction_ids)).update(
+        {"status": "syncing"}
+    )
+    db.commit()
+
+    queued = 0
+    try:
+        if _push_fair(user_id, transaction_ids):
+            return
+        for i in range(0, len(transaction_ids), SYNC_CHUNK_SIZE):
+            chunk = transaction_ids[i : i + SYNC_CHUNK_SIZE]
+            sync_transactions_worker.delay(chunk, user_id)
+            queued = i + len(chunk)
+    except Exception:
+        db.query(TransactionSync).filter(
+            TransactionSync.id.in_(transaction_ids[queued:])
+        ).update({"status": "pending"})
+        db.commit()
+        raise
+
+
+@app.task
+def sync_next_worker():
+    get_event_loop().run_until_complete(sync_next())
+
 
+async def sync_next() -> bool:
+    """Sync the next chunk from the fair queue, then start another task
+    to take the chunk after it.
+
+    Returns:
+        bool: False if there was no chunk to take, which ends the chain"""
+    if _fair_queue is None:
+        return False
+    try:
+        chunk = _fair_queue.pop(SYNC_CHUNK_SIZE)
+    except RedisError:
+        return False
+    if chunk is None:
+        return False
+
+    try:
+        await sync_transactions(chunk.transaction_ids, chunk.user_id)
+    finally:
+        try:
+            _fair_queue.done(chunk)
+        except RedisError:
+            pass  # its lease expires after SYNC_LEASE_TIMEOUT
+        sync_next_worker.delay()
+    return True
+
+
+@app.task
+def resume_sync_next() -> None:
+    """Start taking chunks from the fair queue again, run by Celery beat.
+
+    A chain of sync_next_worker tasks ends when its worker is lost with a
+    chunk, or when it finds every queued user at max_running chunks.
+    Without this, transactions left queued would wait for another sync to
+    be dispatched. Extra tasks end as soon as they find no chunk to take."""
+    if _fair_queue is None:
+        return
+    try:
+        queued = _fair_queue.has_queued()
+    except RedisError:
+        return
+    if queued:
+        for _ in range(_fair_queue.max_running):
+            sync_next_worker.delay()
+
+
+async def _get_syncer(db: Session, user_id: int) -> Tuple[Stripe2QBO, User, str]:
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise Exception("User is not set")
@@ -44,29 +232,467 @@ async def sync_transaction(transaction_id: str, user_id: int):
     if settings is None:
         raise Exception("Settings is not set")
 
-    if user.stripe_user_id is None:
+    stripe_user_id = user.stripe_user_id
+    if stripe_user_id is None:
         raise Exception("Stripe user id is not set")
 
-    syncer = await create_stripe2qbo(settings, qbo_token)
-    transaction = get_transaction(transaction_id, account_id=user.stripe_user_id)
-    transaction_sync = await syncer.sync(transaction, user)
-
-    db.query(TransactionSync).filter(TransactionSync.id == transaction_id).update(
-        {
-            "status": transaction_sync.status,
-            "transfer_id": transaction_sync.transfer_id,
-            "invoice_id": transaction_sync.invoice_id,
-            "payment_id": transaction_sync.payment_id,
-            "expense_id": transaction_sync.expense_id,
-            "failure_reason": transaction_sync.failure_reason or None,
+    syncer = await get_stripe2qbo(settings, qbo_token, batch=SYNC_QBO_BATCH)
+    return syncer, user, stripe_user_id
+
+
+async def sync_transactions(
+    transaction_ids: List[str], user_id: int
+) -> List[TransactionSyncSchema]:
+    """Sync a chunk of a user's transactions, several at a time.
+
+    The user, QBO token, settings and syncer are loaded once for the chunk,
+    and the results are saved together. If they can't be loaded, every
+    transaction of the chunk fails with the reason.
+
+    Returns:
+        List[TransactionSyncSchema]: the result of each transaction"""
+    db = SessionLocal()
+    try:
+        outcomes: List[TransactionSyncSchema | str] = []
+        try:
+            syncer, user, stripe_user_id = await _get_syncer(db, user_id)
+        except Exception as e:
+            outcomes = [str(e)] * len(transaction_ids)
+        else:
+            semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+            async def _sync(transaction_id: str) -> TransactionSyncSchema:
+                async with semaphore:
+                    transaction = await get_transaction_async(
+                        transaction_id, account_id=stripe_user_id
+                    )
+                    return await syncer.sync(transaction, user)
+
+            results = await asyncio.gather(
+                *[_sync(transaction_id) for transaction_id in transaction_ids],
+                return_exceptions=True,
+            )
+            outcomes = [
+                result if isinstance(result, TransactionSyncSchema) else "Server error"
+                for result in results
+            ]
+
+        synced = {
+            outcome.id: outcome
+            for outcome in outcomes
+            if isinstance(outcome, TransactionSyncSchema)
         }
+        failed = {
+            transaction_id: outcome
+            for transaction_id, outcome in zip(transaction_ids, outcomes)
+            if isinstance(outcome, str)
+        }
+        if len(synced) > 0:
+            db.execute(
+                update(TransactionSync),
+                [
+                    {
+                        "id": result.id,
+                        "status": result.status,
+                        "transfer_id": result.transfer_id,
+                        "invoice_id": result.invoice_id,
+                        "payment_id": result.payment_id,
+                        "expense_id": result.expense_id,
+                        "failure_reason": result.failure_reason or None,
+                    }
+                    for result in synced.values()
+                ],
+            )
+        if len(failed) > 0:
+            db.execute(
+                update(TransactionSync),
+                [
+                    {"id": transaction_id, "status": "failed", "failure_reason": reason}
+                    for transaction_id, reason in failed.items()
+                ],
+            )
+        db.commit()
+
+        by_id = dict(synced)
+        for row in db.scalars(
+            select(TransactionSync).where(TransactionSync.id.in_(failed))
+        ):
+            by_id[row.id] = TransactionSyncSchema.model_validate(
+                row, from_attributes=True
+            )
+    finally:
+        db.close()
+
+    transaction_syncs = [by_id[id] for id in transaction_ids if id in by_id]
+    await asyncio.gather(
+        *[
+            asyncio.to_thread(notify, user_id, transaction_sync)
+            for transaction_sync in transaction_syncs
+        ]
     )
+    return transaction_syncs
+
+
+def start_import_job(
+    db: Session,
+    user_id: int,
+    from_timestamp: Optional[int],
+    to_timestamp: Optional[int],
+) -> Tuple[ImportJob, bool]:
+    """Mark the user's import job as importing, and commit.
+
+    An unfinished job for the same dates resumes from its last page.
+
+    Returns:
+        Tuple[ImportJob, bool]: the job, and False if it was left as is
+        because it is still running"""
+    now = int(time.time())
+    job = db.get(ImportJob, user_id)
+    if (
+        job is not None
+        and job.status == "importing"
+        and now - job.updated_at < IMPORT_STALE_AFTER
+    ):
+        return job, False
+
+    if job is None:
+        job = ImportJob(user_id=user_id, imported=0, skipped=0)
+        db.add(job)
+
+    is_resumable = (
+        job.status != "done"
+        and job.from_timestamp == from_timestamp
+        and job.to_timestamp == to_timestamp
+    )
+    if not is_resumable:
+        job.from_timestamp = from_timestamp
+        job.to_timestamp = to_timestamp
+        job.starting_after = None
+        job.newest_created = None
+        job.newest_id = None
+        job.imported = 0
+        job.skipped = 0
+
+    job.status = "importing"
+    job.failure_reason = None
+    job.updated_at = now
     db.commit()
-    db.close()
+    return job, True
+
+
+@app.task(acks_late=True, reject_on_worker_lost=True)
+def import_transactions_worker(user_id: int):
+    get_event_loop().run_until_complete(import_transactions(user_id))
+
+
+async def import_transactions(user_id: int) -> None:
+    """Import a user's Stripe transactions one page at a time.
+
+    Starts from the cursor saved in the user's ImportJob, and saves it with
+    each page, so a failed or interrupted job picks up where it left off.
+    When done, moves the Stripe account's watermark to the newest transaction."""
+    db = SessionLocal()
+    try:
+        job = db.get(ImportJob, user_id)
+        user = db.get(User, user_id)
+        if job is None or user is None:
+            raise Exception("Import job is not set")
+
+        stripe_user_id = user.stripe_user_id
+        if stripe_user_id is None:
+            raise Exception("Stripe user id is not set")
+
+        while job.status == "importing":
+            try:
+                txns = await get_transactions_async(
+                    stripe_user_id,
+                    from_timestamp=job.from_timestamp,
+                    to_timestamp=job.to_timestamp,
+                    limit=IMPORT_PAGE_SIZE,
+                    starting_after=job.starting_after,
+                )
+                imported = insert_new_transactions(
+                    db,
+                    [
+                        TransactionSyncSchema(
+                            stripe_id=stripe_user_id,
+                            user_id=user_id,
+                            status="pending",
+                            **txn.model_dump(),
+                        )
+                        for txn in txns
+                    ],
+                )
+            except Exception as e:
+                db.rollback()
+                job.status = "failed"
+                job.failure_reason = str(e)
+            else:
+                job.imported += imported
+                job.skipped += len(txns) - imported
+                if job.newest_id is None and len(txns) > 0:
+                    job.newest_created = txns[0].created
+                    job.newest_id = txns[0].id
+                if len(txns) < IMPORT_PAGE_SIZE:
+                    job.status = "done"
+                    advance_watermark(db, stripe_user_id, job)
+                else:
+                    job.starting_after = txns[-1].id
+
+            job.updated_at = int(time.time())
+            db.commit()
+            await asyncio.to_thread(
+                notify_import, user_id, ImportJobSchema.model_validate(job)
+            )
+    finally:
+        db.close()
+
+
+@app.task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=WEBHOOK_IMPORT_MAX_RETRIES,
+)
+def import_new_transactions_worker(
+    self,
+    user_id: int,
+    transaction_ids: Optional[List[str]] = None,
+    event_id: Optional[str] = None,
+):
+    """Import the transactions of a Stripe webhook event, retrying with backoff
+    if it fails. If the last retry fails too, the event is forgotten, so that
+    it is imported if Stripe sends it again."""
+    try:
+        get_event_loop().run_until_complete(
+            import_new_transactions(user_id, transaction_ids)
+        )
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=backoff(self.request.retries, 5, 300))
+        if event_id is not None:
+            with SessionLocal() as db:
+                db.query(StripeEvent).filter(StripeEvent.id == event_id).delete()
+                db.commit()
+        raise
+
+
+def _imported_ids(db: Session, transaction_ids: Collection[str]) -> Set[str]:
+    return set(
+        db.scalars(
+            select(TransactionSync.id).where(TransactionSync.id.in_(transaction_ids))
+        )
+    )
+
+
+async def import_new_transactions(
+    user_id: int, transaction_ids: Optional[List[str]] = None
+) -> List[str]:
+    """Import the transactions reported by a Stripe webhook event, or, if
+    transaction_ids is None, every transaction from the Stripe account's
+    watermark on, which is moved to the newest one. Nothing is imported
+    without a watermark, rather than the account's whole history.
+
+    Queues them to be synced too if STRIPE_WEBHOOK_SYNC is true, through
+    dispatch_sync like any other sync, so they are marked syncing first.
+
+    Returns:
+        List[str]: ids of the transactions that weren't imported yet"""
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        if user is None:
+            raise Exception("User is not set")
+
+        stripe_user_id = user.stripe_user_id
+        if stripe_user_id is None:
+            raise Exception("Stripe user id is not set")
+
+        if transaction_ids is not None:
+            imported = _imported_ids(db, transaction_ids)
+            txns = await asyncio.gather(
+                *[
+                    get_transaction_async(transaction_id, account_id=stripe_user_id)
+                    for transaction_id in transaction_ids
+                    if transaction_id not in imported
+                ]
+            )
+        else:
+            watermark = db.get(ImportWatermark, stripe_user_id)
+            if watermark is None:
+                return []
+            # Not saved, only used to move the watermark
+            job = ImportJob(from_timestamp=watermark.created, to_timestamp=None)
+            txns = []
+            starting_after = None
+            while True:
+                page = await get_transactions_async(
+                    stripe_user_id,
+                    from_timestamp=watermark.created,
+                    limit=IMPORT_PAGE_SIZE,
+                    starting_after=starting_after,
+                )
+                if job.newest_id is None and len(page) > 0:
+                    job.newest_created = page[0].created
+                    job.newest_id = page[0].id
+                imported = _imported_ids(db, [txn.id for txn in page])
+                txns.extend(txn for txn in page if txn.id not in imported)
+                if len(page) < IMPORT_PAGE_SIZE:
+                    break
+                starting_after = page[-1].id
+
+        insert_new_transactions(
+            db,
+            [
+                TransactionSyncSchema(
+                    stripe_id=stripe_user_id,
+                    user_id=user_id,
+                    status="pending",
+                    **txn.model_dump(),
+                )
+                for txn in txns
+            ],
+        )
+        if transaction_ids is None:
+            advance_watermark(db, stripe_user_id, job)
+        db.commit()
 
+        new_ids = [txn.id for txn in txns]
+        if STRIPE_WEBHOOK_SYNC and len(new_ids) > 0:
+            dispatch_sync(db, user_id, new_ids)
+    finally:
+        db.close()
+
+    return new_ids
+
+
+def next_scheduled_run(user_id: int, interval_minutes: int, now: int) -> int:
+    """Time of a user's next scheduled sync after now.
+
+    Each user runs at their own offset within the interval, so that syncs
+    with the same interval are spread over it instead of starting together."""
+    interval = interval_minutes * 60
+    digest = hashlib.sha256(str(user_id).encode()).digest()
+    offset = int.from_bytes(digest[:8], "big") % interval
+    return now + interval - (now - offset) % interval
+
+
+@app.task
+def run_due_schedules() -> None:
+    """Start the scheduled syncs that are due, run by Celery beat.
+
+    Each schedule is claimed by moving its next run before its sync is
+    started, so that copies of this task running at the same time don't
+    start the same sync twice."""
+    now = int(time.time())
+    db = SessionLocal()
+    try:
+        due = db.execute(
+            select(
+                SyncSchedule.user_id,
+                SyncSchedule.interval_minutes,
+                SyncSchedule.next_run_at,
+            ).where(SyncSchedule.next_run_at <= now)
+        ).all()
+        for user_id, interval_minutes, next_run_at in due:
+            claimed = db.execute(
+                update(SyncSchedule)
+                .where(
+                    SyncSchedule.user_id == user_id,
+                    SyncSchedule.next_run_at == next_run_at,
+                )
+                .values(
+                    last_run_at=now,
+                    next_run_at=next_scheduled_run(user_id, interval_minutes, now),
+                )
+            )
+            db.commit()
+            if claimed.rowcount != 1:
+                continue  # claimed by another copy of this task
+
+            try:
+                scheduled_sync_worker.delay(user_id)
+            except Exception:
+                # Due again at the next check
+                db.execute(
+                    update(SyncSchedule)
+                    .where(SyncSchedule.user_id == user_id)
+                    .values(next_run_at=next_run_at)
+                )
+                db.commit()
+                raise
+    finally:
+        db.close()
+
+
+app.conf.beat_schedule = {
+    "run-due-schedules": {
+        "task": run_due_schedules.name,
+        "schedule": SCHEDULE_CHECK_INTERVAL,
+    },
+    "resume-sync-next": {
+        "task": resume_sync_next.name,
+        "schedule": SCHEDULE_CHECK_INTERVAL,
+    },
+}
+
+
+@app.task
+def scheduled_sync_worker(user_id: int):
+    get_event_loop().run_until_complete(scheduled_sync(user_id))
+
+
+async def scheduled_sync(user_id: int) -> None:
+    """Import a user's new transactions, then sync every pending one.
+
+    The import starts at the Stripe account's watermark, or at the schedule's
+    from_timestamp. The run is skipped if there is neither, rather than
+    importing and syncing the account's whole history. If the user's own
+    import is running, only the pending transactions are synced."""
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        if user is None or user.stripe_user_id is None:
+            raise Exception("Stripe user id is not set")
+
+        schedule = db.get(SyncSchedule, user_id)
+        watermark = db.get(ImportWatermark, user.stripe_user_id)
+        if schedule is not None and schedule.from_timestamp is not None:
+            from_timestamp = incremental_from_timestamp(
+                db, user.stripe_user_id, schedule.from_timestamp
+            )
+        elif watermark is not None:
+            from_timestamp = watermark.created
+        else:
+            return
+        _, started = start_import_job(db, user_id, from_timestamp, None)
+    finally:
+        db.close()
+
+    if started:
+        await import_transactions(user_id)
+
+    db = SessionLocal()
+    try:
+        pending = list(
+            db.scalars(
+                select(TransactionSync.id).where(
+                    TransactionSync.user_id == user_id,
+                    TransactionSync.status == "pending",
+                )
+            )
+        )
+        if len(pending) > 0:
+            dispatch_sync(db, user_id, pending)
+    finally:
+        db.close()
+
+
+def _post_signed(path: str, user_id: int, body: BaseModel) -> None:
+    data = body.model_dump_json()
     sig = hmac.new(
         os.environ["SECRET_KEY"].encode(),
-        transaction_sync.model_dump_json().encode(),
+        data.encode(),
         hashlib.sha256,
     ).hexdigest()
 
@@ -75,11 +701,17 @@ async def sync_transaction(transaction_id: str, user_id: int):
     try:
         request(
             "POST",
-            f"{PROTOCOL}://{HOST}/api/sync/notify?user_id={user_id}",
+            f"{PROTOCOL}://{HOST}/api/{path}?user_id={user_id}",
             headers={"X-Signature": sig},
-            data=transaction_sync.model_dump_json(),
+            data=data,
         )
     except Exception as e:
         print("Failed to notify", e)
 
-    return "ok"
+
+def notify(user_id: int, transaction_sync: TransactionSyncSchema) -> None:
+    _post_signed("sync/notify", user_id, transaction_sync)
+
+
+def notify_import(user_id: int, import_job: ImportJobSchema) -> None:
+    _post_signed("sync/notify/import", user_id, import_job)